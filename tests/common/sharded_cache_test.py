@@ -16,22 +16,26 @@
 """Tests for sharded_cache.py."""
 
 import cPickle as pickle
+import os
+import zlib
 from google.appengine.api import memcache
 from google.appengine.ext import testbed
+from mox import stubout
 from titan.common.lib.google.apputils import basetest
 from titan.common import sharded_cache
+from titan import stats
 
 MAX_VALUE_SIZE = memcache.MAX_VALUE_SIZE
 
 # 1KB -- Should be packed with the shard_map entry and use 0 real shards.
 SMALL_CONTENT = 'a' * 1000
 
-# 2MB -- Will be slightly >2MB when pickled, so should be in 3 shards.
-LARGE_CONTENT = 'b' * MAX_VALUE_SIZE * 2
-LARGE_CONTENT_PICKLED = pickle.dumps(LARGE_CONTENT)
+# 2MB of incompressible bytes -- Shards also hold a generation id, so should be
+# in 3 shards.
+LARGE_CONTENT = os.urandom(MAX_VALUE_SIZE * 2)
 
 # 40MB -- Larger than the 32 MiB set_multi max.
-LARGEST_CONTENT = 'c' * MAX_VALUE_SIZE * 40
+LARGEST_CONTENT = os.urandom(MAX_VALUE_SIZE * 40)
 
 class ShardedCacheTest(basetest.TestCase):
 
@@ -39,8 +43,13 @@ class ShardedCacheTest(basetest.TestCase):
     self.testbed = testbed.Testbed()
     self.testbed.activate()
     self.testbed.init_memcache_stub()
+    self.stubs = stubout.StubOutForTesting()
+    # Only testStats records stats.
+    self.stubs.Set(sharded_cache, 'STATS_SAMPLE_RATE', 0)
+    sharded_cache._hot_keys.clear()
 
   def tearDown(self):
+    self.stubs.UnsetAll()
     self.testbed.deactivate()
 
   def testGet(self):
@@ -64,11 +73,23 @@ class ShardedCacheTest(basetest.TestCase):
     sharded_cache.Set('foo', LARGE_CONTENT)
     memcache.delete(sharded_cache.MEMCACHE_PREFIX + 'foo1')
     self.assertEqual(None, sharded_cache.Get('foo'))
-    # The shard map and unevicted shards should be deleted.
-    cache_keys = ['foo', 'foo0', 'foo1', 'foo2', 'foo3']
-    memcache_keys = [sharded_cache.MEMCACHE_PREFIX + key for key in cache_keys]
-    content = memcache.get_multi(memcache_keys)
-    self.assertFalse(any(content))
+    # Only the shard map should be deleted.
+    self.assertIsNone(memcache.get(sharded_cache.MEMCACHE_PREFIX + 'foo'))
+    self.assertTrue(memcache.get(sharded_cache.MEMCACHE_PREFIX + 'foo0'))
+
+    # Shards of another value are never stitched together.
+    sharded_cache.Set('foo', LARGE_CONTENT)
+    old_shard = memcache.get(sharded_cache.MEMCACHE_PREFIX + 'foo1')
+    sharded_cache.Set('foo', os.urandom(MAX_VALUE_SIZE * 2))
+    memcache.set(sharded_cache.MEMCACHE_PREFIX + 'foo1', old_shard)
+    self.assertEqual(None, sharded_cache.Get('foo'))
+
+    # Corrupt shards fail the checksum.
+    sharded_cache.Set('foo', LARGE_CONTENT)
+    shard_map = memcache.get(sharded_cache.MEMCACHE_PREFIX + 'foo')
+    memcache.set(sharded_cache.MEMCACHE_PREFIX + 'foo1',
+                 shard_map['generation'] + 'x' * 100)
+    self.assertEqual(None, sharded_cache.Get('foo'))
 
     # All content shards were evicted.
     sharded_cache.Set('foo', LARGE_CONTENT)
@@ -77,12 +98,41 @@ class ShardedCacheTest(basetest.TestCase):
     memcache.delete_multi(memcache_keys)
     self.assertEqual(None, sharded_cache.Get('foo'))
 
+  def testGetRoundTrips(self):
+    get_multi_calls = []
+    original_get_multi = memcache.get_multi
+    def CountingGetMulti(keys, *args, **kwargs):
+      get_multi_calls.append(keys)
+      return original_get_multi(keys, *args, **kwargs)
+    self.stubs.Set(memcache, 'get_multi', CountingGetMulti)
+
+    # Values of up to PREFETCH_SHARDS shards take a single round trip.
+    sharded_cache.Set('foo', LARGE_CONTENT)
+    self.assertEqual(LARGE_CONTENT, sharded_cache.Get('foo'))
+    self.assertEqual(1, len(get_multi_calls))
+
+    # Larger values fetch the remaining shards in a second one.
+    self.stubs.Set(sharded_cache, 'PREFETCH_SHARDS', 2)
+    get_multi_calls[:] = []
+    self.assertEqual(LARGE_CONTENT, sharded_cache.Get('foo'))
+    self.assertEqual(2, len(get_multi_calls))
+    self.assertEqual([sharded_cache.MEMCACHE_PREFIX + 'foo2'],
+                     get_multi_calls[1])
+
+    # Leftover shards of a larger previous value are never prefetched.
+    sharded_cache.Set('foo', SMALL_CONTENT)
+    memcache_keys = [sharded_cache.MEMCACHE_PREFIX + key
+                     for key in ('foo0', 'foo1')]
+    self.assertDictEqual({}, original_get_multi(memcache_keys))
+    self.assertEqual(SMALL_CONTENT, sharded_cache.Get('foo'))
+
   def testSet(self):
     # Set object smaller than 1MB.
     sharded_cache.Set('foo', SMALL_CONTENT)
     shard_map = memcache.get(sharded_cache.MEMCACHE_PREFIX + 'foo')
     self.assertEqual(0, shard_map['num_shards'])
-    self.assertEqual(SMALL_CONTENT, pickle.loads(shard_map['content']))
+    self.assertEqual('raw', shard_map['encoding'])
+    self.assertEqual(SMALL_CONTENT, shard_map['content'])
     first_shard = memcache.get(sharded_cache.MEMCACHE_PREFIX + 'foo0')
     self.assertEqual(None, first_shard)
 
@@ -94,13 +144,15 @@ class ShardedCacheTest(basetest.TestCase):
     content = memcache.get_multi(memcache_keys)
     self.assertEqual(3, shard_map['num_shards'])
     keys = ['%sfoo%d' % (sharded_cache.MEMCACHE_PREFIX, i) for i in xrange(3)]
+    generation = shard_map['generation']
+    shard_size = sharded_cache._SHARD_SIZE
     expected_content_shards = {
         # 0 to 1MB.
-        keys[0]: LARGE_CONTENT_PICKLED[0:MAX_VALUE_SIZE],
+        keys[0]: generation + LARGE_CONTENT[0:shard_size],
         # 1MB to 2MB.
-        keys[1]: LARGE_CONTENT_PICKLED[MAX_VALUE_SIZE:MAX_VALUE_SIZE * 2],
+        keys[1]: generation + LARGE_CONTENT[shard_size:shard_size * 2],
         # 2MB to end.
-        keys[2]: LARGE_CONTENT_PICKLED[MAX_VALUE_SIZE * 2:],
+        keys[2]: generation + LARGE_CONTENT[shard_size * 2:],
     }
     self.assertDictEqual(expected_content_shards, content)
     next_shard = memcache.get(sharded_cache.MEMCACHE_PREFIX + 'foo3')
@@ -116,6 +168,29 @@ class ShardedCacheTest(basetest.TestCase):
     self.assertEqual(None, sharded_cache.Get('foo'))
     self.assertDictEqual({}, content)
 
+  def testEncoding(self):
+    prefix = sharded_cache.MEMCACHE_PREFIX
+
+    # Compressible bytes are stored compressed, here in a single entry.
+    content = 'b' * MAX_VALUE_SIZE * 2
+    sharded_cache.Set('foo', content)
+    shard_map = memcache.get(prefix + 'foo')
+    self.assertEqual('zlib', shard_map['encoding'])
+    self.assertEqual(0, shard_map['num_shards'])
+    self.assertEqual(content, zlib.decompress(shard_map['content']))
+    self.assertEqual(content, sharded_cache.Get('foo'))
+
+    # Other values are pickled.
+    for value in (u'\xe9' * 2000, {'foo': [1, 2]}, None):
+      sharded_cache.Set('foo', value)
+      self.assertEqual('pickle', memcache.get(prefix + 'foo')['encoding'])
+      self.assertEqual(value, sharded_cache.Get('foo'))
+
+    # Entries without an encoding are unpickled.
+    memcache.set(prefix + 'foo',
+                 {'num_shards': 0, 'content': pickle.dumps(SMALL_CONTENT)})
+    self.assertEqual(SMALL_CONTENT, sharded_cache.Get('foo'))
+
   def testDelete(self):
     # Delete small content with no sharding.
     sharded_cache.Set('foo', SMALL_CONTENT)
@@ -134,6 +209,183 @@ class ShardedCacheTest(basetest.TestCase):
     self.assertEqual(None, sharded_cache.Get('foo'))
     self.assertDictEqual({}, content)
 
+  def testMultiKeyMethods(self):
+    rpcs = []
+    for method_name in ('get', 'get_multi', 'set_multi', 'delete_multi'):
+      self.stubs.Set(memcache, method_name, self._MakeCountingMethod(
+          rpcs, method_name, getattr(memcache, method_name)))
+
+    # New keys leave nothing stale to delete.
+    mapping = {'foo': SMALL_CONTENT, 'bar': LARGE_CONTENT, 'baz': 'baz'}
+    self.assertEqual([], sharded_cache.SetMulti(mapping))
+    self.assertEqual(['get_multi', 'set_multi'], rpcs)
+
+    # Neither do overwrites of values without replicas or extra shards.
+    rpcs[:] = []
+    sharded_cache.Set('baz', 'baz')
+    self.assertEqual(['get', 'set_multi'], rpcs)
+
+    # Values of all sizes come back with a single get_multi.
+    rpcs[:] = []
+    self.assertDictEqual(
+        mapping, sharded_cache.GetMulti(['foo', 'bar', 'baz', 'missing']))
+    self.assertEqual(['get_multi'], rpcs)
+    self.assertEqual(LARGE_CONTENT, sharded_cache.Get('bar'))
+
+    # Evicted entries are misses, and are cleaned up in one delete_multi.
+    memcache.delete(sharded_cache.MEMCACHE_PREFIX + 'bar1')
+    rpcs[:] = []
+    self.assertDictEqual({'foo': SMALL_CONTENT, 'baz': 'baz'},
+                         sharded_cache.GetMulti(['foo', 'bar', 'baz']))
+    self.assertEqual(['get_multi', 'delete_multi'], rpcs)
+    self.assertIsNone(memcache.get(sharded_cache.MEMCACHE_PREFIX + 'bar'))
+
+    # Deletes take one get_multi and one delete_multi.
+    sharded_cache.Set('bar', LARGE_CONTENT)
+    rpcs[:] = []
+    self.assertTrue(sharded_cache.DeleteMulti(['foo', 'bar', 'baz']))
+    self.assertEqual(['get_multi', 'delete_multi'], rpcs)
+    self.assertDictEqual({}, sharded_cache.GetMulti(['foo', 'bar', 'baz']))
+    self.assertIsNone(memcache.get(sharded_cache.MEMCACHE_PREFIX + 'bar0'))
+
+    # Values which cannot be set are reported and cleaned up.
+    failed_keys = sharded_cache.SetMulti(
+        {'foo': SMALL_CONTENT, 'huge': LARGEST_CONTENT})
+    self.assertIn('huge', failed_keys)
+    self.assertIsNone(memcache.get(sharded_cache.MEMCACHE_PREFIX + 'huge'))
+
+  def _MakeCountingMethod(self, rpcs, method_name, method):
+    def CountingMethod(*args, **kwargs):
+      rpcs.append(method_name)
+      return method(*args, **kwargs)
+    return CountingMethod
+
+  def testAsyncMethods(self):
+    futures = [
+        sharded_cache.SetAsync('foo', SMALL_CONTENT),
+        sharded_cache.SetAsync('bar', LARGE_CONTENT),
+    ]
+    self.assertEqual([True, True], [future.get_result() for future in futures])
+
+    futures = [sharded_cache.GetAsync(key) for key in ('foo', 'bar', 'baz')]
+    self.assertEqual([SMALL_CONTENT, LARGE_CONTENT, None],
+                     [future.get_result() for future in futures])
+    self.assertEqual(LARGE_CONTENT, sharded_cache.Get('bar'))
+
+    # Evicted shards are a miss.
+    memcache.delete(sharded_cache.MEMCACHE_PREFIX + 'bar1')
+    self.assertIsNone(sharded_cache.GetAsync('bar').get_result())
+
+    sharded_cache.Set('bar', LARGE_CONTENT)
+    self.assertTrue(sharded_cache.DeleteAsync('bar').get_result())
+    self.assertIsNone(sharded_cache.Get('bar'))
+    self.assertIsNone(memcache.get(sharded_cache.MEMCACHE_PREFIX + 'bar0'))
+
+  def testStats(self):
+    logged_counters = {}
+    def LogCounters(counters, counters_func):
+      self.assertEqual([], counters_func())
+      for counter in counters:
+        logged_counters[counter.name] = counter.finalize()
+    self.stubs.Set(stats, 'log_counters', LogCounters)
+
+    # Unsampled operations are not recorded.
+    sharded_cache.Set('foo', SMALL_CONTENT)
+    self.assertEqual({}, logged_counters)
+
+    # Counts of sampled operations are scaled up.
+    self.stubs.Set(sharded_cache, 'STATS_SAMPLE_RATE', 0.5)
+    self.stubs.Set(sharded_cache.random, 'random', lambda: 0.0)
+    sharded_cache.Set('foo', SMALL_CONTENT, caller='test')
+    sharded_cache.Get('foo', caller='test')
+    sharded_cache.Get('bar', caller='test')
+    sharded_cache.Delete('foo')
+    self.assertEqual(2, logged_counters['sharded_cache/test/set'])
+    self.assertEqual(2000, logged_counters['sharded_cache/test/set/bytes'])
+    self.assertEqual(2, logged_counters['sharded_cache/test/get/hit'])
+    self.assertEqual(2, logged_counters['sharded_cache/test/get/miss'])
+    self.assertEqual(2, logged_counters['sharded_cache/default/delete'])
+    self.assertEqual(
+        1, logged_counters['sharded_cache/test/get/latency'][1])
+
+    # Partial evictions and failed sets are counted.
+    sharded_cache.Set('foo', LARGE_CONTENT, caller='test')
+    memcache.delete(sharded_cache.MEMCACHE_PREFIX + 'foo1')
+    sharded_cache.Get('foo', caller='test')
+    self.assertEqual(2, logged_counters['sharded_cache/test/get/evicted'])
+    sharded_cache.Set('foo', LARGEST_CONTENT, caller='test')
+    self.assertEqual(2, logged_counters['sharded_cache/test/set/failed'])
+
+    # Async operations are recorded the same way.
+    sharded_cache.SetAsync('foo', SMALL_CONTENT, caller='async').get_result()
+    sharded_cache.GetAsync('foo', caller='async').get_result()
+    sharded_cache.DeleteAsync('foo', caller='async').get_result()
+    self.assertEqual(2, logged_counters['sharded_cache/async/set'])
+    self.assertEqual(2, logged_counters['sharded_cache/async/get/hit'])
+    self.assertEqual(2, logged_counters['sharded_cache/async/delete'])
+
+  def testHotKeys(self):
+    prefix = sharded_cache.MEMCACHE_PREFIX
+
+    # Explicit replicas, including for sharded content.
+    sharded_cache.Set('foo', LARGE_CONTENT, replicas=3)
+    self.assertEqual(3, memcache.get(prefix + 'foo')['replicas'])
+    for replica in ('foo@1:', 'foo@2:'):
+      self.assertEqual(3, memcache.get(prefix + replica)['num_shards'])
+    self.assertIsNone(memcache.get(prefix + 'foo@3:'))
+    for _ in range(10):
+      self.assertEqual(LARGE_CONTENT, sharded_cache.Get('foo'))
+    self.assertEqual(3, sharded_cache._hot_keys[prefix + 'foo'][0])
+
+    # Set fans out invalidations to every replica.
+    sharded_cache.Set('foo', SMALL_CONTENT)
+    self.assertIsNone(memcache.get(prefix + 'foo@1:'))
+    for _ in range(10):
+      self.assertEqual(SMALL_CONTENT, sharded_cache.Get('foo'))
+    self.assertNotIn(prefix + 'foo', sharded_cache._hot_keys)
+
+    # Sampled reads detect hot keys and replicate them.
+    self.stubs.Set(sharded_cache, 'HOT_KEY_SAMPLE_RATE', 1.0)
+    self.stubs.Set(sharded_cache, 'HOT_KEY_SAMPLED_READS', 3)
+    self.stubs.Set(sharded_cache, 'HOT_KEY_WINDOW_SECONDS', 10 ** 9)
+    sharded_cache.Set('bar', SMALL_CONTENT)
+    sharded_cache.Get('bar')
+    sharded_cache.Get('bar')
+    self.assertIsNone(memcache.get(prefix + 'bar@1:'))
+    sharded_cache.Get('bar')
+    shard_map = memcache.get(prefix + 'bar')
+    self.assertEqual(sharded_cache.HOT_KEY_REPLICAS, shard_map['replicas'])
+    self.assertEqual(
+        SMALL_CONTENT, memcache.get(prefix + 'bar@1:')['content'])
+    self.assertEqual(SMALL_CONTENT, sharded_cache.Get('bar'))
+
+    # Values replaced since they were read are not replicated.
+    sharded_cache.Set('baz', SMALL_CONTENT)
+    read_shard_map = memcache.get(prefix + 'baz')
+    sharded_cache.Set('baz', 'baz')
+    sharded_cache._ReplicateHotKey(
+        prefix + 'baz', read_shard_map, SMALL_CONTENT)
+    self.assertIsNone(memcache.get(prefix + 'baz@1:'))
+    self.assertNotIn('replicas', memcache.get(prefix + 'baz'))
+
+    # Deletes only fan out to the replicas recorded in the shard map...
+    sharded_cache.Set('foo', SMALL_CONTENT, replicas=2)
+    shard_maps = memcache.get_multi([prefix + 'foo'])
+    self.assertEqual([prefix + 'foo', prefix + 'foo@1:'],
+                     sharded_cache._DeleteKeys([prefix + 'foo'], shard_maps))
+    self.assertTrue(sharded_cache.DeleteMulti(['foo']))
+    self.assertIsNone(memcache.get(prefix + 'foo@1:'))
+    # ...or to every possible replica if the shard map is gone.
+    self.assertEqual(
+        sharded_cache.MAX_HOT_KEY_REPLICAS,
+        len(sharded_cache._DeleteKeys([prefix + 'missing'], {})))
+
+    # Delete removes all replicas, even if the original was evicted.
+    memcache.delete(prefix + 'bar')
+    sharded_cache.Delete('bar')
+    self.assertIsNone(memcache.get(prefix + 'bar@1:'))
+    self.assertIsNone(sharded_cache.Get('bar'))
+
   def testMaxValueSize(self):
     # If memcache max value size ever changes, I want to know.
     self.assertEqual(1000000, MAX_VALUE_SIZE)
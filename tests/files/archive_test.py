@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for archive.py."""
+
+from tests.common import testing
+
+import cStringIO
+import datetime
+import tarfile
+from google.appengine.ext import blobstore
+from titan.common.lib.google.apputils import basetest
+from titan import files
+from titan import users
+from titan.files import archive
+from titan.files import dirs
+
+# Content larger than the arbitrary max content size.
+LARGE_FILE_CONTENT = 'a' * (files.MAX_CONTENT_SIZE + 1)
+
+class ArchiveTest(testing.BaseTestCase):
+
+  def setUp(self):
+    super(ArchiveTest, self).setUp()
+    created = datetime.datetime(2013, 1, 2, 3, 4, 5, 6)
+    files.File('/site/a.html').write(
+        'a', mime_type='text/html', meta={'color': 'blue', 'flag': True},
+        created=created, created_by=users.TitanUser('foo@example.com'))
+    files.File('/site/b/c.txt').write(u'\xe9')
+    files.File('/site/b/large').write(LARGE_FILE_CONTENT)
+    files.File('/other/d').write('d')
+
+  def testExportArchive(self):
+    fileobj = cStringIO.StringIO()
+    self.assertEqual(3, archive.export_archive('/site', fileobj))
+    fileobj.seek(0)
+    tar = tarfile.open(fileobj=fileobj, mode='r:gz')
+    self.assertEqual(
+        ['site/a.html', 'site/b/c.txt', 'site/b/large'],
+        sorted(tar.getnames()))
+    tarinfo = tar.getmember('site/a.html')
+    self.assertEqual('text/html', tarinfo.pax_headers['TITAN.mime_type'])
+    self.assertEqual('foo@example.com',
+                     tarinfo.pax_headers['TITAN.created_by'])
+    self.assertEqual(LARGE_FILE_CONTENT,
+                     tar.extractfile('site/b/large').read())
+
+    # Non-recursive.
+    fileobj = cStringIO.StringIO()
+    self.assertEqual(
+        1, archive.export_archive('/site', fileobj, recursive=False))
+
+  def testExportToBlobstore(self):
+    blob_key, num_files = archive.export_to_blobstore('/site')
+    self.assertEqual(3, num_files)
+    content = blobstore.BlobReader(blob_key).read()
+    tar = tarfile.open(fileobj=cStringIO.StringIO(content), mode='r:gz')
+    self.assertEqual(3, len(tar.getnames()))
+
+  def testDeferExportToBlobstore(self):
+    job = archive.defer_export_to_blobstore(
+        '/site', blob_expiration_seconds=60)
+    self.assertEqual(files.JOB_STATUS_RUNNING, job.status)
+    self.RunDeferredTasks()
+    job.refresh()
+    self.assertEqual(files.JOB_STATUS_SUCCESSFUL, job.status)
+    self.assertEqual(3, job.num_processed)
+    content = blobstore.BlobReader(job.blob_key).read()
+    tar = tarfile.open(fileobj=cStringIO.StringIO(content), mode='r:gz')
+    self.assertEqual(3, len(tar.getnames()))
+
+    # The blob expires in a task.
+    self.RunDeferredTasks()
+    self.assertIsNone(blobstore.BlobInfo.get(job.blob_key))
+
+    self.assertRaises(
+        ValueError, archive.defer_export_to_blobstore, '/site', depth=0)
+
+  def testImportArchive(self):
+    fileobj = cStringIO.StringIO()
+    archive.export_archive('/site', fileobj)
+    fileobj.seek(0)
+
+    paths = archive.import_archive(
+        fileobj, dir_path='/restored', namespace='aaa', batch_size=2)
+    self.assertEqual(
+        ['/restored/site/a.html', '/restored/site/b/c.txt',
+         '/restored/site/b/large'],
+        sorted(paths))
+
+    source = files.File('/site/a.html')
+    titan_file = files.File('/restored/site/a.html', namespace='aaa')
+    self.assertEqual('a', titan_file.content)
+    self.assertEqual('text/html', titan_file.mime_type)
+    self.assertEqual('blue', titan_file.meta.color)
+    self.assertTrue(titan_file.meta.flag)
+    self.assertEqual(source.created, titan_file.created)
+    self.assertEqual(source.modified, titan_file.modified)
+    self.assertEqual('foo@example.com', titan_file.created_by.email)
+    self.assertEqual(source.md5_hash, titan_file.md5_hash)
+    self.assertEqual(
+        u'\xe9', files.File('/restored/site/b/c.txt', namespace='aaa').content)
+    large_file = files.File('/restored/site/b/large', namespace='aaa')
+    self.assertTrue(large_file.blob)
+    self.assertEqual(LARGE_FILE_CONTENT, large_file.content)
+
+    # Imports are recorded in the change journal.
+    changes, _, _ = files.Files.changes_since(namespace='aaa', settle_seconds=0)
+    self.assertEqual(sorted(paths), sorted(c.path for c in changes))
+    self.assertEqual(source.md5_hash, [c.md5_hash for c in changes
+                                       if c.path == '/restored/site/a.html'][0])
+
+    # Directories were created in batches.
+    self.assertEqual(
+        dirs.Dirs(['/restored/site/b'], namespace='aaa'),
+        dirs.Dirs.list('/restored/site', namespace='aaa'))
+
+    # Importing again overwrites the files and cleans up replaced blobs.
+    old_blob_key = large_file.blob.key()
+    fileobj.seek(0)
+    archive.import_archive(fileobj, dir_path='/restored', namespace='aaa')
+    self.assertIsNone(blobstore.get(old_blob_key))
+    self.assertEqual(
+        LARGE_FILE_CONTENT,
+        files.File('/restored/site/b/large', namespace='aaa').content)
+
+    self.assertRaises(
+        archive.InvalidArchiveError,
+        archive.import_archive, cStringIO.StringIO('not an archive'))
+
+if __name__ == '__main__':
+  basetest.main()
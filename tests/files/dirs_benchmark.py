@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of computing affected dirs for large modification batches.
+
+Not collected by runtests.py. Run directly, with the same PYTHONPATH:
+  PYTHONPATH=tests:. python tests/files/dirs_benchmark.py
+"""
+
+from tests.common import testing
+
+import time
+
+from titan.common.lib.google.apputils import basetest
+from titan.common import utils
+from titan.files import dirs
+
+NUM_PATHS = 10000
+NUM_RUNS = 5
+
+def _make_modified_paths(depth):
+  """Makes NUM_PATHS modifications spread over a tree of the given depth."""
+  modified_paths = []
+  for i in range(NUM_PATHS):
+    # Ten children per level, so deep levels share most ancestors.
+    dir_path = ''.join('/d%d' % (i // 10 ** level % 10)
+                       for level in range(depth))
+    action = dirs.ModifiedPath.DELETE if i % 3 else dirs.ModifiedPath.WRITE
+    modified_paths.append(dirs.ModifiedPath(
+        '%s/file%d' % (dir_path, i), namespace=None, modified=i,
+        action=action))
+  return modified_paths
+
+def _compute_with_split_path(modified_paths):
+  """The previous approach: union a new split_path set for each path."""
+  dirs_with_adds = set()
+  dirs_with_deletes = set()
+  for modified_path in modified_paths:
+    current_dirs = utils.split_path(modified_path.path)
+    if modified_path.action == dirs.ModifiedPath.WRITE:
+      dirs_with_adds = dirs_with_adds.union(set(current_dirs))
+    else:
+      dirs_with_deletes = dirs_with_deletes.union(set(current_dirs))
+  return dirs_with_adds, dirs_with_deletes
+
+def _time_ms(func, *args):
+  start = time.time()
+  for _ in range(NUM_RUNS):
+    func(*args)
+  return 1000 * (time.time() - start) / NUM_RUNS
+
+class ComputeAffectedDirsBenchmark(testing.BaseTestCase):
+
+  def testComputeAffectedDirs(self):
+    dir_service = dirs.DirService()
+    print
+    print '%-6s %-10s %-18s %s' % (
+        'Depth', 'Num dirs', 'split_path (ms)', 'compute_affected_dirs (ms)')
+    for depth in (1, 4, 8, 16):
+      modified_paths = _make_modified_paths(depth)
+      affected_dirs = dir_service.compute_affected_dirs(modified_paths)
+      num_dirs = len(affected_dirs['dirs_with_adds'] |
+                     affected_dirs['dirs_with_deletes'])
+      print '%-6d %-10d %-18.1f %.1f' % (
+          depth, num_dirs,
+          _time_ms(_compute_with_split_path, modified_paths),
+          _time_ms(dir_service.compute_affected_dirs, modified_paths))
+
+if __name__ == '__main__':
+  basetest.main()
@@ -18,7 +18,11 @@
 from tests.common import testing
 
 import datetime
+import hashlib
+import json
 import time
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from titan.common.lib.google.apputils import basetest
 from titan import files
 from titan.files import dirs
@@ -97,6 +101,106 @@ class DirManagerTest(testing.BaseTestCase):
     titan_dirs = dirs.Dirs(dirs=titan_dirs.values())
     self.assertEqual('/b', titan_dirs['/b'].path)
 
+  def testLoad(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+    files.File('/a/b/foo').write('')
+    files.File('/a/c/foo').write('')
+    dirs.Dir('/a/b').set_meta({'flag': True})
+    files.File('/a/c/foo').delete()
+
+    # Deleted and non-existent dirs are dropped in one get_multi.
+    titan_dirs = dirs.Dirs(['/a/b', '/a/c', '/fake']).load()
+    self.assertEqual(['/a/b'], titan_dirs.keys())
+    self.assertTrue(titan_dirs['/a/b'].meta.flag)
+
+    # Loaded listings don't need any more gets.
+    self.mox.StubOutWithMock(dirs._TitanDir, 'get_by_id')
+    self.mox.ReplayAll()
+    titan_dirs = dirs.Dirs.list('/a', load=True)
+    self.assertEqual(['/a/b'], titan_dirs.keys())
+    self.assertTrue(titan_dirs['/a/b'].meta.flag)
+    self.assertTrue(titan_dirs['/a/b'].exists)
+    titan_dirs = dirs.Dirs.list('/a', load=True, strip_prefix='/a')
+    self.assertEqual(['/b'], titan_dirs.keys())
+    self.mox.VerifyAll()
+
+  def testDirsListCache(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+    files.File('/a/b/foo').write('')
+    files.File('/a/c/foo').write('')
+    self.assertEqual(['/a/b', '/a/c'],
+                     sorted(dirs.Dirs.list('/a', cache=True).keys()))
+
+    # Cached listings are served without a query.
+    self.mox.StubOutWithMock(dirs, '_make_subdirs_query')
+    self.mox.ReplayAll()
+    self.assertEqual(['/a/b', '/a/c'],
+                     sorted(dirs.Dirs.list('/a', cache=True).keys()))
+    self.assertEqual(1, len(dirs.Dirs.list('/a', limit=1, cache=True)))
+    titan_dirs = dirs.Dirs.list('/a', load=True, cache=True)
+    self.assertEqual(['/a/b', '/a/c'], sorted(titan_dirs.keys()))
+    self.mox.VerifyAll()
+    self.mox.UnsetStubs()
+
+    # Status changes invalidate the parent's listing.
+    files.File('/a/c/foo').delete()
+    self.assertEqual(['/a/b'], dirs.Dirs.list('/a', cache=True).keys())
+    files.File('/a/d/foo').write('')
+    self.assertEqual(['/a/b', '/a/d'],
+                     sorted(dirs.Dirs.list('/a', cache=True).keys()))
+
+    # A reader which queried before an invalidation can't cache its result
+    # for later readers.
+    stale_cache_key = dirs._get_dir_listing_memcache_key('/a')
+    dirs._clear_dir_listings(['/a'])
+    memcache.set(stale_cache_key, ['/a/stale'])
+    self.assertEqual(['/a/b', '/a/d'],
+                     sorted(dirs.Dirs.list('/a', cache=True).keys()))
+
+    # Listings are only read from the cache when asked for.
+    memcache.set(dirs._get_dir_listing_memcache_key('/a'), ['/a/stale'])
+    self.assertEqual(['/a/b', '/a/d'], sorted(dirs.Dirs.list('/a').keys()))
+
+  def testWalk(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+    for path in ('/a/b/c/foo', '/a/d/foo', '/a/b/e/foo', '/f/foo'):
+      files.File(path).write('')
+
+    walked = [(path, titan_dirs.keys())
+              for path, titan_dirs in dirs.Dirs.walk('/a', page_size=2)]
+    expected = [
+        ('/a', ['/a/b', '/a/d']),
+        ('/a/b', ['/a/b/c', '/a/b/e']),
+        ('/a/b/c', []),
+        ('/a/b/e', []),
+        ('/a/d', []),
+    ]
+    self.assertEqual(expected, walked)
+
+    # Limit depth.
+    walked = [(path, titan_dirs.keys())
+              for path, titan_dirs in dirs.Dirs.walk('/', depth=2)]
+    expected = [
+        ('/', ['/a', '/f']),
+        ('/a', ['/a/b', '/a/d']),
+        ('/f', []),
+    ]
+    self.assertEqual(expected, walked)
+    walked = [(path, titan_dirs.keys())
+              for path, titan_dirs in dirs.Dirs.walk('/a/', depth=1)]
+    self.assertEqual([('/a', ['/a/b', '/a/d'])], walked)
+    self.assertRaises(ValueError, lambda: list(dirs.Dirs.walk('/', depth=0)))
+
+    # Deleted dirs and other namespaces are not walked.
+    files.File('/a/b/c/foo').delete()
+    files.File('/a/z/foo', namespace='aaa').write('')
+    walked = [(path, titan_dirs.keys())
+              for path, titan_dirs in dirs.Dirs.walk('/a/b')]
+    self.assertEqual([('/a/b', ['/a/b/e']), ('/a/b/e', [])], walked)
+    walked = dict(dirs.Dirs.walk('/a', namespace='aaa'))
+    self.assertEqual(['/a/z'], walked['/a'].keys())
+    self.assertEqual('aaa', walked['/a']['/a/z'].namespace)
+
   def testModifiedPath(self):
     # Test serialize().
     now = datetime.datetime.now()
@@ -180,6 +284,93 @@ class DirManagerTest(testing.BaseTestCase):
     }
     self.assertEqual(expected_affected_dirs, affected_dirs)
 
+  def testUpdateAffectedDirs(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+    for path in ('/a/b/foo', '/a/c/foo', '/a/d/e/foo', '/f/foo'):
+      files.File(path, namespace='aaa').write('')
+    files.File('/a/b/foo').write('')
+
+    # Delete files without the mixin, then update dirs in one batch.
+    files.unregister_file_factory()
+    modified_paths = []
+    for path in ('/a/b/foo', '/a/c/foo', '/a/d/e/foo'):
+      files.File(path, namespace='aaa').delete()
+      modified_paths.append(dirs.ModifiedPath(
+          path, namespace='aaa', modified=0, action=PATH_DELETE_ACTION))
+    dir_service = dirs.DirService()
+    affected_dirs = dir_service.compute_affected_dirs(modified_paths)
+    dir_service.update_affected_dirs(**affected_dirs)
+
+    # Every sibling subdir is gone, so the parent is deleted too.
+    self.assertEqual(['/f'], dirs.Dirs.list('/', namespace='aaa').keys())
+    for path in ('/a', '/a/b', '/a/c', '/a/d', '/a/d/e'):
+      self.assertFalse(dirs.Dir(path, namespace='aaa').exists)
+    # Dirs in other namespaces are untouched.
+    self.assertEqual(['/a'], dirs.Dirs.list('/').keys())
+    self.assertEqual(['/a/b'], dirs.Dirs.list('/a').keys())
+
+    # A dir which still has a subdir is kept, along with its parents.
+    files.register_file_mixins([dirs.DirManagerMixin])
+    files.File('/a/b/foo', namespace='aaa').write('')
+    files.File('/a/c/foo', namespace='aaa').write('')
+    files.File('/a/c/foo', namespace='aaa').delete()
+    self.assertEqual(['/a/b'], dirs.Dirs.list('/a', namespace='aaa').keys())
+    self.assertEqual(
+        ['/a', '/f'], sorted(dirs.Dirs.list('/', namespace='aaa').keys()))
+
+  def testKnownDirs(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+    files.File('/a/b/foo').write('')
+    self.assertTrue(dirs._is_known_dir('/a/b'))
+    self.assertFalse(dirs._is_known_dir('/a/b', namespace='aaa'))
+
+    # Writes into known dirs skip directory updates entirely.
+    self.mox.StubOutWithMock(dirs.DirService, 'update_affected_dirs')
+    self.mox.ReplayAll()
+    files.File('/a/b/bar').write('')
+    files.File('/bar').write('')
+    self.mox.VerifyAll()
+    self.mox.UnsetStubs()
+
+    self.assertTrue(dirs._is_known_dir('/a'))
+
+    # Deleting a dir invalidates it, so a later write re-creates it.
+    files.File('/a/b/foo').delete()
+    files.File('/a/b/bar').delete()
+    self.assertFalse(dirs.Dir('/a/b').exists)
+    self.assertFalse(dirs._is_known_dir('/a/b'))
+    files.File('/a/b/foo').write('')
+    self.assertTrue(dirs.Dir('/a/b').exists)
+    self.assertEqual(['/a'], dirs.Dirs.list('/').keys())
+
+  def testDirInitializer(self):
+    # Files written without the mixin have no dirs.
+    for i in range(5):
+      files.File('/a/b/foo%d' % i, namespace='aaa').write('')
+    files.File('/c/foo', namespace='aaa').write('')
+    # Dirs which lost their files are orphaned.
+    files.register_file_mixins([dirs.DirManagerMixin])
+    files.File('/d/e/foo', namespace='aaa').write('')
+    files.File('/d/foo', namespace='aaa').write('')
+    files.unregister_file_factory()
+    files.File('/d/e/foo', namespace='aaa').delete()
+    files.File('/d/foo', namespace='aaa').delete()
+    self.assertEqual(['/d'], dirs.Dirs.list('/', namespace='aaa').keys())
+
+    dir_initializer = dirs.DirInitializer(
+        namespace='aaa', num_shards=2, batch_size=2, num_batches=1)
+    self.assertGreaterEqual(dir_initializer.run(), 2)
+    # Run until no more continuation tasks are deferred.
+    while self.taskqueue_stub.GetTasks('default'):
+      self.RunDeferredTasks()
+
+    self.assertEqual(
+        ['/a', '/c'], sorted(dirs.Dirs.list('/', namespace='aaa').keys()))
+    self.assertEqual(['/a/b'], dirs.Dirs.list('/a', namespace='aaa').keys())
+    self.assertFalse(dirs.Dir('/d/e', namespace='aaa').exists)
+    self.assertTrue(dirs.Dir('/a/b', namespace='aaa').exists)
+    self.assertEqual([], dirs.Dirs.list('/').keys())
+
   def testNamespaces(self):
     files.register_file_mixins([dirs.DirManagerMixin])
 
@@ -191,5 +382,103 @@ class DirManagerTest(testing.BaseTestCase):
     self.assertEqual(['/a'], dirs.Dirs.list('/', namespace='aaa').keys())
     self.assertEqual(['/z'], dirs.Dirs.list('/').keys())
 
+  def testDirTaskConsumer(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+    files.File('/a/foo').write('')
+    files.File('/a/foo', namespace='aaa').write('')
+
+    # Queue delete tasks without consuming them.
+    self.stubs.Set(dirs.DirTaskConsumer, 'process_next_window', lambda _: None)
+    files.File('/a/foo').delete()
+    files.File('/a/foo', namespace='aaa').delete()
+    self.stubs.UnsetAll()
+    dir_task_consumer = dirs.DirTaskConsumer()
+    backlog = dir_task_consumer.get_backlog()
+    self.assertEqual(2, backlog['num_tasks'])
+    self.assertGreaterEqual(backlog['lag_seconds'], 0)
+
+    # Each namespace's tasks are leased separately.
+    queue = taskqueue.Queue(dirs.TASKQUEUE_NAME)
+    tags = []
+    for _ in range(2):
+      tasks = queue.lease_tasks_by_tag(lease_seconds=60, max_tasks=10)
+      self.assertEqual(1, len(tasks))
+      tags.append(tasks[0].tag)
+    self.assertEqual(['', 'aaa'], sorted(tag.split(':')[1] for tag in tags))
+
+    # Windows mixing namespaces, queued before per-namespace tags, still work.
+    queue.purge()
+    for namespace in (None, 'aaa'):
+      path_data = {
+          'path': '/a/foo',
+          'namespace': namespace,
+          'modified': time.time(),
+          'action': dirs.ModifiedPath.DELETE,
+      }
+      queue.add(taskqueue.Task(
+          method='PULL', payload=json.dumps(path_data), tag='123'))
+    modified_paths = dir_task_consumer.process_next_window()
+    self.assertEqual(2, len(modified_paths))
+    self.assertFalse(dirs.Dir('/a').exists)
+    self.assertFalse(dirs.Dir('/a', namespace='aaa').exists)
+    self.assertEqual(0, dir_task_consumer.log_backlog()['num_tasks'])
+
+  def testChangeJournal(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+
+    files.File('/a/foo').write('foo')
+    files.File('/a/bar', namespace='aaa').write('bar')
+    files.File('/a/foo').delete()
+    changes, _, _ = files.Files.changes_since(settle_seconds=0)
+    self.assertEqual([('/a/foo', files.CHANGE_ACTION_WRITE),
+                      ('/a/foo', files.CHANGE_ACTION_DELETE)],
+                     [(c.path, c.action) for c in changes])
+    self.assertEqual(hashlib.md5('foo').hexdigest(), changes[0].md5_hash)
+    self.assertIsNone(changes[1].md5_hash)
+    changes, _, _ = files.Files.changes_since(
+        namespace='aaa', settle_seconds=0)
+    self.assertEqual(['/a/bar'], [c.path for c in changes])
+
+  def testListingCache(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+    files.File('/a/b/foo').write('')
+
+    titan_files = files.Files.list('/a', recursive=True, cache=True)
+    self.assertEqual(['/a/b/foo'], titan_files.keys())
+
+    # Writes which bypass the mixin don't invalidate, proving a cache hit.
+    files.unregister_file_factory()
+    files.File('/a/b/bar').write('')
+    titan_files = files.Files.list('/a', recursive=True, cache=True)
+    self.assertEqual(['/a/b/foo'], titan_files.keys())
+    # Different query shapes are cached separately.
+    titan_files = files.Files.list('/a/b', cache=True)
+    self.assertEqual(['/a/b/bar', '/a/b/foo'], sorted(titan_files.keys()))
+
+    # Mixin writes and deletes bump the generation of every ancestor dir.
+    files.register_file_mixins([dirs.DirManagerMixin])
+    files.File('/a/b/c/baz').write('')
+    titan_files = files.Files.list('/a', recursive=True, cache=True)
+    self.assertEqual(['/a/b/bar', '/a/b/c/baz', '/a/b/foo'],
+                     sorted(titan_files.keys()))
+    files.File('/a/b/foo').delete()
+    titan_files = files.Files.list('/a/b', cache=True)
+    self.assertEqual(['/a/b/bar'], titan_files.keys())
+
+    # Equivalent filters and orders built separately share a cache key.
+    def GetCacheKey():
+      return files._get_listing_cache_key(
+          '/a', recursive=True,
+          filters=[files.FileProperty('color') == 'blue',
+                   files.FileProperty('size') > 3],
+          order=[-files.FileProperty('size'), files.FileProperty('color')])
+    self.assertEqual(GetCacheKey(), GetCacheKey())
+    other_key = files._get_listing_cache_key(
+        '/a', recursive=True,
+        filters=[files.FileProperty('color') == 'red',
+                 files.FileProperty('size') > 3],
+        order=[-files.FileProperty('size'), files.FileProperty('color')])
+    self.assertNotEqual(GetCacheKey(), other_key)
+
 if __name__ == '__main__':
   basetest.main()
@@ -22,12 +22,18 @@ import cPickle as pickle
 import copy
 import datetime
 import hashlib
+import time
+from google.appengine.api import datastore_errors
 from google.appengine.api import files as blobstore_files
 from google.appengine.ext import blobstore
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
 from titan.common.lib.google.apputils import app
 from titan.common.lib.google.apputils import basetest
 from titan.files import files
+from titan.common import sharded_cache
 from titan.common import utils
+from titan import stats
 from titan import users
 
 # Content larger than the arbitrary max content size and the 1MB RPC limit.
@@ -835,6 +841,104 @@ class FilesTestCase(testing.BaseTestCase):
     ]
     self.assertEqual(1, files.Files.count('/', recursive=True, filters=filters))
 
+  def testDisablePathIndexes(self):
+    files.disable_path_indexes('unindexed')
+    self.addCleanup(files.enable_path_indexes, 'unindexed')
+    paths = ['/foo', '/a/foo', '/a/b/foo', '/a/b/c/foo', '/ab/foo']
+    for path in paths:
+      files.File(path, namespace='unindexed').write('')
+
+    # Path properties are stored unindexed.
+    query = files._TitanFile.query(
+        files._TitanFile.paths == '/a', namespace='unindexed')
+    self.assertEqual([], query.fetch())
+
+    # Recursive listings are key range scans, with in-memory depth filtering.
+    titan_files = files.Files.list('/a', namespace='unindexed', recursive=True)
+    self.assertEqual(['/a/b/c/foo', '/a/b/foo', '/a/foo'],
+                     sorted(titan_files.keys()))
+    titan_files = files.Files.list(
+        '/a', namespace='unindexed', recursive=True, depth=1)
+    self.assertEqual(['/a/b/foo', '/a/foo'], sorted(titan_files.keys()))
+    titan_files = files.Files.list(
+        '/', namespace='unindexed', recursive=True, depth=1, limit=2)
+    self.assertEqual(2, len(titan_files))
+    self.assertEqual(3, files.Files.count(
+        '/', namespace='unindexed', recursive=True, depth=1))
+    self.assertEqual(5, files.Files.count(
+        '/', namespace='unindexed', recursive=True))
+    # Non-recursive listings still use the dir_path index.
+    self.assertEqual(['/a/foo'], files.Files.list(
+        '/a', namespace='unindexed').keys())
+
+    # Other namespaces are unaffected.
+    files.File('/a/foo').write('')
+    query = files._TitanFile.query(files._TitanFile.paths == '/a')
+    self.assertEqual(1, query.count())
+
+    # Depth-limited queries cannot be built without path indexes.
+    self.assertRaises(
+        ValueError, files._create_files_query, '/', namespace='unindexed',
+        recursive=True, depth=1)
+
+  def testIndexProfiles(self):
+    def GetIndexedNames(titan_file):
+      return set(p.name() for p in titan_file._file._to_pb().property_list())
+
+    files.register_index_profile(
+        files.IndexProfile(['color']), namespace='aaa', path_prefix='/static/')
+    files.register_index_profile(
+        files.IndexProfile(index_all_meta=True), namespace='aaa',
+        path_prefix='/static/raw')
+    self.addCleanup(files.unregister_index_profile, 'aaa', '/static')
+    self.addCleanup(files.unregister_index_profile, 'aaa', '/static/raw')
+    self.assertRaises(ValueError, files.register_index_profile,
+                      files.IndexProfile(), path_prefix='bad')
+
+    meta = {'color': 'blue', 'size': 'large'}
+    titan_file = files.File('/static/foo', namespace='aaa')
+    titan_file.write('', meta=meta)
+    self.assertEqual(set(['dir_path', 'color']), GetIndexedNames(titan_file))
+    # The longest matching prefix wins.
+    titan_file = files.File('/static/raw/foo', namespace='aaa')
+    titan_file.write('', meta=meta)
+    self.assertEqual(set(['dir_path', 'color', 'size']),
+                     GetIndexedNames(titan_file))
+    # Other paths and namespaces are unaffected.
+    titan_file = files.File('/other/foo', namespace='aaa')
+    titan_file.write('', meta=meta)
+    self.assertIn('paths', GetIndexedNames(titan_file))
+    titan_file = files.File('/static/foo').write('', meta=meta)
+    self.assertIn('size', GetIndexedNames(titan_file))
+
+    # Listings which overlap a profile without path indexes use key ranges.
+    self.assertEqual(
+        ['/other/foo', '/static/foo', '/static/raw/foo'],
+        sorted(files.Files.list('/', namespace='aaa', recursive=True, depth=2)))
+    self.assertEqual(['/static/foo'], files.Files.list(
+        '/static', namespace='aaa', recursive=True, depth=1).keys())
+    filters = [files.FileProperty('color') == 'blue']
+    self.assertEqual(['/static/foo', '/static/raw/foo'], sorted(
+        files.Files.list('/static', namespace='aaa', recursive=True,
+                         filters=filters)))
+
+    # Re-indexing applies changed profiles to existing entities.
+    files.unregister_index_profile('aaa', '/static/raw')
+    query = files._TitanFile.query(
+        files.FileProperty('size') == 'large', namespace='aaa')
+    self.assertEqual(2, query.count())
+    job = files.Files.reindex('/static', namespace='aaa')
+    self.RunDeferredTasks()
+    self.assertTrue(job.refresh().is_done)
+    self.assertEqual(2, job.num_updated)
+    self.assertEqual(['/other/foo'], [key.id() for key in query.fetch(
+        keys_only=True)])
+    # Without any profile, meta properties are indexed again.
+    files.unregister_index_profile('aaa', '/static')
+    files.Files.reindex('/static', namespace='aaa')
+    self.RunDeferredTasks()
+    self.assertEqual(3, query.count())
+
   def testOrderedFiles(self):
     # Create files for testing.
     root_level = files.OrderedFiles([
@@ -1072,6 +1176,255 @@ class FilesTestCase(testing.BaseTestCase):
                      files.Files.list(dir_path='/foo/',
                                       recursive=True).serialize(full=True))
 
+  def testUpdateMeta(self):
+    files.File('/site/v2/a.html').write('a', meta={'color': 'blue'})
+    files.File('/site/v2/b/c.html').write('c')
+    files.File('/site/v2/b/d.html').write(LARGE_FILE_CONTENT)
+    files.File('/site/v1/e.html').write('e')
+    blob_key = files.File('/site/v2/b/d.html').blob.key()
+
+    # Error handling.
+    self.assertRaises(TypeError, files.Files.update_meta, '/site', meta=None)
+    self.assertRaises(
+        files.InvalidMetaError,
+        files.Files.update_meta, '/site', meta={'content': 'foo'})
+    self.assertRaises(
+        ValueError,
+        files.Files.update_meta, '/site', meta={'a': 1}, depth=1)
+
+    job = files.Files.update_meta(
+        '/site/v2', meta={'published': True}, recursive=True, batch_size=2)
+    self.assertEqual(files.JOB_STATUS_RUNNING, job.status)
+    self.assertFalse(job.is_done)
+
+    # Two batches of two and one file, chained through deferred tasks.
+    self.RunDeferredTasks()
+    self.assertFalse(job.refresh().is_done)
+    self.assertEqual(2, job.num_processed)
+    self.RunDeferredTasks()
+    job = files.FilesJob(job.key)
+    self.assertTrue(job.is_done)
+    self.assertEqual(files.JOB_STATUS_SUCCESSFUL, job.status)
+    self.assertEqual(3, job.num_processed)
+    self.assertEqual(3, job.num_updated)
+
+    self.assertTrue(files.File('/site/v2/a.html').meta.published)
+    self.assertEqual('blue', files.File('/site/v2/a.html').meta.color)
+    self.assertTrue(files.File('/site/v2/b/c.html').meta.published)
+    self.assertFalse(hasattr(files.File('/site/v1/e.html').meta, 'published'))
+    # Content and blobs are untouched.
+    self.assertEqual('a', files.File('/site/v2/a.html').content)
+    self.assertEqual(blob_key, files.File('/site/v2/b/d.html').blob.key())
+    self.assertEqual(LARGE_FILE_CONTENT,
+                     files.File('/site/v2/b/d.html').content)
+    # Meta updates bypass File mixins, but are still journaled.
+    changes, _, _ = files.Files.changes_since(settle_seconds=0)
+    self.assertEqual(
+        ['/site/v2/a.html', '/site/v2/b/c.html', '/site/v2/b/d.html'],
+        sorted(c.path for c in changes))
+
+    # Re-running with the same meta visits files but changes nothing.
+    job = files.Files.update_meta(
+        '/site/v2', meta={'published': True}, recursive=True)
+    self.RunDeferredTasks()
+    job.refresh()
+    self.assertEqual(3, job.num_processed)
+    self.assertEqual(0, job.num_updated)
+
+    # Retried batches are only counted once.
+    meta = {'flag': True}
+    query_kwargs = {'dir_path': '/site/v2', 'namespace': None,
+                    'recursive': True, 'depth': None, 'filters': None}
+    job = files.Files.update_meta('/site/v2', meta=meta, recursive=True,
+                                  batch_size=2)
+    files._update_meta_batch(job.key, meta, query_kwargs, 2)
+    self.RunDeferredTasks()
+    job.refresh()
+    self.assertEqual(files.JOB_STATUS_SUCCESSFUL, job.status)
+    self.assertEqual(3, job.num_processed)
+    self.assertEqual(3, job.num_updated)
+
+    # Transient errors are retried; the job only fails on the last retry.
+    job = files.Files.update_meta('/site/v2', meta=meta, recursive=True)
+    def _RaiseError(*args, **kwargs):
+      raise datastore_errors.Timeout
+    self.stubs.Set(files, '_put_meta_async', _RaiseError)
+    self.stubs.Set(files, '_get_task_retry_count', lambda: 0)
+    self.assertRaises(
+        datastore_errors.Timeout,
+        files._update_meta_batch, job.key, meta, query_kwargs, 100)
+    self.assertEqual(files.JOB_STATUS_RUNNING, job.refresh().status)
+    self.stubs.Set(files, '_get_task_retry_count',
+                   lambda: files.JOB_TASK_RETRY_LIMIT)
+    self.assertRaises(
+        datastore_errors.Timeout,
+        files._update_meta_batch, job.key, meta, query_kwargs, 100)
+    self.assertEqual(files.JOB_STATUS_FAILED, job.refresh().status)
+
+    # Other errors, even ValueErrors, are retried too...
+    job = files.Files.update_meta('/site/v2', meta=meta, recursive=True)
+    def _RaiseValueError(*args, **kwargs):
+      raise ValueError
+    self.stubs.Set(files, '_put_meta_async', _RaiseValueError)
+    self.stubs.Set(files, '_get_task_retry_count', lambda: 0)
+    self.assertRaises(
+        ValueError, files._update_meta_batch, job.key, meta, query_kwargs, 100)
+    self.assertEqual(files.JOB_STATUS_RUNNING, job.refresh().status)
+    # ...but meta values which can't be stored fail the job right away.
+    def _RaiseInvalidMetaError(*args, **kwargs):
+      raise files.InvalidMetaError
+    self.stubs.Set(files, '_put_meta_async', _RaiseInvalidMetaError)
+    self.assertRaises(
+        deferred.PermanentTaskFailure,
+        files._update_meta_batch, job.key, meta, query_kwargs, 100)
+    self.assertEqual(files.JOB_STATUS_FAILED, job.refresh().status)
+
+    self.assertRaises(
+        files.InvalidJobError, lambda: files.FilesJob(12345).status)
+    self.assertFalse(files.FilesJob(12345).exists)
+
+  def testChunkedStorage(self):
+    files.configure_chunked_storage(max_size=files.MAX_CONTENT_SIZE * 4,
+                                    chunk_size=files.MAX_CONTENT_SIZE)
+    self.addCleanup(files.configure_chunked_storage, max_size=0)
+    self.assertRaises(ValueError, files.configure_chunked_storage, -1)
+    self.assertRaises(ValueError, files.configure_chunked_storage, chunk_size=0)
+    # Chunks must fit in a single entity.
+    self.assertRaises(ValueError, files.configure_chunked_storage,
+                      chunk_size=files.MAX_CHUNK_SIZE + 1)
+    files.configure_chunked_storage(chunk_size=files.MAX_CHUNK_SIZE)
+    files.configure_chunked_storage(max_size=files.MAX_CONTENT_SIZE * 4,
+                                    chunk_size=files.MAX_CONTENT_SIZE)
+    mid_content = 'a' * (files.MAX_CONTENT_SIZE * 2 + 1)
+    big_content = 'b' * (files.MAX_CONTENT_SIZE * 4 + 1)
+
+    # Mid-size content is stored in three chunk entities.
+    titan_file = files.File('/foo/bar').write(mid_content)
+    self.assertIsNone(titan_file.blob)
+    self.assertIsNone(titan_file._file.content)
+    self.assertEqual(3, len(titan_file._file.chunks))
+    self.assertEqual(mid_content, files.File('/foo/bar').content)
+    self.assertEqual(len(mid_content), files.File('/foo/bar').size)
+    self.assertEqual(hashlib.md5(mid_content).hexdigest(),
+                     files.File('/foo/bar').md5_hash)
+    self.assertEqual({}, files.File('/foo/bar').meta.serialize())
+    old_chunk_keys = titan_file._file.chunks
+
+    # Unicode content is encoded before chunking.
+    unicode_content = u'\xe9' * files.MAX_CONTENT_SIZE
+    files.File('/foo/unicode').write(unicode_content)
+    self.assertEqual(unicode_content, files.File('/foo/unicode').content)
+
+    # Copies get their own chunks.
+    files.File('/foo/bar').copy_to(files.File('/foo/copy'))
+    self.assertEqual(mid_content, files.File('/foo/copy').content)
+    self.assertNotEqual(old_chunk_keys, files.File('/foo/copy')._file.chunks)
+
+    # Replaced chunks are deleted, and larger content goes to blobstore.
+    titan_file = files.File('/foo/bar').write(big_content)
+    self.assertTrue(titan_file.blob)
+    self.assertEqual([], titan_file._file.chunks)
+    self.assertEqual([None, None, None], ndb.get_multi(old_chunk_keys))
+    self.assertEqual(big_content, files.File('/foo/bar').content)
+    titan_file = files.File('/foo/bar').write('small')
+    self.assertEqual('small', files.File('/foo/bar').content)
+
+    # Deleting a file deletes its chunks.
+    chunk_keys = files.File('/foo/copy')._file.chunks
+    files.File('/foo/copy').delete()
+    self.assertEqual([None, None, None], ndb.get_multi(chunk_keys))
+    chunk_keys = files.File('/foo/unicode')._file.chunks
+    files.Files(['/foo/unicode']).delete()
+    self.assertEqual([None] * len(chunk_keys), ndb.get_multi(chunk_keys))
+
+    # Chunks are kept when old blobs are kept, as for microversioned files.
+    chunk_keys = files.File('/foo/keep').write(mid_content)._file.chunks
+    files.File('/foo/keep').write('small', _delete_old_blob=False)
+    self.assertNotIn(None, ndb.get_multi(chunk_keys))
+    chunk_keys = files.File('/foo/keep').write(mid_content)._file.chunks
+    files.File('/foo/keep').delete(_delete_old_blob=False)
+    self.assertNotIn(None, ndb.get_multi(chunk_keys))
+
+    # Moved files don't share chunks, so the source chunks are deleted.
+    chunk_keys = files.File('/foo/move').write(mid_content)._file.chunks
+    files.File('/foo/move').move_to(files.File('/foo/moved'))
+    self.assertEqual([None, None, None], ndb.get_multi(chunk_keys))
+    self.assertEqual(mid_content, files.File('/foo/moved').content)
+
+  def testChangesSince(self):
+    now = time.time()
+    files._append_file_changes([
+        files.FileChange('/a', files.CHANGE_ACTION_WRITE, modified=now - 200),
+        files.FileChange('/b', files.CHANGE_ACTION_WRITE, modified=now - 100),
+        files.FileChange('/a', files.CHANGE_ACTION_DELETE, modified=now - 50),
+        files.FileChange('/c', files.CHANGE_ACTION_WRITE, modified=now,
+                         md5_hash='abc'),
+    ])
+    self.assertRaises(ValueError, files.FileChange, '/a', 'bad')
+    self.assertRaises(ValueError, files.Files.changes_since, 'bad-token')
+
+    # Young entries are held back until they settle.
+    changes, token, has_more = files.Files.changes_since()
+    self.assertEqual(['/a', '/b', '/a'], [c.path for c in changes])
+    self.assertFalse(has_more)
+
+    changes, token, has_more = files.Files.changes_since(
+        settle_seconds=0, limit=2)
+    self.assertEqual(['/a', '/b'], [c.path for c in changes])
+    self.assertTrue(has_more)
+    changes, token, has_more = files.Files.changes_since(
+        token, settle_seconds=0)
+    self.assertEqual([('/a', files.CHANGE_ACTION_DELETE),
+                      ('/c', files.CHANGE_ACTION_WRITE)],
+                     [(c.path, c.action) for c in changes])
+    self.assertEqual('abc', changes[-1].md5_hash)
+    self.assertFalse(has_more)
+    # Nothing new: the same token comes back.
+    self.assertEqual(([], token, False),
+                     files.Files.changes_since(token, settle_seconds=0))
+    # Journals are per-namespace.
+    self.assertEqual(
+        [], files.Files.changes_since(namespace='aaa', settle_seconds=0)[0])
+
+    # Compaction drops expired entries and superseded entries.
+    old_changes, old_token, _ = files.Files.changes_since(limit=1)
+    files._append_file_changes([
+        files.FileChange('/c', files.CHANGE_ACTION_DELETE, modified=now - 10),
+    ])
+    job = files.compact_file_changes(max_age_seconds=150)
+    self.RunDeferredTasks()
+    job.refresh()
+    self.assertEqual(files.JOB_STATUS_SUCCESSFUL, job.status)
+    self.assertEqual(5, job.num_processed)
+    self.assertEqual(2, job.num_updated)
+    changes, _, _ = files.Files.changes_since(settle_seconds=0)
+    self.assertEqual([('/b', files.CHANGE_ACTION_WRITE),
+                      ('/a', files.CHANGE_ACTION_DELETE),
+                      ('/c', files.CHANGE_ACTION_WRITE)],
+                     [(c.path, c.action) for c in changes])
+    self.assertRaises(files.ChangeTokenExpiredError,
+                      files.Files.changes_since, old_token)
+    self.assertEqual('/a', old_changes[0].path)
+
+    # Compaction is batched, and superseded entries are only dropped within
+    # a batch: newest first, the batches are [/c, /b] and [/a, /b].
+    files._append_file_changes([
+        files.FileChange('/b', files.CHANGE_ACTION_DELETE, modified=now - 5),
+    ])
+    job = files.compact_file_changes(max_age_seconds=150, batch_size=2)
+    for _ in range(3):
+      self.RunDeferredTasks()
+    job.refresh()
+    self.assertEqual(files.JOB_STATUS_SUCCESSFUL, job.status)
+    self.assertEqual(4, job.num_processed)
+    self.assertEqual(0, job.num_updated)
+    job = files.compact_file_changes(max_age_seconds=150, batch_size=4)
+    for _ in range(3):
+      self.RunDeferredTasks()
+    self.assertEqual(1, job.refresh().num_updated)
+    changes, _, _ = files.Files.changes_since(settle_seconds=0)
+    self.assertEqual(['/a', '/b', '/c'], [c.path for c in changes])
+
 class FileCacheTestCase(testing.BaseTestCase):
 
   def testCacheHelpers(self):
@@ -1081,6 +1434,104 @@ class FileCacheTestCase(testing.BaseTestCase):
     files._clear_blob_cache_for_paths(['/foo.html'])
     self.assertIsNone(files._get_blob_cache('/foo.html'))
 
+  def testReadAsync(self):
+    files.configure_chunked_storage(max_size=files.MAX_CONTENT_SIZE * 4)
+    self.addCleanup(files.configure_chunked_storage, max_size=0)
+    small_content = u'f\xf8\xf8'
+    chunked_content = 'a' * (files.MAX_CONTENT_SIZE * 2)
+    blob_content = 'b' * (files.MAX_CONTENT_SIZE * 5)
+    files.File('/foo/small').write(small_content)
+    files.File('/foo/chunked').write(chunked_content)
+    files.File('/foo/blob').write(blob_content)
+    files._clear_blob_cache_for_paths(['/foo/blob'])
+
+    # Blobs are fetched with async RPCs, never with the blocking reader.
+    self.stubs.Set(files, '_read_blob', lambda *args, **kwargs: self.fail())
+
+    titan_files = files.Files(['/foo/small', '/foo/chunked', '/foo/blob'])
+    titan_files.load()
+    futures = [titan_files[path].read_async()
+               for path in ('/foo/small', '/foo/chunked', '/foo/blob')]
+    self.assertEqual([small_content, chunked_content, blob_content],
+                     [future.get_result() for future in futures])
+    # Mid-size blob content is only admitted on the second read; the write
+    # doesn't count as an access.
+    self.assertIsNone(files._get_blob_cache('/foo/blob'))
+    self.assertEqual(
+        blob_content, files.File('/foo/blob').read_async().get_result())
+    self.assertEqual(blob_content, files._get_blob_cache('/foo/blob'))
+    self.assertRaises(files.BadFileError,
+                      files.File('/foo/fake').read_async().get_result)
+
+  def testBlobCacheAdmission(self):
+    policy = files.SizeAwareAdmissionPolicy(admit_size=10, max_size=100)
+    self.assertRaises(ValueError, files.SizeAwareAdmissionPolicy,
+                      admit_size=10, max_size=5)
+    # Small content is admitted right away, oversized content never is.
+    self.assertTrue(policy.admit('/small', 10))
+    self.assertFalse(policy.admit('/huge', 101))
+    self.assertFalse(policy.admit('/huge', 101))
+    # Mid-size content is admitted on repeat access.
+    self.assertFalse(policy.admit('/mid', 50))
+    self.assertTrue(policy.admit('/mid', 50))
+    self.assertFalse(policy.admit(u'/mid\xe9', 50))
+
+    # Writes are not accesses, and only cache content that would be admitted.
+    self.assertTrue(policy.admit_write('/small', 10))
+    self.assertFalse(policy.admit_write('/new', 50))
+    self.assertFalse(policy.admit_write('/new', 50))
+    self.assertFalse(policy.admit('/new', 50))
+    self.assertTrue(policy.admit_write('/mid', 50))
+    self.assertFalse(policy.admit_write('/mid', 101))
+    self.assertFalse(files.BlobCacheAdmissionPolicy().admit_write('/a', 1))
+
+    # Counts decay every sample_size accesses.
+    policy = files.SizeAwareAdmissionPolicy(
+        admit_size=10, max_size=100, sample_size=2)
+    self.assertFalse(policy.admit('/mid', 50))
+    self.assertFalse(policy.admit('/other', 50))
+    self.assertFalse(policy.admit('/mid', 50))
+
+    # Reads go through the registered policy, and decisions are logged.
+    logged_counters = []
+    self.stubs.Set(files, '_log_blob_cache_admission', logged_counters.append)
+    files.register_blob_cache_admission_policy(
+        files.SizeAwareAdmissionPolicy(admit_size=0))
+    self.addCleanup(files.unregister_blob_cache_admission_policy)
+    content = 'a' * (files.MAX_CONTENT_SIZE + 1)
+    files.File('/foo/bar').write(content)
+    self.assertIsNone(files._get_blob_cache('/foo/bar'))
+    self.assertEqual(content, files.File('/foo/bar').content)
+    self.assertIsNone(files._get_blob_cache('/foo/bar'))
+    self.assertEqual(content, files.File('/foo/bar').content)
+    self.assertEqual(content, files._get_blob_cache('/foo/bar'))
+    self.assertEqual([False, True], logged_counters)
+    # Rewriting a path which is read repeatedly keeps it cached.
+    content = 'c' * (files.MAX_CONTENT_SIZE + 1)
+    files.File('/foo/bar').write(content)
+    self.assertEqual(content, files._get_blob_cache('/foo/bar'))
+    self.assertEqual([False, True], logged_counters)
+
+    # Blob cache counters are sampled and scaled up, like sharded_cache's.
+    logged_counters = {}
+    def LogCounters(counters, counters_func):
+      for counter in counters:
+        logged_counters[counter.name] = counter.finalize()
+    self.stubs.Set(stats, 'log_counters', LogCounters)
+    self.stubs.Set(sharded_cache, 'STATS_SAMPLE_RATE', 0)
+    files._log_blob_cache_counter('files/blob_cache/admit')
+    self.assertEqual({}, logged_counters)
+    self.stubs.Set(sharded_cache, 'STATS_SAMPLE_RATE', 0.5)
+    self.stubs.Set(files.random, 'random', lambda: 0.0)
+    files._log_blob_cache_counter('files/blob_cache/admit')
+    self.assertEqual({'files/blob_cache/admit': 2}, logged_counters)
+
+    # A rejected write never leaves stale content cached.
+    files.register_blob_cache_admission_policy(
+        files.SizeAwareAdmissionPolicy(admit_size=0, max_size=0))
+    files.File('/foo/bar').write('b' * (files.MAX_CONTENT_SIZE + 1))
+    self.assertIsNone(files._get_blob_cache('/foo/bar'))
+
 def main(unused_argv):
   basetest.main()
 
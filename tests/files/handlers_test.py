@@ -21,9 +21,10 @@ import hashlib
 import json
 import time
 import webtest
-from google.appengine.api import blobstore
+from google.appengine.ext import blobstore
 from titan.common.lib.google.apputils import basetest
 from titan import files
+from titan.files import dirs
 from titan.files import handlers
 from titan.common import utils
 
@@ -71,11 +72,47 @@ class HandlersTest(testing.BaseTestCase):
     self.assertEqual(400, response.status_int)
     self.assertEqual('', response.body)
 
+  def testDirsHandler(self):
+    files.register_file_mixins([dirs.DirManagerMixin])
+    self.addCleanup(files.unregister_file_factory)
+    files.File('/a/b/foo').write('')
+    files.File('/a/c/foo').write('')
+
+    response = self.app.get('/_titan/dirs?dir_path=/a')
+    self.assertEqual(['b', 'c'], sorted(json.loads(response.body)))
+
+    response = self.app.get('/_titan/dirs?dir_path=/&recursive=true')
+    data = json.loads(response.body)
+    self.assertEqual(['/', '/a', '/a/b', '/a/c'], sorted(data))
+    self.assertEqual('/a/b', data['/a']['b']['path'])
+    self.assertEqual({}, data['/a/b'])
+
+    response = self.app.get('/_titan/dirs?dir_path=/&recursive=true&depth=1')
+    self.assertEqual(['/'], json.loads(response.body).keys())
+    response = self.app.get(
+        '/_titan/dirs?dir_path=/&recursive=true&depth=foo', expect_errors=True)
+    self.assertEqual(400, response.status_int)
+
   def testDirsProcessDataHandler(self):
     response = self.app.get('/_titan/dirs/processdata?runtime=1')
     self.assertEqual(200, response.status_int)
     self.assertIn(json.dumps({}), response.body)
 
+    # Extra workers are started in the default queue.
+    response = self.app.get('/_titan/dirs/processdata?runtime=0&num_workers=3')
+    self.assertEqual(200, response.status_int)
+    tasks = self.taskqueue_stub.GetTasks('default')
+    self.assertEqual(2, len(tasks))
+    self.assertEqual('/_titan/dirs/processdata?runtime=0', tasks[0]['url'])
+
+    # Bad worker counts are rejected before any worker is started.
+    for num_workers in ('0', '-1', 'foo'):
+      response = self.app.get(
+          '/_titan/dirs/processdata',
+          {'runtime': 0, 'num_workers': num_workers}, expect_errors=True)
+      self.assertEqual(400, response.status_int)
+    self.assertEqual(2, len(self.taskqueue_stub.GetTasks('default')))
+
   def testFileHandlerPost(self):
     params = {
         'content': 'foobar',
@@ -198,6 +235,95 @@ class HandlersTest(testing.BaseTestCase):
     self.assertEqual(200, response.status_int)
     self.assertEqual(expected_paths, json.loads(response.body))
 
+  def testFilesExportAndImportHandlers(self):
+    files.File('/foo/bar').write('bar', meta={'color': 'blue'})
+    files.File('/foo/baz/qux').write(LARGE_FILE_CONTENT)
+    # Exports run in a task, and are polled until done.
+    response = self.app.post('/_titan/files/export', {'dir_path': '/foo'})
+    self.assertEqual(202, response.status_int)
+    job_key = json.loads(response.body)['key']
+    response = self.app.get('/_titan/files/export', {'job': job_key})
+    self.assertEqual(
+        files.JOB_STATUS_RUNNING, json.loads(response.body)['status'])
+    self.RunDeferredTasks()
+    response = self.app.get('/_titan/files/export', {'job': job_key})
+    data = json.loads(response.body)
+    self.assertEqual(files.JOB_STATUS_SUCCESSFUL, data['status'])
+    self.assertEqual(2, data['num_files'])
+    content = blobstore.fetch_data(data['blob'], 0, data['size'] - 1)
+    self.assertEqual(data['size'], len(content))
+
+    # The archive blob is served by blobstore, and only archive blobs are.
+    response = self.app.get(
+        '/_titan/files/export/download', {'blob': data['blob']})
+    self.assertEqual(200, response.status_int)
+    self.assertEqual(data['blob'], response.headers['X-AppEngine-BlobKey'])
+    blob_key = str(files.File('/foo/baz/qux').blob.key())
+    response = self.app.get('/_titan/files/export/download', {'blob': blob_key},
+                            expect_errors=True)
+    self.assertEqual(404, response.status_int)
+
+    # Import from the request body.
+    response = self.app.post(
+        '/_titan/files/import?dir_path=/copy', content,
+        headers={'Content-Type': 'application/x-gzip'})
+    self.assertEqual(201, response.status_int)
+    self.assertEqual(
+        ['/copy/foo/bar', '/copy/foo/baz/qux'],
+        sorted(json.loads(response.body)['paths']))
+    self.assertEqual('blue', files.File('/copy/foo/bar').meta.color)
+    self.assertEqual(
+        LARGE_FILE_CONTENT, files.File('/copy/foo/baz/qux').content)
+
+    # Import from a blob, which is deleted afterwards.
+    response = self.app.post('/_titan/files/import',
+                             {'dir_path': '/blobcopy', 'blob': data['blob']})
+    self.assertEqual(201, response.status_int)
+    self.assertEqual('blue', files.File('/blobcopy/foo/bar').meta.color)
+    self.assertIsNone(blobstore.BlobInfo.get(data['blob']))
+    # Other blobs are neither imported nor deleted.
+    response = self.app.post('/_titan/files/import',
+                             {'dir_path': '/blobcopy', 'blob': blob_key},
+                             expect_errors=True)
+    self.assertEqual(400, response.status_int)
+    self.assertIsNotNone(blobstore.BlobInfo.get(blob_key))
+
+    response = self.app.post('/_titan/files/export', {'dir_path': 'bad'},
+                             expect_errors=True)
+    self.assertEqual(400, response.status_int)
+    response = self.app.get('/_titan/files/export', {'job': 'missing'},
+                            expect_errors=True)
+    self.assertEqual(404, response.status_int)
+    response = self.app.post('/_titan/files/import', 'garbage',
+                             expect_errors=True)
+    self.assertEqual(400, response.status_int)
+
+  def testFilesChangesHandler(self):
+    files._append_file_changes([
+        files.FileChange('/foo', files.CHANGE_ACTION_WRITE,
+                         modified=time.time() - 60),
+    ])
+    response = self.app.get('/_titan/files/changes')
+    self.assertEqual(200, response.status_int)
+    data = json.loads(response.body)
+    self.assertEqual(['/foo'], [c['path'] for c in data['changes']])
+    self.assertFalse(data['has_more'])
+    response = self.app.get('/_titan/files/changes', {'token': data['token']})
+    self.assertEqual([], json.loads(response.body)['changes'])
+
+    response = self.app.get('/_titan/files/changes', {'token': 'bad'},
+                            expect_errors=True)
+    self.assertEqual(400, response.status_int)
+
+    response = self.app.get('/_titan/files/changes/compact',
+                            {'max_age_seconds': 0})
+    job = files.FilesJob(json.loads(response.body)['key'])
+    self.RunDeferredTasks()
+    self.assertEqual(1, job.num_updated)
+    response = self.app.get('/_titan/files/changes', {'token': data['token']},
+                            expect_errors=True)
+    self.assertEqual(410, response.status_int)
+
   def testFileReadHandler(self):
     files.File('/foo/bar').write('foobar')
     response = self.app.get('/_titan/file/read', {'path': '/foo/bar'})
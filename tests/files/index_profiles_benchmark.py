@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of datastore write ops per new file under index profiles.
+
+Not collected by runtests.py. Run directly, with the same PYTHONPATH:
+  PYTHONPATH=tests:. python tests/files/index_profiles_benchmark.py
+"""
+
+from tests.common import testing
+
+from titan.common.lib.google.apputils import basetest
+from titan.files import files
+
+NUM_FILES = 50
+META = {'color': 'blue', 'size': 'large', 'tags': ['a', 'b', 'c']}
+
+PROFILES = (
+    ('default', None),
+    ('no path indexes', files.IndexProfile(
+        files._TitanFile.BASE_PROPERTIES - files._PATH_INDEX_PROPERTIES,
+        index_all_meta=True)),
+    ('listing + color', files.IndexProfile(['color'])),
+    ('listing only', files.IndexProfile()),
+)
+
+def _count_write_ops(file_ent):
+  """Write ops to put a new entity: 2, plus 2 per indexed property value."""
+  return 2 + 2 * len(file_ent._to_pb().property_list())
+
+class IndexProfilesBenchmark(testing.BaseTestCase):
+
+  def testWriteOpsPerFile(self):
+    # Spread files over depths 1 to 5, since each level adds a "paths" value.
+    paths = ['/a/b/c/d/e'[:2 * (i % 5) + 2] + '/file%d' % i
+             for i in range(NUM_FILES)]
+    print
+    print '%-20s %s' % ('Profile', 'Write ops per file')
+    for i, (name, index_profile) in enumerate(PROFILES):
+      namespace = 'benchmark%d' % i
+      if index_profile:
+        files.register_index_profile(index_profile, namespace=namespace)
+        self.addCleanup(files.unregister_index_profile, namespace=namespace)
+      total_ops = 0
+      for path in paths:
+        titan_file = files.File(path, namespace=namespace)
+        titan_file.write('content', meta=META)
+        total_ops += _count_write_ops(titan_file._file)
+      print '%-20s %.1f' % (name, float(total_ops) / len(paths))
+
+if __name__ == '__main__':
+  basetest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for mapper.py."""
+
+from tests.common import testing
+
+import json
+from titan.common.lib.google.apputils import basetest
+from titan import files
+from titan import pipelines
+from titan import tasks
+from titan.files import mapper
+
+class MapperTest(testing.BaseTestCase):
+
+  def testMapper(self):
+    for i in range(5):
+      files.File('/a/b/foo%d' % i).write('x' * i)
+    files.File('/a/c/bar').write('bar')
+    files.File('/other/baz').write('baz')
+
+    self.assertRaises(ValueError, SizeMapper, '/a', recursive=False, depth=1)
+    self.assertRaises(
+        NotImplementedError, mapper.Mapper('/a').map, files.File('/a/c/bar'))
+
+    # Shards split at sampled keys under the dir.
+    self.stubs.Set(
+        SizeMapper, '_sample_file_paths',
+        lambda self, num_samples: ['/other/baz', '/a/c/bar', '/a/b/foo1',
+                                   '/a/b/foo3'])
+    size_mapper = SizeMapper('/a/', num_shards=3, batch_size=1)
+    self.assertEqual(
+        [(None, '/a/b/foo3'), ('/a/b/foo3', '/a/c/bar'), ('/a/c/bar', None)],
+        size_mapper._compute_shards())
+    # Depth-limited mappers run in one shard.
+    self.assertEqual(
+        [(None, None)], SizeMapper('/a', depth=1)._compute_shards())
+
+    task_manager = size_mapper.run(description='sizes')
+    self.assertEqual(mapper.TASK_MANAGER_GROUP, task_manager.group)
+    self.assertEqual(3, task_manager.num_total)
+    self.RunDeferredTasks()
+    task_manager = tasks.TaskManager(
+        key=task_manager.key, group=mapper.TASK_MANAGER_GROUP)
+    self.assertEqual(tasks.STATUS_SUCCESSFUL, task_manager.status)
+
+    # Every mapped file got the buffered meta update, and nothing else did.
+    for i in range(5):
+      self.assertEqual(i, files.File('/a/b/foo%d' % i).meta.size)
+      self.assertEqual('x' * i, files.File('/a/b/foo%d' % i).content)
+    self.assertEqual(3, files.File('/a/c/bar').meta.size)
+    self.assertFalse(hasattr(files.File('/other/baz').meta, 'size'))
+    # Mapper writes bypass File mixins, but are still journaled.
+    changes, _, _ = files.Files.changes_since(settle_seconds=0)
+    self.assertEqual(
+        ['/a/b/foo%d' % i for i in range(5)] + ['/a/c/bar'],
+        sorted(c.path for c in changes))
+
+  def testPutMeta(self):
+    files.File('/a/foo').write('foo')
+    size_mapper = SizeMapper('/a')
+    titan_file = files.File('/a/foo')
+    size_mapper.put_meta(titan_file, {'size': 3})
+    size_mapper.put_meta(titan_file, {'color': 'blue'})
+    # Content written after the file was mapped is kept.
+    files.File('/a/foo').write('bar')
+    size_mapper.flush()
+    titan_file = files.File('/a/foo')
+    self.assertEqual('bar', titan_file.content)
+    self.assertEqual(3, titan_file.meta.size)
+    self.assertEqual('blue', titan_file.meta.color)
+
+  def testReduce(self):
+    for i in range(4):
+      files.File('/a/foo%d' % i).write('x' * i)
+    self.stubs.Set(
+        SizeMapper, '_sample_file_paths',
+        lambda self, num_samples: ['/a/foo2'])
+
+    size_mapper = SizeMapper(
+        '/a', num_shards=2, reduce_processor=SizesProcessor())
+    self.assertEqual(2, size_mapper.run().num_total)
+    self.RunDeferredTasks()
+    # Both shards push to the same batch, which is reduced at once.
+    self.RunDeferredTasks(queue_name=pipelines.PIPELINES_QUEUE)
+    self.assertEqual(
+        [0, 1, 2, 3], json.loads(files.File('/reduced/sizes').content))
+
+class SizeMapper(mapper.Mapper):
+  """A sample mapper that can be pickled."""
+
+  def map(self, titan_file):
+    size = len(titan_file.content)
+    self.put_meta(titan_file, {'size': size})
+    return size
+
+class SizesProcessor(pipelines.BaseAggregateProcessor):
+  """A sample reduce processor that can be pickled."""
+
+  def finalize(self):
+    sizes = sorted(sum(self.data, []))
+    files.File('/reduced/sizes').write(json.dumps(sizes))
+
+if __name__ == '__main__':
+  basetest.main()
@@ -637,7 +637,29 @@ class VersionsTest(testing.BaseTestCase):
     # Verify that hash is evenly distributing the paths over the shards by
     # verifying the shards are not nearly full to 1000 paths.
     manifest_shard = changeset._get_manifest_shard_ent('/foo0')
-    self.assertLess(900, len(manifest_shard.paths_to_changeset_num))
+    self.assertLess(len(manifest_shard.paths_to_changeset_num), 900)
+    self.assertLess(700, len(manifest_shard.paths_to_changeset_num))
+
+    # Changeset 10 and 11: only the shard of the changed path is rewritten.
+    changeset = self.vcs.new_staging_changeset()
+    files.File('/foo0', changeset=changeset).write('NEWfoo0')
+    changeset.finalize_associated_files()
+    final_changeset = self.vcs.commit(changeset)
+    self.assertEqual(11, final_changeset.num)
+    base_shard_ids = versions.Changeset(9).changeset_ent.manifest_shard_ids
+    shard_ids = final_changeset.changeset_ent.manifest_shard_ids
+    self.assertEqual(4, len(shard_ids))
+    changed_slots = [i for i in range(4) if shard_ids[i] != base_shard_ids[i]]
+    self.assertEqual(1, len(changed_slots))
+    self.assertEqual('11:0', shard_ids[changed_slots[0]])
+    self.assertEqual(
+        'NEWfoo0', files.File('/foo0', changeset=final_changeset).content)
+    self.assertEqual('', files.File('/foo1', changeset=final_changeset).content)
+    self.assertEqual(
+        'NEWfoo', files.File('/foo', changeset=final_changeset).content)
+    self.assertEqual(
+        3202, len(final_changeset.list_files(
+            '/', recursive=True, include_manifested=True)))
 
     # Rebase the staging changeset and verify the new manifest files.
     changeset = versions.Changeset(5)  # 'staging'
@@ -18,6 +18,7 @@
 from tests.common import testing
 
 import datetime
+import json
 import mock
 import os
 import webtest
@@ -352,6 +353,37 @@ class StatsTestCase(testing.BaseTestCase):
     }
     self.assertEqual(expected, processor.serialize())
 
+  @mock.patch('titan.stats.stats._get_window')
+  def testUnconfiguredCounters(self, internal_window):
+    internal_window.return_value = 0
+    def counters_func():
+      return [stats.Counter('page/view')]
+    page_counter = stats.Counter('page/view')
+    widget_counter = stats.Counter('widget/render')
+    latency_counter = stats.AverageTimingCounter('widget/render/latency')
+    page_counter.increment()
+    widget_counter.offset(3)
+    latency_counter.offset(50)
+    latency_counter.offset(100)
+    _, processor = _log_counters(
+        [page_counter, widget_counter, latency_counter], counters_func)
+
+    # Counters missing from the counters_func are kept, typed by their data.
+    batch_processor = processor.batch_processor
+    batch_processor.process(json.loads(json.dumps(processor.serialize())))
+    batch_processor.finalize()
+    counters_service = stats.CountersService()
+    expected = {
+        'page/view': [(0, 1)],
+        'widget/render': [(0, 3)],
+        'widget/render/latency': [(0, [75.0, 2])],
+    }
+    start_date = datetime.datetime.utcfromtimestamp(0)
+    counter_data = counters_service.get_counter_data(
+        ['page/view', 'widget/render', 'widget/render/latency'],
+        start_date=start_date)
+    self.assertEqual(expected, counter_data)
+
   @mock.patch('titan.stats.stats._get_window')
   def testManualCounterTimestamp(self, internal_window):
     def counters_func():
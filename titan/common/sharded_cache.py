@@ -20,11 +20,41 @@ be read into app memory often, but can't be cached due to size limits.
 
 This module should not be used with very large objects, keeping in mind the
 32 MB limit of memcache.set_multi.
+
+Get() fetches the shard map together with the first few content shards, so
+values of up to PREFETCH_SHARDS shards are read in a single round trip.
+GetMulti(), SetMulti() and DeleteMulti() batch many keys into a fixed number of
+memcache RPCs. GetAsync(), SetAsync() and DeleteAsync() return ndb Futures, so
+lookups can overlap with each other and with datastore RPCs.
+
+Every Set() tags its content shards with a new generation id which is recorded
+in the shard map, along with a checksum of the whole value. Shards from another
+Set() or a corrupt reassembly are never returned; they are treated as a miss.
+
+Operations are sampled into Titan Stats counters tagged by caller, such as
+'sharded_cache/blob_cache/get/hit', with latencies in '.../get/latency'.
+
+Byte string values skip pickling and are zlib-compressed when that makes them
+notably smaller; other values are pickled. The encoding is recorded in the
+shard map.
+
+Hot keys: a single very popular value would hammer one memcache key (and one
+memcache server). Values can be replicated under several keys, either
+explicitly with Set(..., replicas=N) or automatically when sampled reads show a
+key is hot. Readers which know a key is hot read a random replica, and re-read
+the original's shard map at least once every HOT_KEY_WINDOW_SECONDS. A Set()
+invalidates the replicas recorded in the previous shard map, and so does
+Delete(); only if the shard map was evicted does Delete() invalidate every
+possible replica.
 """
 
 import cPickle as pickle
 import logging
+import random
+import time as time_module
+import zlib
 from google.appengine.api import memcache
+from google.appengine.ext import ndb
 
 # Pseudo namespace for memcache values.
 MEMCACHE_PREFIX = 'sharded:'
@@ -38,81 +68,646 @@ DEFAULT_EXPIRATION_SECONDS = 24 * 60 * 60  # 1 day
 # Cutoff for when content will be sharded into multiple memcache entries.
 # Content less than this size will be stored with the shard_map dictionary and
 # only use a single memcache item total. This value needs to leave room for the
-# max number of bytes of the pickled shard_map dict (without content).
+# max number of bytes of the shard_map dict (without content).
 MIN_SHARDING_SIZE = memcache.MAX_VALUE_SIZE - 1000  # 999 KB
 
-def Get(key):
-  """Get a memcache entry, or None."""
-  key = MEMCACHE_PREFIX + key
-  shard_map = memcache.get(key)
-  if not shard_map:
-    # The shard_map was evicted or never set.
-    return
+# Byte strings of at least this size are considered for compression.
+MIN_COMPRESSION_SIZE = 1024
+
+# Compression is only applied if a leading sample of the value shrinks to this
+# fraction of its size or less, so incompressible content costs little CPU.
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+MAX_COMPRESSION_RATIO = 0.9
+
+# Favor speed: values are compressed on every Set() of a large blob.
+COMPRESSION_LEVEL = 1
+
+# Value encodings, recorded in the shard map.
+_ENCODING_PICKLE = 'pickle'
+_ENCODING_RAW = 'raw'
+_ENCODING_ZLIB = 'zlib'
+
+# Content shards start with a generation id of this many hex characters.
+_GENERATION_SIZE = 8
+
+# Number of content bytes per shard, leaving room for the generation id.
+_SHARD_SIZE = memcache.MAX_VALUE_SIZE - _GENERATION_SIZE
 
-  # If zero shards, the content was small enough and stored in the shard_map.
-  num_shards = shard_map['num_shards']
-  if num_shards == 0:
-    return pickle.loads(shard_map['content'])
+# Number of content shards fetched speculatively, in the same get_multi as the
+# shard map. Values of up to this many shards are read in one round trip.
+PREFETCH_SHARDS = 4
 
-  keys = ['%s%d' % (key, i) for i in range(num_shards)]
-  shards = memcache.get_multi(keys)
-  if len(shards) != num_shards:
-    # One or more content shards were evicted, delete map and content shards.
-    memcache.delete_multi([key] + keys)
+# Number of copies (including the original) made of a key detected as hot.
+HOT_KEY_REPLICAS = 4
+
+# Upper bound for replicas, explicit or not. Deletes of keys whose shard map was
+# evicted fan out to this many keys, so that no stale replica survives.
+MAX_HOT_KEY_REPLICAS = 16
+
+# Fraction of Get() calls which are counted for hot key detection.
+HOT_KEY_SAMPLE_RATE = 0.01
+
+# A key is hot when this many sampled reads land in one window. With the
+# defaults: about 1000 reads in 10 seconds, or 100 reads per second.
+HOT_KEY_SAMPLED_READS = 10
+HOT_KEY_WINDOW_SECONDS = 10
+
+# Fraction of operations recorded in Titan Stats. Recorded counts are scaled up
+# by the inverse, so graphs estimate true totals. 0 disables recording.
+STATS_SAMPLE_RATE = 0.01
+
+# The caller name used to tag Titan Stats counters when none is given.
+DEFAULT_STATS_CALLER = 'default'
+
+# Instance-local memory of keys known to be hot, mapping to two-tuples of
+# (replica count, expiration timestamp).
+_MAX_LOCAL_HOT_KEYS = 1000
+_hot_keys = {}
+
+def Get(key, caller=None):
+  """Get a memcache entry, or None.
+
+  Args:
+    key: The cache key.
+    caller: Optionally, a name for the caller used to tag Titan Stats.
+  Returns:
+    The value, or None if not found.
+  """
+  op_stats = _OperationStats(caller, 'get')
+  value = _Get(MEMCACHE_PREFIX + key, op_stats)
+  op_stats.CountValue(value)
+  op_stats.Log()
+  return value
+
+def _Get(key, op_stats):
+  num_replicas, expires = _hot_keys.get(key, (0, 0))
+  if num_replicas > 1 and expires > time_module.time():
+    replica = random.randrange(num_replicas)
+    if replica:
+      shard_map, value = _GetEntry(_ReplicaKey(key, replica), op_stats)
+      if shard_map is not None:
+        return value
+      # The replica was invalidated or evicted; fall back to the original.
+
+  shard_map, value = _GetEntry(key, op_stats)
+  if shard_map is None:
+    _hot_keys.pop(key, None)
     return
 
-  # All shards present, stitch contents back together and unpickle.
-  shards = tuple([shards[key] for key in keys])
-  value = '%s' * shard_map['num_shards']
-  value = pickle.loads(value % shards)
+  num_replicas = shard_map.get('replicas', 0)
+  if num_replicas > 1:
+    _RememberHotKey(key, num_replicas)
+  else:
+    _hot_keys.pop(key, None)
+    if random.random() < HOT_KEY_SAMPLE_RATE and _IsHotRead(key):
+      _ReplicateHotKey(key, shard_map, value)
   return value
 
-def Set(key, value, time=DEFAULT_EXPIRATION_SECONDS):
-  """Set a memcache entry."""
-  key = MEMCACHE_PREFIX + key
-  value = pickle.dumps(value)
+def Set(key, value, time=DEFAULT_EXPIRATION_SECONDS, replicas=0,
+        caller=None):
+  """Set a memcache entry.
 
-  # The original key is used as the shard map.
-  # The content shards are stored as '<key>0', '<key>1', etc.
-  num_shards = (len(value) / memcache.MAX_VALUE_SIZE) + 1
-  content_map = {}
-  content_map[key] = {'num_shards': num_shards}
-  for i in range(num_shards):
-    # [0:1MB] first, [1MB:2MB] second, etc.
-    begin_slice = i * memcache.MAX_VALUE_SIZE
-    end_slice = begin_slice + memcache.MAX_VALUE_SIZE
-    content_map[key + str(i)] = value[begin_slice:end_slice]
+  Args:
+    key: The cache key.
+    value: Any picklable value.
+    time: The expiration time, in seconds.
+    replicas: Optionally, the number of copies (including the original) to
+        store of a value which is known to be hot.
+    caller: Optionally, a name for the caller used to tag Titan Stats.
+  Returns:
+    True if the value was set, or if a failed set was cleaned up.
+  """
+  op_stats = _OperationStats(caller, 'set')
+  op_stats.CountValue(value)
+  key = MEMCACHE_PREFIX + key
+  replicas = min(replicas, MAX_HOT_KEY_REPLICAS)
+  encoding, value = _Encode(value)
 
-  # Optimization: for small content, store the content in the shard_map
-  # dictionary directly instead of actually sharding.
-  if num_shards == 1 and len(value) < MIN_SHARDING_SIZE:
-    content_map[key]['num_shards'] = num_shards = 0
-    content_map[key]['content'] = value
-    del content_map[key + '0']
+  content_map = _MakeContentMap(key, value, encoding)
+  previous_shard_map = memcache.get(key)
+  if replicas > 1:
+    content_map[key]['replicas'] = replicas
+    for i in range(1, replicas):
+      content_map.update(
+          _MakeContentMap(_ReplicaKey(key, i), value, encoding))
 
   # Set the shard map and all content shards.
   is_successful = True
   failed_keys = memcache.set_multi(content_map, time=time)
+  # Invalidate replicas and leftover shards of the previous value.
+  stale_keys = _StaleKeys(key, content_map[key], previous_shard_map)
   if failed_keys:
-    is_successful = False
+    op_stats.Count('failed')
     logging.error('Sharded cache set_multi failed. '
                   'Attempting to delete keys...\n %r', failed_keys)
     # Failed. Delete the sharp_map and any keys which succeeded.
-    delete_result = memcache.delete_multi(content_map.keys())
-    if delete_result:
+    if not memcache.delete_multi(content_map.keys() + stale_keys):
+      is_successful = False
+      op_stats.Count('cleanup_failed')
       logging.error('Sharded cache delete_multi failed! '
                     'Some keys may still remain and contaminate the cache.')
-    else:
-      # If the set_mutli failed but was cleaned up correctly, mark successful.
-      is_successful = True
+  elif stale_keys:
+    memcache.delete_multi(stale_keys)
+  op_stats.Log()
   return is_successful
 
-def Delete(key, seconds=0):
-  """Delete a memcache entry."""
-  key = MEMCACHE_PREFIX + key
+def Delete(key, seconds=0, caller=None):
+  """Delete a memcache entry.
+
+  Args:
+    key: The cache key.
+    seconds: Optional lock time, in seconds, during which adds are rejected.
+    caller: Optionally, a name for the caller used to tag Titan Stats.
+  Returns:
+    The result of memcache.delete_multi, or memcache.DELETE_ITEM_MISSING.
+  """
+  op_stats = _OperationStats(caller, 'delete')
+  op_stats.Count()
+  result = _Delete(MEMCACHE_PREFIX + key, seconds)
+  op_stats.Log()
+  return result
+
+def _Delete(key, seconds):
+  _hot_keys.pop(key, None)
   shard_map = memcache.get(key)
   if not shard_map:
-    # The shard_map was evicted or never set.
+    # The shard_map was evicted or never set, but replicas may still exist.
+    memcache.delete_multi(_ReplicaKeys(key), seconds=seconds)
     return memcache.DELETE_ITEM_MISSING
-  keys = [key] + ['%s%d' % (key, i) for i in range(shard_map['num_shards'])]
+  keys = [key] + _ShardKeys(key, shard_map['num_shards'])
+  keys.extend(_RecordedReplicaKeys(key, shard_map))
   return memcache.delete_multi(keys, seconds=seconds)
+
+def GetMulti(keys, caller=None):
+  """Get multiple memcache entries.
+
+  Unlike Get(), this always reads the original keys and never samples reads
+  for hot key detection.
+
+  Args:
+    keys: An iterable of cache keys.
+    caller: Optionally, a name for the caller used to tag Titan Stats.
+  Returns:
+    A dictionary of the found cache keys to their values.
+  """
+  op_stats = _OperationStats(caller, 'get')
+  full_keys = dict((MEMCACHE_PREFIX + key, key) for key in keys)
+  entries = _GetEntries(full_keys.keys(), op_stats)
+  values = {}
+  for full_key in full_keys:
+    _, value = entries.get(full_key, (None, None))
+    op_stats.CountValue(value)
+    if full_key in entries:
+      values[full_keys[full_key]] = value
+  op_stats.Log()
+  return values
+
+def SetMulti(mapping, time=DEFAULT_EXPIRATION_SECONDS, caller=None):
+  """Set multiple memcache entries in a single set_multi.
+
+  Args:
+    mapping: A dictionary of cache keys to picklable values.
+    time: The expiration time, in seconds.
+    caller: Optionally, a name for the caller used to tag Titan Stats.
+  Returns:
+    A list of the cache keys which could not be set. Their partially-written
+    entries are deleted.
+  """
+  op_stats = _OperationStats(caller, 'set')
+  previous_shard_maps = memcache.get_multi(
+      [MEMCACHE_PREFIX + key for key in mapping])
+  content_maps = {}
+  all_content = {}
+  for key, value in mapping.iteritems():
+    op_stats.CountValue(value)
+    encoding, value = _Encode(value)
+    content_map = _MakeContentMap(MEMCACHE_PREFIX + key, value, encoding)
+    content_maps[key] = content_map
+    all_content.update(content_map)
+  failed_memcache_keys = set(memcache.set_multi(all_content, time=time) or [])
+
+  failed_keys = []
+  delete_keys = []
+  for key, content_map in content_maps.iteritems():
+    full_key = MEMCACHE_PREFIX + key
+    if failed_memcache_keys.intersection(content_map):
+      failed_keys.append(key)
+      delete_keys.extend(content_map)
+    delete_keys.extend(_StaleKeys(
+        full_key, content_map[full_key], previous_shard_maps.get(full_key)))
+  if failed_keys:
+    op_stats.Count('failed', len(failed_keys))
+    logging.error('Sharded cache set_multi failed for keys: %r', failed_keys)
+  # Cleanup and invalidation of all keys share a single delete_multi.
+  if delete_keys and not memcache.delete_multi(delete_keys) and failed_keys:
+    op_stats.Count('cleanup_failed', len(failed_keys))
+  op_stats.Log()
+  return failed_keys
+
+def DeleteMulti(keys, seconds=0, caller=None):
+  """Delete multiple memcache entries with one get_multi and one delete_multi.
+
+  Args:
+    keys: An iterable of cache keys.
+    seconds: Optional lock time, in seconds, during which adds are rejected.
+    caller: Optionally, a name for the caller used to tag Titan Stats.
+  Returns:
+    True if all deletes succeeded, False otherwise.
+  """
+  full_keys = [MEMCACHE_PREFIX + key for key in keys]
+  if not full_keys:
+    return True
+  op_stats = _OperationStats(caller, 'delete')
+  op_stats.Count(value=len(full_keys))
+  shard_maps = memcache.get_multi(full_keys)
+  result = memcache.delete_multi(
+      _DeleteKeys(full_keys, shard_maps), seconds=seconds)
+  op_stats.Log()
+  return result
+
+@ndb.tasklet
+def GetAsync(key, caller=None):
+  """Asynchronous version of Get().
+
+  Unlike Get(), this always reads the original key and never samples reads
+  for hot key detection.
+
+  Returns:
+    An ndb.Future of the value, or of None.
+  """
+  op_stats = _OperationStats(caller, 'get')
+  key = MEMCACHE_PREFIX + key
+  entries = yield _GetEntriesAsync([key], op_stats)
+  _, value = entries.get(key, (None, None))
+  op_stats.CountValue(value)
+  op_stats.Log()
+  raise ndb.Return(value)
+
+@ndb.tasklet
+def SetAsync(key, value, time=DEFAULT_EXPIRATION_SECONDS, caller=None):
+  """Asynchronous version of Set(), without replicas.
+
+  Returns:
+    An ndb.Future of True if the value was set, False otherwise.
+  """
+  op_stats = _OperationStats(caller, 'set')
+  op_stats.CountValue(value)
+  key = MEMCACHE_PREFIX + key
+  encoding, value = _Encode(value)
+  content_map = _MakeContentMap(key, value, encoding)
+  client = memcache.Client()
+  previous_shard_maps = yield client.get_multi_async([key])
+  # The result maps keys to statuses, or is None if the RPC failed.
+  statuses = yield client.set_multi_async(content_map, time=time)
+  is_successful = bool(statuses) and all(
+      status == memcache.STORED for status in statuses.itervalues())
+  delete_keys = _StaleKeys(key, content_map[key], previous_shard_maps.get(key))
+  if not is_successful:
+    op_stats.Count('failed')
+    logging.error('Sharded cache set_multi_async failed. Deleting keys...')
+    delete_keys.extend(content_map)
+  if delete_keys:
+    delete_statuses = yield client.delete_multi_async(delete_keys)
+    if delete_statuses is None and not is_successful:
+      op_stats.Count('cleanup_failed')
+  op_stats.Log()
+  raise ndb.Return(is_successful)
+
+@ndb.tasklet
+def DeleteAsync(key, seconds=0, caller=None):
+  """Asynchronous version of Delete().
+
+  Returns:
+    An ndb.Future of True if the delete succeeded, False otherwise.
+  """
+  op_stats = _OperationStats(caller, 'delete')
+  op_stats.Count()
+  key = MEMCACHE_PREFIX + key
+  client = memcache.Client()
+  shard_maps = yield client.get_multi_async([key])
+  statuses = yield client.delete_multi_async(
+      _DeleteKeys([key], shard_maps), seconds=seconds)
+  op_stats.Log()
+  raise ndb.Return(statuses is not None)
+
+class _OperationStats(object):
+  """Records counters and the latency of one cache operation in Titan Stats.
+
+  Only a STATS_SAMPLE_RATE fraction of operations is recorded; counts are
+  scaled up accordingly. Counters are named like
+  'sharded_cache/<caller>/get/hit' and can be graphed at /_titan/stats/graph.
+  """
+
+  def __init__(self, caller, operation):
+    self.is_sampled = random.random() < STATS_SAMPLE_RATE
+    self._counter_prefix = 'sharded_cache/%s/%s' % (
+        caller or DEFAULT_STATS_CALLER, operation)
+    self._counts = {}
+    self._start = time_module.time()
+
+  def Count(self, name=None, value=1):
+    """Offsets the operation's counter, or one of its named sub-counters."""
+    if self.is_sampled:
+      self._counts[name] = self._counts.get(name, 0) + value
+
+  def CountValue(self, value):
+    """Counts a get hit or miss, or a set, and the bytes of string values."""
+    if self._counter_prefix.endswith('/get'):
+      self.Count('miss' if value is None else 'hit')
+    else:
+      self.Count()
+    if isinstance(value, str):
+      self.Count('bytes', len(value))
+
+  def Log(self):
+    if not self.is_sampled:
+      return
+    # Imported here since titan.stats depends on titan.files, which uses this
+    # module.
+    from titan import stats
+    scale = 1.0 / STATS_SAMPLE_RATE
+    counters = []
+    for name, value in self._counts.iteritems():
+      counter_name = self._counter_prefix
+      if name is not None:
+        counter_name = '%s/%s' % (self._counter_prefix, name)
+      counter = stats.Counter(counter_name)
+      counter.offset(int(round(value * scale)))
+      counters.append(counter)
+    latency_counter = stats.AverageTimingCounter(
+        self._counter_prefix + '/latency')
+    latency_counter.offset(int((time_module.time() - self._start) * 1000))
+    counters.append(latency_counter)
+    stats.log_counters(counters, counters_func=_MakeEmptyCounters)
+
+def _MakeEmptyCounters():
+  # Counter names depend on callers; Titan Stats infers their types.
+  return []
+
+def _DeleteKeys(keys, shard_maps):
+  """Returns all keys to delete for full memcache keys and their shard maps."""
+  delete_keys = []
+  for key in keys:
+    _hot_keys.pop(key, None)
+    delete_keys.append(key)
+    shard_map = shard_maps.get(key)
+    if shard_map:
+      delete_keys.extend(_ShardKeys(key, shard_map['num_shards']))
+      delete_keys.extend(_RecordedReplicaKeys(key, shard_map))
+    else:
+      # The shard_map was evicted or never set, but replicas may still exist.
+      delete_keys.extend(_ReplicaKeys(key))
+  return delete_keys
+
+def _MakeContentMap(key, value, encoding):
+  """Returns a dictionary of memcache keys to the shard map and shards."""
+  # The original key is used as the shard map.
+  # The content shards are stored as '<key>0', '<key>1', etc.
+  num_shards = (len(value) / _SHARD_SIZE) + 1
+  content_map = {}
+
+  # Optimization: for small content, store the content in the shard_map
+  # dictionary directly instead of actually sharding.
+  if num_shards == 1 and len(value) < MIN_SHARDING_SIZE:
+    content_map[key] = {
+        'num_shards': 0,
+        'encoding': encoding,
+        'content': value,
+    }
+    return content_map
+
+  generation = '%0*x' % (_GENERATION_SIZE, random.getrandbits(
+      _GENERATION_SIZE * 4))
+  content_map[key] = {
+      'num_shards': num_shards,
+      'encoding': encoding,
+      'generation': generation,
+      'checksum': _Checksum(value),
+  }
+  for i in range(num_shards):
+    # [0:1MB] first, [1MB:2MB] second, etc., each prefixed by the generation.
+    begin_slice = i * _SHARD_SIZE
+    end_slice = begin_slice + _SHARD_SIZE
+    content_map[key + str(i)] = generation + value[begin_slice:end_slice]
+  return content_map
+
+def _Encode(value):
+  """Returns a two-tuple of (encoding, encoded byte string) for a value."""
+  # Exact type check: subclasses of str must be pickled to round-trip.
+  if type(value) is not str:
+    return _ENCODING_PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+  if len(value) >= MIN_COMPRESSION_SIZE:
+    sample = value[:COMPRESSION_SAMPLE_SIZE]
+    compressed_sample = zlib.compress(sample, COMPRESSION_LEVEL)
+    if len(compressed_sample) <= len(sample) * MAX_COMPRESSION_RATIO:
+      compressed_value = zlib.compress(value, COMPRESSION_LEVEL)
+      if len(compressed_value) <= len(value) * MAX_COMPRESSION_RATIO:
+        return _ENCODING_ZLIB, compressed_value
+  return _ENCODING_RAW, value
+
+def _Decode(shard_map, value):
+  # Entries without an encoding were written when every value was pickled.
+  encoding = shard_map.get('encoding', _ENCODING_PICKLE)
+  if encoding == _ENCODING_RAW:
+    return value
+  if encoding == _ENCODING_ZLIB:
+    return zlib.decompress(value)
+  return pickle.loads(value)
+
+def _JoinShards(shard_map, shards):
+  """Returns the reassembled content of shards, or None if they don't match."""
+  if None in shards:
+    # One or more content shards were evicted.
+    return None
+  generation = shard_map.get('generation')
+  if generation is None:
+    # Untagged shards, written before generations were recorded.
+    return ''.join(shards)
+  for shard in shards:
+    if not shard.startswith(generation):
+      # The shard was written by another Set().
+      return None
+  value = ''.join([shard[len(generation):] for shard in shards])
+  if _Checksum(value) != shard_map['checksum']:
+    logging.error('Sharded cache checksum mismatch, treating as a miss.')
+    return None
+  return value
+
+def _Checksum(value):
+  return zlib.crc32(value) & 0xffffffff
+
+def _GetEntry(key, op_stats=None):
+  """Returns a two-tuple of (shard_map, value) for a full memcache key.
+
+  Returns:
+    The shard map and the value, or (None, None) if not found.
+  """
+  return _GetEntries([key], op_stats).get(key, (None, None))
+
+def _GetEntries(keys, op_stats=None):
+  """Returns a dictionary of full memcache keys to (shard_map, value) tuples.
+
+  The shard maps and the first PREFETCH_SHARDS content shards of every key are
+  fetched in a single get_multi, so only larger values need a second round
+  trip. Missing or partially evicted entries are left out.
+  """
+  results = memcache.get_multi(_PrefetchKeys(keys))
+  remaining_keys = _RemainingShardKeys(keys, results)
+  if remaining_keys:
+    results.update(memcache.get_multi(remaining_keys))
+  entries, broken_keys = _ParseEntries(keys, results)
+  if broken_keys:
+    if op_stats:
+      op_stats.Count('evicted', len(broken_keys))
+    memcache.delete_multi(broken_keys)
+  return entries
+
+@ndb.tasklet
+def _GetEntriesAsync(keys, op_stats=None):
+  """Asynchronous version of _GetEntries(); returns a Future."""
+  client = memcache.Client()
+  results = yield client.get_multi_async(_PrefetchKeys(keys))
+  remaining_keys = _RemainingShardKeys(keys, results)
+  if remaining_keys:
+    remaining_results = yield client.get_multi_async(remaining_keys)
+    results.update(remaining_results)
+  entries, broken_keys = _ParseEntries(keys, results)
+  if broken_keys:
+    if op_stats:
+      op_stats.Count('evicted', len(broken_keys))
+    yield client.delete_multi_async(broken_keys)
+  raise ndb.Return(entries)
+
+def _PrefetchKeys(keys):
+  """Returns the shard map keys and the first PREFETCH_SHARDS shard keys."""
+  prefetch_keys = []
+  for key in keys:
+    prefetch_keys.append(key)
+    prefetch_keys.extend(_ShardKeys(key, PREFETCH_SHARDS))
+  return prefetch_keys
+
+def _RemainingShardKeys(keys, results):
+  """Returns the shard keys which were not prefetched."""
+  remaining_keys = []
+  for key in keys:
+    shard_map = results.get(key)
+    if shard_map and shard_map['num_shards'] > PREFETCH_SHARDS:
+      remaining_keys.extend(
+          _ShardKeys(key, shard_map['num_shards'])[PREFETCH_SHARDS:])
+  return remaining_keys
+
+def _ParseEntries(keys, results):
+  """Reassembles entries from get_multi results.
+
+  Returns:
+    A two-tuple of a dictionary of full memcache keys to (shard_map, value)
+    tuples, and a list of shard map keys of broken entries to delete.
+  """
+  entries = {}
+  broken_keys = []
+  for key in keys:
+    shard_map = results.get(key)
+    if not shard_map:
+      # The shard_map was evicted or never set.
+      continue
+
+    # If zero shards, the content was small enough and stored in the shard_map.
+    num_shards = shard_map['num_shards']
+    if num_shards == 0:
+      entries[key] = (shard_map, _Decode(shard_map, shard_map['content']))
+      continue
+
+    shards = [results.get(shard_key)
+              for shard_key in _ShardKeys(key, num_shards)]
+    value = _JoinShards(shard_map, shards)
+    if value is None:
+      # Only the shard map is deleted, so that later reads miss right away.
+      # Orphaned shards can never be stitched into another value, and expire.
+      broken_keys.append(key)
+      continue
+
+    # All shards matched and were stitched back together.
+    entries[key] = (shard_map, _Decode(shard_map, value))
+  return entries, broken_keys
+
+def _ShardKeys(key, num_shards):
+  # The content shards are stored as '<key>0', '<key>1', etc.
+  return ['%s%d' % (key, i) for i in range(num_shards)]
+
+def _StaleKeys(key, shard_map, previous_shard_map):
+  """Returns keys a Set() of shard_map over previous_shard_map leaves stale.
+
+  If the previous shard map was evicted, any replicas it had are no longer
+  known; readers stop using them within HOT_KEY_WINDOW_SECONDS.
+  """
+  if not previous_shard_map:
+    return []
+  # Replicas of the previous value which the new value doesn't overwrite, and
+  # leftover shards of a larger previous value which Get() would prefetch.
+  stale_keys = [
+      _ReplicaKey(key, i) for i in range(
+          max(shard_map.get('replicas', 0), 1),
+          min(previous_shard_map.get('replicas', 0), MAX_HOT_KEY_REPLICAS))]
+  num_previous_shards = min(previous_shard_map['num_shards'], PREFETCH_SHARDS)
+  stale_keys.extend(
+      _ShardKeys(key, num_previous_shards)[shard_map['num_shards']:])
+  return stale_keys
+
+def _ReplicaKey(key, replica):
+  # Replica 0 is the original key.
+  return '%s@%d:' % (key, replica)
+
+def _ReplicaKeys(key, start=1):
+  return [_ReplicaKey(key, i) for i in range(start, MAX_HOT_KEY_REPLICAS)]
+
+def _RecordedReplicaKeys(key, shard_map):
+  """Returns the replica keys recorded in a key's shard map, as Set() wrote."""
+  num_replicas = min(shard_map.get('replicas', 0), MAX_HOT_KEY_REPLICAS)
+  return [_ReplicaKey(key, i) for i in range(1, num_replicas)]
+
+def _RememberHotKey(key, num_replicas):
+  if len(_hot_keys) >= _MAX_LOCAL_HOT_KEYS:
+    _hot_keys.clear()
+  # Expire, so that the original's shard map is periodically re-read. Replicas
+  # can outlive an evicted shard map, and then are never invalidated by Set().
+  _hot_keys[key] = (num_replicas, time_module.time() + HOT_KEY_WINDOW_SECONDS)
+
+def _IsHotRead(key):
+  """Counts a sampled read, and returns whether the key just became hot."""
+  window = int(time_module.time() / HOT_KEY_WINDOW_SECONDS)
+  counter_key = '%s@reads:%d' % (key, window)
+  num_reads = memcache.incr(counter_key)
+  if num_reads is None:
+    memcache.add(counter_key, 1, time=HOT_KEY_WINDOW_SECONDS * 2)
+    num_reads = 1
+  # Only the read which crosses the threshold triggers replication.
+  return num_reads == HOT_KEY_SAMPLED_READS
+
+def _ReplicateHotKey(key, read_shard_map, value):
+  """Copies a value to replica keys and flags the original's shard map.
+
+  Args:
+    key: The full memcache key.
+    read_shard_map: The shard map which was read together with the value.
+    value: The decoded value.
+  """
+  client = memcache.Client()
+  shard_map = client.gets(key)
+  # The shard map identifies the value by its generation and checksum, or by
+  # its content if unsharded. Skip if the value was replaced since it was read.
+  if shard_map != read_shard_map or shard_map.get('replicas'):
+    return
+  encoding, value = _Encode(value)
+  content_map = {}
+  for i in range(1, HOT_KEY_REPLICAS):
+    content_map.update(_MakeContentMap(_ReplicaKey(key, i), value, encoding))
+  if memcache.set_multi(content_map, time=DEFAULT_EXPIRATION_SECONDS):
+    memcache.delete_multi(content_map.keys())
+    return
+  # Compare-and-set the flag: if a concurrent Set() replaced the value since it
+  # was read, the replicas just written are stale and must be removed.
+  shard_map['replicas'] = HOT_KEY_REPLICAS
+  if client.cas(key, shard_map, time=DEFAULT_EXPIRATION_SECONDS):
+    _RememberHotKey(key, HOT_KEY_REPLICAS)
+  else:
+    memcache.delete_multi(content_map.keys())
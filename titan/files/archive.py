@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Export and import Titan file trees as a single tar.gz archive.
+
+Each file becomes one tar member named by its path (without the leading
+slash). File metadata (mime_type, encoding, meta, created, modified,
+created_by, modified_by) is stored in PAX extended headers of the member.
+
+Usage:
+  # Stream a tree into any file-like object:
+  archive.export_archive('/some/dir', fileobj)
+  # Or into blobstore:
+  blob_key, num_files = archive.export_to_blobstore('/some/dir')
+  # Or into blobstore from a deferred task, for trees too big for a request:
+  job = archive.defer_export_to_blobstore('/some/dir')
+  # Later, once job.is_done: job.blob_key, job.num_processed
+
+  # Import an archive, optionally under a different root directory:
+  archive.import_archive(fileobj, dir_path='/restored')
+"""
+
+import calendar
+import cStringIO
+import datetime
+import hashlib
+import json
+import os
+import tarfile
+
+from google.appengine.api import files as blobstore_files
+from google.appengine.ext import blobstore
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
+
+from titan import files
+from titan import users
+from titan.common import utils
+from titan.files import dirs
+
+__all__ = [
+    # Constants.
+    'ARCHIVE_MIME_TYPE',
+    'DEFAULT_PAGE_SIZE',
+    # Errors.
+    'Error',
+    'InvalidArchiveError',
+    # Functions.
+    'defer_export_to_blobstore',
+    'export_archive',
+    'export_to_blobstore',
+    'import_archive',
+]
+
+ARCHIVE_MIME_TYPE = 'application/x-gzip'
+
+# Number of file entities fetched per query page on export, and written per
+# put_multi batch on import.
+DEFAULT_PAGE_SIZE = 100
+
+_PAX_PREFIX = 'TITAN.'
+
+class Error(Exception):
+  pass
+
+class InvalidArchiveError(Error):
+  pass
+
+def export_archive(dir_path, fileobj, namespace=None, recursive=True,
+                   depth=None, filters=None, page_size=DEFAULT_PAGE_SIZE):
+  """Stream a tar.gz archive of the files under a directory.
+
+  Args:
+    dir_path: Absolute directory path.
+    fileobj: A writable file-like object. Only write() is required.
+    namespace: The filesystem namespace, or None if the default namespace.
+    recursive: Whether to export files recursively.
+    depth: If recursive, a positive integer to limit the recursion depth.
+    filters: An iterable of files.FileProperty comparisons.
+    page_size: The number of file entities fetched per query page.
+  Raises:
+    ValueError: If given invalid query arguments.
+  Returns:
+    The number of files written to the archive.
+  """
+  files_query = files._create_files_query(
+      dir_path, namespace=namespace, recursive=recursive, depth=depth,
+      filters=filters)
+  num_files = 0
+  tar = tarfile.open(fileobj=fileobj, mode='w|gz', format=tarfile.PAX_FORMAT,
+                     encoding='utf-8')
+  try:
+    cursor = None
+    while True:
+      file_ents, cursor, has_more = files_query.fetch_page(
+          page_size, start_cursor=cursor)
+      for file_ent in file_ents:
+        content = _read_raw_content(file_ent, namespace=namespace)
+        tar.addfile(_make_tarinfo(file_ent, len(content)),
+                    cStringIO.StringIO(content))
+        num_files += 1
+      if not has_more or not cursor:
+        break
+  finally:
+    tar.close()
+  return num_files
+
+def export_to_blobstore(dir_path, **kwargs):
+  """Export a tar.gz archive of a directory into a new blob.
+
+  Args:
+    dir_path: Absolute directory path.
+    **kwargs: Keyword arguments passed through to export_archive().
+  Returns:
+    A two-tuple of (BlobKey, number of files exported).
+  """
+  filename = blobstore_files.blobstore.create(mime_type=ARCHIVE_MIME_TYPE)
+  blobstore_file = blobstore_files.open(filename, 'a')
+  try:
+    num_files = export_archive(
+        dir_path, _ChunkedWriter(blobstore_file), **kwargs)
+  finally:
+    blobstore_file.close()
+  blobstore_files.finalize(filename)
+  return blobstore_files.blobstore.get_blob_key(filename), num_files
+
+def defer_export_to_blobstore(dir_path, namespace=None, recursive=True,
+                              depth=None, blob_expiration_seconds=None,
+                              queue=files.DEFAULT_JOB_QUEUE):
+  """Export a tar.gz archive of a directory into a new blob, in a task.
+
+  Args:
+    dir_path: Absolute directory path.
+    namespace: The filesystem namespace, or None if the default namespace.
+    recursive: Whether to export files recursively.
+    depth: If recursive, a positive integer to limit the recursion depth.
+    blob_expiration_seconds: If given, the blob is deleted this many seconds
+        after the export finishes.
+    queue: The task queue used for the deferred export.
+  Raises:
+    ValueError: If given invalid query arguments.
+  Returns:
+    A files.FilesJob. Once it is successful, its blob_key is the archive and
+    its num_processed the number of exported files.
+  """
+  # Validate up front, so that bad arguments fail the request, not the task.
+  files._validate_list_args(dir_path, recursive=recursive, depth=depth)
+  if namespace is not None:
+    utils.validate_namespace(namespace)
+  job = files.FilesJob.new(namespace=namespace)
+  deferred.defer(
+      _export_to_blobstore_task, job.key, dir_path, namespace, recursive,
+      depth, blob_expiration_seconds, _queue=queue,
+      _retry_options=files._make_job_retry_options())
+  return job
+
+def import_archive(fileobj, dir_path='/', namespace=None,
+                   batch_size=DEFAULT_PAGE_SIZE, update_dirs=True):
+  """Import a tar.gz archive produced by export_archive().
+
+  Existing files at the same paths are overwritten. Writes bypass File mixins
+  and are done in put_multi batches, followed by one change journal append
+  and one directory update per batch.
+
+  Args:
+    fileobj: A readable file-like object of the archive.
+    dir_path: The absolute directory path to import files into.
+    namespace: The filesystem namespace, or None if the default namespace.
+    batch_size: The number of files written per put_multi batch.
+    update_dirs: Whether or not to update directory entities.
+  Raises:
+    InvalidArchiveError: If the archive cannot be read.
+    ValueError: If the archive contains invalid paths.
+  Returns:
+    A list of the imported file paths.
+  """
+  utils.validate_dir_path(dir_path)
+  if namespace is not None:
+    utils.validate_namespace(namespace)
+  try:
+    tar = tarfile.open(fileobj=fileobj, mode='r|*', encoding='utf-8')
+  except tarfile.TarError as e:
+    raise InvalidArchiveError('Could not read archive: %s' % e)
+
+  imported_paths = []
+  pending_file_ents = []
+  try:
+    for tarinfo in tar:
+      if not tarinfo.isfile():
+        continue
+      path = utils.safe_join(dir_path, tarinfo.name.decode('utf-8'))
+      files.File.validate_path(path)
+      content = tar.extractfile(tarinfo).read()
+      pending_file_ents.append(
+          _make_file_ent(path, namespace, content, tarinfo.pax_headers))
+      if len(pending_file_ents) >= batch_size:
+        _put_file_ents(pending_file_ents, namespace, update_dirs=update_dirs)
+        imported_paths.extend([ent.path for ent in pending_file_ents])
+        pending_file_ents = []
+  except tarfile.TarError as e:
+    raise InvalidArchiveError('Could not read archive: %s' % e)
+  finally:
+    tar.close()
+  if pending_file_ents:
+    _put_file_ents(pending_file_ents, namespace, update_dirs=update_dirs)
+    imported_paths.extend([ent.path for ent in pending_file_ents])
+  return imported_paths
+
+def _export_to_blobstore_task(job_key, dir_path, namespace, recursive, depth,
+                              blob_expiration_seconds):
+  """Deferred task of defer_export_to_blobstore()."""
+
+  def _export():
+    blob_key, num_files = export_to_blobstore(
+        dir_path, namespace=namespace, recursive=recursive, depth=depth)
+
+    def _finish():
+      if not files._finish_blob_job(job_key, namespace, blob_key, num_files):
+        return False
+      if blob_expiration_seconds:
+        deferred.defer(blobstore.delete, blob_key,
+                       _countdown=blob_expiration_seconds, _transactional=True)
+      return True
+
+    if not ndb.transaction(_finish):
+      # A previous attempt of this task already finished the job.
+      blobstore.delete(blob_key)
+
+  files._run_job_task(job_key, namespace, _export)
+
+class _ChunkedWriter(object):
+  """File-like wrapper that splits writes under the blobstore RPC limit."""
+
+  def __init__(self, fileobj):
+    self._fileobj = fileobj
+
+  def write(self, data):
+    for i in xrange(0, len(data), utils.BLOBSTORE_APPEND_CHUNK_SIZE):
+      self._fileobj.write(data[i:i + utils.BLOBSTORE_APPEND_CHUNK_SIZE])
+
+def _read_raw_content(file_ent, namespace=None):
+  """Returns the undecoded byte-string content of a file entity."""
+  if file_ent.content is not None:
+    return file_ent.content
+  titan_file = files.File(
+      file_ent.path, namespace=namespace, _file_ent=file_ent, _internal=True)
+  content = files._read_content_or_blob(titan_file)
+  if file_ent.encoding:
+    content = content.encode(file_ent.encoding)
+  return content
+
+def _to_timestamp(value):
+  return calendar.timegm(value.utctimetuple()) + 1e-6 * value.microsecond
+
+def _make_tarinfo(file_ent, size):
+  headers = {
+      'mime_type': file_ent.mime_type,
+      'encoding': file_ent.encoding,
+      'meta': json.dumps(file_ent.meta_properties,
+                         cls=utils.CustomJsonEncoder),
+      'created': repr(_to_timestamp(file_ent.created)),
+      'modified': repr(_to_timestamp(file_ent.modified)),
+      'created_by': file_ent.created_by and file_ent.created_by.email,
+      'modified_by': file_ent.modified_by and file_ent.modified_by.email,
+  }
+  tarinfo = tarfile.TarInfo(name=file_ent.path[1:].encode('utf-8'))
+  tarinfo.size = size
+  tarinfo.mtime = int(_to_timestamp(file_ent.modified))
+  tarinfo.mode = 0644
+  tarinfo.pax_headers = dict(
+      (unicode(_PAX_PREFIX + key), unicode(value))
+      for key, value in headers.iteritems() if value is not None)
+  return tarinfo
+
+def _make_file_ent(path, namespace, content, pax_headers):
+  """Creates an unsaved _TitanFile from an archive member."""
+  headers = {}
+  for key, value in pax_headers.iteritems():
+    if key.startswith(_PAX_PREFIX):
+      headers[key[len(_PAX_PREFIX):]] = value
+  meta = json.loads(headers.get('meta', '{}'))
+  files._TitanFile.validate_meta_properties(meta)
+
+  now = datetime.datetime.now()
+  created = now
+  modified = now
+  if 'created' in headers:
+    created = datetime.datetime.utcfromtimestamp(float(headers['created']))
+  if 'modified' in headers:
+    modified = datetime.datetime.utcfromtimestamp(float(headers['modified']))
+  current_user = users.get_current_user()
+  created_by = current_user
+  modified_by = current_user
+  if headers.get('created_by'):
+    created_by = users.TitanUser(headers['created_by'])
+  if headers.get('modified_by'):
+    modified_by = users.TitanUser(headers['modified_by'])
+
+  blob = None
+  chunks = []
+  md5_hash = hashlib.md5(content).hexdigest()
+  if files._storage_config.should_chunk(content):
+    chunks = files._write_chunks(content, namespace=namespace)
+    content = None
+  elif len(content) > files.MAX_CONTENT_SIZE:
+    blob = utils.write_to_blobstore(content)
+    content = None
+    md5_hash = None
+
+  paths = utils.split_path(path)
+  file_ent = files._TitanFile(
+      # NDB args:
+      id=path,
+      namespace=namespace,
+      # Model:
+      name=os.path.basename(path),
+      dir_path=paths[-1],
+      paths=paths,
+      depth=len(paths) - 1,
+      mime_type=headers.get('mime_type') or utils.guess_mime_type(path),
+      encoding=headers.get('encoding') or None,
+      created=created,
+      modified=modified,
+      content=content,
+      blob=blob,
+      blobs=[],
+      chunks=chunks,
+      created_by=created_by,
+      modified_by=modified_by,
+      md5_hash=md5_hash,
+  )
+  for key, value in meta.iteritems():
+    setattr(file_ent, key, value)
+  return file_ent
+
+def _put_file_ents(file_ents, namespace, update_dirs=True):
+  """Writes a batch of imported entities and cleans up replaced blobs."""
+  paths = [ent.path for ent in file_ents]
+  old_file_ents = files._get_titan_file_ents(paths, namespace=namespace)
+  ndb.put_multi(file_ents)
+  files._bump_listing_generations(paths, namespace=namespace)
+  files._journal_file_changes(
+      paths, files.CHANGE_ACTION_WRITE, namespace=namespace,
+      md5_hashes=[ent.md5_hash for ent in file_ents])
+
+  # Delete replaced blobs and chunks only after the new entities are saved.
+  old_blobs = []
+  old_chunks = []
+  for old_file_ent in old_file_ents.itervalues():
+    if old_file_ent.blob:
+      old_blobs.append(blobstore.BlobInfo(old_file_ent.blob))
+    old_chunks.extend(old_file_ent.chunks)
+  if old_blobs:
+    files._delete_blobs(blobs=old_blobs, file_paths=old_file_ents.keys())
+  if old_chunks:
+    ndb.delete_multi(old_chunks)
+
+  if update_dirs:
+    modified_paths = []
+    for path in paths:
+      modified_paths.append(dirs.ModifiedPath(
+          path, namespace=namespace, modified=0,
+          action=dirs.ModifiedPath.WRITE))
+    dir_service = dirs.DirService()
+    affected_dirs = dir_service.compute_affected_dirs(modified_paths)
+    dir_service.update_affected_dirs(**affected_dirs)
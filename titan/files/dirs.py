@@ -15,13 +15,17 @@
 
 import collections
 import datetime
+import hashlib
 import json
+import logging
 import os
 import time
+from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 from titan import files
 from titan.common import utils
+from titan.tasks import deferred
 
 WINDOW_SIZE_SECONDS = 10
 TASKQUEUE_NAME = 'titan-dirs'
@@ -31,6 +35,23 @@ TASKQUEUE_LEASE_ETA_BUFFER = TASKQUEUE_LEASE_SECONDS
 DEFAULT_CRON_RUNTIME_SECONDS = 60
 INITIALIZER_BATCH_SIZE = 100
 INITIALIZER_NUM_BATCHES = 50
+INITIALIZER_NUM_SHARDS = 8
+# Number of __scatter__ samples per shard used to split key ranges.
+_INITIALIZER_OVERSAMPLING = 32
+# Max number of directory emptiness queries in flight at once.
+MAX_CONCURRENT_DIR_CHECKS = 50
+# Dirs known to be available are remembered in memcache, which every instance
+# invalidates before deleting a dir.
+KNOWN_DIRS_MEMCACHE_SECONDS = 24 * 60 * 60
+# Number of dir entities fetched per query page by Dirs.walk().
+DEFAULT_WALK_PAGE_SIZE = 500
+# Cached Dirs.list() results are invalidated whenever a sub-directory changes
+# status. Since queries are eventually consistent, they also expire.
+DIR_LISTING_MEMCACHE_SECONDS = 10 * 60
+
+_KNOWN_DIR_MEMCACHE_PREFIX = 'titan-known-dir:'
+_DIR_LISTING_MEMCACHE_PREFIX = 'titan-dir-listing:'
+_DIR_LISTING_GENERATION_MEMCACHE_PREFIX = 'titan-dir-listing-gen:'
 
 _STATUS_AVAILABLE = 1
 _STATUS_DELETED = 2
@@ -61,16 +82,34 @@ class DirManagerMixin(files.File):
     # rarely occur when many parent dirs don't exist and a large set of files
     # with common parent parents are concurrently created).
     self.update_titan_dirs(async=async)
+    self.add_titan_file_change(files.CHANGE_ACTION_WRITE)
+    files._bump_listing_generations([self.real_path], namespace=self.namespace)
     return result
 
   def delete(self, *args, **kwargs):
     result = super(DirManagerMixin, self).delete(*args, **kwargs)
     # Update dirs eventually.
     self.add_titan_dir_delete_task()
+    self.add_titan_file_change(files.CHANGE_ACTION_DELETE)
+    files._bump_listing_generations([self.real_path], namespace=self.namespace)
     return result
 
+  def add_titan_file_change(self, action):
+    """Append this file's modification to the namespace's change journal."""
+    md5_hash = None
+    if action == files.CHANGE_ACTION_WRITE and self._file_ent:
+      # Blobstore files don't store a hash on the entity; avoid the extra RPC.
+      md5_hash = self._file_ent.md5_hash
+    files._journal_file_changes(
+        [self.real_path], action, namespace=self.namespace,
+        md5_hashes=[md5_hash])
+
   def update_titan_dirs(self, async=True):
     """Updates parent path directories to make sure they exist."""
+    # Parents of an available dir are always available, so if the direct
+    # parent is known to exist there is nothing to update.
+    if _is_known_dir(os.path.dirname(self.real_path), namespace=self.namespace):
+      return
     modified_path = ModifiedPath(
         path=self.real_path,
         namespace=self.namespace,
@@ -106,7 +145,7 @@ class DirManagerMixin(files.File):
     task = taskqueue.Task(
         method='PULL',
         payload=json.dumps(path_data),
-        tag=str(window),
+        tag=_make_task_tag(window, namespace=self.namespace),
         eta=current_task_eta)
     task.add(queue_name=TASKQUEUE_NAME)
 
@@ -123,6 +162,10 @@ class DirTaskConsumer(object):
   def process_next_window(self):
     """Lease one window-worth of tasks and update the corresponding dirs.
 
+    Tasks are tagged by window and namespace. Leased tasks are hidden from
+    other consumers, so several consumers can run in parallel, each working
+    on a different window.
+
     Returns:
       A list of ModifiedPaths.
     """
@@ -147,6 +190,7 @@ class DirTaskConsumer(object):
     # Package each task's data into a ModifiedPath and pass it on.
     # Don't deal with ordering or chronologically collapsing paths here.
     modified_paths = []
+    namespace_modified_paths = collections.defaultdict(list)
     for task in tasks:
       path_data = json.loads(task.payload)
       modified_path = ModifiedPath(
@@ -156,11 +200,15 @@ class DirTaskConsumer(object):
           action=path_data['action'],
       )
       modified_paths.append(modified_path)
+      namespace_modified_paths[modified_path.namespace].append(modified_path)
 
     # Compute the affected directories and then update them if needed.
+    # Tags are per-namespace, but tasks added before that may still mix
+    # namespaces in one window.
     dir_service = DirService()
-    affected_dirs = dir_service.compute_affected_dirs(modified_paths)
-    dir_service.update_affected_dirs(**affected_dirs)
+    for namespace_paths in namespace_modified_paths.itervalues():
+      affected_dirs = dir_service.compute_affected_dirs(namespace_paths)
+      dir_service.update_affected_dirs(**affected_dirs)
 
     for tasks_to_delete in utils.chunk_generator(tasks):
       queue.delete_tasks(tasks_to_delete)
@@ -175,12 +223,45 @@ class DirTaskConsumer(object):
     Returns:
       A list of results from process_next_window().
     """
+    self.log_backlog()
     results = utils.run_with_backoff(
         func=self.process_next_window,
         runtime=runtime,
         max_backoff=TASKQUEUE_LEASE_SECONDS)
     return results
 
+  def get_backlog(self):
+    """Get the size and lag of the dir tasks backlog.
+
+    Returns:
+      A dictionary containing 'num_tasks', the number of tasks in the queue,
+      and 'lag_seconds', how long ago the oldest task became available for
+      lease (0 if none are available yet).
+    """
+    queue_stats = taskqueue.Queue(TASKQUEUE_NAME).fetch_statistics()
+    lag_seconds = 0
+    if queue_stats.oldest_eta_usec:
+      lag_seconds = max(time.time() - queue_stats.oldest_eta_usec / 1e6, 0)
+    return {
+        'num_tasks': queue_stats.tasks,
+        'lag_seconds': lag_seconds,
+    }
+
+  def log_backlog(self):
+    """Record the dir tasks backlog in Titan Stats and return it."""
+    # Imported here since titan.stats depends on titan.files.
+    from titan import stats
+    backlog = self.get_backlog()
+    logging.info('Dir tasks backlog: %(num_tasks)d tasks, %(lag_seconds).1fs '
+                 'lag.', backlog)
+    num_tasks_counter = stats.AverageCounter('dirs/backlog/num_tasks')
+    num_tasks_counter.offset(backlog['num_tasks'])
+    lag_counter = stats.AverageCounter('dirs/backlog/lag_seconds')
+    lag_counter.offset(backlog['lag_seconds'])
+    stats.log_counters([num_tasks_counter, lag_counter],
+                       counters_func=_make_backlog_counters)
+    return backlog
+
 class ModifiedPath(object):
   """Simple container for metadata about the type of path modification."""
 
@@ -225,20 +306,17 @@ class DirService(object):
       A dictionary containing 'dirs_with_adds' and 'dirs_with_deletes',
       both of which are sets of strings containing the affect dir paths.
     """
-    if modified_paths:
-      namespace = modified_paths[0].namespace
+    namespace = modified_paths[0].namespace if modified_paths else None
     # First, merge file path modifications.
     # Perform an in-order pass to get the final modified state of each file.
     sorted_paths = sorted(modified_paths, key=lambda path: path.modified)
-    new_modified_paths = {}
+    final_actions = {}
     for modified_path in sorted_paths:
       if modified_path.namespace != namespace:
         raise NamespaceMismatchError(
             'Namespace "{}" does not match namespace "{}".'.format(
                 modified_path.namespace, namespace))
-      new_modified_paths[modified_path.path] = modified_path
-    sorted_paths = sorted(new_modified_paths.values(),
-                          key=lambda path: path.modified)
+      final_actions[modified_path.path] = modified_path.action
 
     # Second, generate the set of affected directory paths.
     # This does not need to collapse dirs which are added and then deleted,
@@ -246,12 +324,11 @@ class DirService(object):
     # add and a delete.
     dirs_with_adds = set()
     dirs_with_deletes = set()
-    for modified_path in sorted_paths:
-      current_dirs = utils.split_path(modified_path.path)
-      if modified_path.action == ModifiedPath.WRITE:
-        dirs_with_adds = dirs_with_adds.union(set(current_dirs))
-      elif modified_path.action == ModifiedPath.DELETE:
-        dirs_with_deletes = dirs_with_deletes.union(set(current_dirs))
+    for path, action in final_actions.iteritems():
+      if action == ModifiedPath.WRITE:
+        _add_parent_dirs(path, dirs_with_adds)
+      elif action == ModifiedPath.DELETE:
+        _add_parent_dirs(path, dirs_with_deletes)
 
     # Ignore root dir; it's hard-coded elsewhere to always exist.
     dirs_with_adds.discard('/')
@@ -268,32 +345,9 @@ class DirService(object):
   def update_affected_dirs(self, dirs_with_adds, dirs_with_deletes,
                            namespace=None, async=False):
     """Manage changes to _TitanDir entities computed by compute_affected_dirs."""
-    # Order deletes by depth first. This isn't actually by depth, but all we
-    # need to guarantee here is that paths with common subdirs are deleted
-    # depth-first, which can be accomplished by sorting in reverse
-    # alphabetical order.
-    dirs_with_deletes = sorted(list(dirs_with_deletes), reverse=True)
-
-    # For every directory which contained a deleted file (including children),
-    # check if the directory should disappear. It should disappear if:
-    #   1. There are no files in the directory, and...
-    #   2. There are no child directories, and...
-    #   3. The directory path is not present in dirs_with_adds.
-    dirs_paths_to_delete = []
-    for path in dirs_with_deletes:
-      if path in dirs_with_adds or files.Files.list(
-          path, namespace=namespace, limit=1, _internal=True):
-        # The directory is marked for addition, or files still exist in it.
-        continue
-      subdirs = Dirs.list(path, limit=2)
-      if len(subdirs) > 1:
-        # Multiple subdirs exist, cannot delete dir.
-        continue
-      elif len(subdirs) == 1:
-        # Handle the case where the only remaining subdir is marked for delete.
-        if subdirs.values()[0].path not in dirs_paths_to_delete:
-          continue
-      dirs_paths_to_delete.append(path)
+    dirs_paths_to_delete = self._compute_dirs_to_delete(
+        dirs_with_adds, dirs_with_deletes, namespace=namespace)
+    _forget_known_dirs(dirs_paths_to_delete, namespace=namespace)
 
     # Batch get all directory entities, both added and deleted.
     ns = namespace
@@ -332,12 +386,14 @@ class DirService(object):
       # Whitespace. Important.
       changed_dir_ents.append(ent)
 
+    available_dir_paths = []
     for path in dirs_with_adds:
       if path in existing_dirs:
         # Existing directory, make sure it's marked as available.
         ent = existing_dirs[path]
         if ent.status == _STATUS_AVAILABLE:
           # Skip this entity entirely if it's already correct.
+          available_dir_paths.append(path)
           continue
         ent.status = _STATUS_AVAILABLE
       else:
@@ -355,11 +411,217 @@ class DirService(object):
       # Whitespace. Important.
       changed_dir_ents.append(ent)
 
+    futures = []
     for dir_ents in utils.chunk_generator(changed_dir_ents, chunk_size=100):
       if not async:
         ndb.put_multi(dir_ents)
       else:
-        ndb.put_multi_async(dir_ents)
+        futures.extend(ndb.put_multi_async(dir_ents))
+    if changed_dir_ents:
+      # This function is a toplevel, so it waits for the puts regardless.
+      # Wait before invalidating to not let listings cache the old statuses.
+      ndb.Future.wait_all(futures)
+      _clear_dir_listings(
+          [ent.parent_path for ent in changed_dir_ents], namespace=namespace)
+
+    if not async:
+      # Only remember new dirs once they have actually been written.
+      available_dir_paths = dirs_with_adds
+    _add_known_dirs(available_dir_paths, namespace=namespace)
+
+  def _compute_dirs_to_delete(self, dirs_with_adds, dirs_with_deletes,
+                              namespace=None):
+    """Check which dirs affected by deletes are now empty.
+
+    A directory should disappear if:
+      1. There are no files in the directory, and...
+      2. All of its child directories are also disappearing, and...
+      3. The directory path is not present in dirs_with_adds.
+
+    Directories are checked one depth level at a time, deepest first, since a
+    parent's decision depends on its children's. The two queries per dir are
+    issued concurrently, with at most MAX_CONCURRENT_DIR_CHECKS in flight.
+    Ancestors of a directory which stays are never queried.
+
+    Returns:
+      A list of dir paths to mark as deleted, deepest first.
+    """
+    paths_by_depth = collections.defaultdict(list)
+    for path in dirs_with_deletes:
+      if path not in dirs_with_adds:
+        paths_by_depth[path.count('/')].append(path)
+
+    kept_paths = set()
+    deleted_paths = set()
+    paths_to_delete = []
+    # Maps parent paths to their number of child dirs being deleted.
+    num_deleted_subdirs = collections.defaultdict(int)
+    for depth in sorted(paths_by_depth, reverse=True):
+      paths = [path for path in paths_by_depth[depth]
+               if path not in kept_paths]
+      # Process paths in the same order as before: reverse alphabetical.
+      paths.sort(reverse=True)
+      for paths_chunk in utils.chunk_generator(
+          paths, chunk_size=max(MAX_CONCURRENT_DIR_CHECKS // 2, 1)):
+        checks = []
+        for path in paths_chunk:
+          files_future = files._create_files_query(
+              path, namespace=namespace).fetch_async(1, keys_only=True)
+          # If more subdirs exist than are being deleted, at least one of them
+          # stays and shows up in this many results.
+          subdirs_future = _make_subdirs_query(
+              path, namespace=namespace).fetch_async(
+                  num_deleted_subdirs[path] + 1, keys_only=True)
+          checks.append((path, files_future, subdirs_future))
+
+        for path, files_future, subdirs_future in checks:
+          is_empty = not files_future.get_result() and all(
+              key.id() in deleted_paths for key in subdirs_future.get_result())
+          if is_empty:
+            paths_to_delete.append(path)
+            deleted_paths.add(path)
+            num_deleted_subdirs[os.path.dirname(path)] += 1
+          else:
+            # The dir stays, and so do all of its parents.
+            _add_parent_dirs(path, kept_paths)
+    return paths_to_delete
+
+class DirInitializer(object):
+  """Job which rebuilds _TitanDir entities from existing files.
+
+  Use this when enabling DirManagerMixin for a namespace with existing files,
+  or to repair dirs after the dir tasks were not consumed. Missing or deleted
+  parent dirs of every file are made available, and available dirs without
+  any files below them are marked as deleted.
+
+  Both entity kinds are split into key ranges which are processed in
+  parallel deferred tasks. Each task handles up to INITIALIZER_NUM_BATCHES
+  batches of INITIALIZER_BATCH_SIZE entities, then continues in a new task
+  from where it stopped. Every step is idempotent, so a failed task can
+  simply be retried, and the whole job can be re-run. The dir range scans
+  need the _TitanDir (status, __key__) index in titan/files/index.yaml.
+
+  Usage:
+    dirs.DirInitializer(namespace='aaa').run()
+  """
+
+  def __init__(self, namespace=None, num_shards=INITIALIZER_NUM_SHARDS,
+               batch_size=INITIALIZER_BATCH_SIZE,
+               num_batches=INITIALIZER_NUM_BATCHES, queue='default'):
+    """Constructor.
+
+    Args:
+      namespace: The filesystem namespace, or None if the default namespace.
+      num_shards: The max number of key ranges per entity kind.
+      batch_size: The number of entities fetched and updated per batch.
+      num_batches: The number of batches handled by each task.
+      queue: The task queue for the deferred tasks.
+    """
+    utils.validate_namespace(namespace)
+    self.namespace = namespace
+    self.num_shards = num_shards
+    self.batch_size = batch_size
+    self.num_batches = num_batches
+    self.queue = queue
+
+  def run(self):
+    """Defer one task per key range of files and of dirs.
+
+    Returns:
+      The number of deferred tasks.
+    """
+    num_tasks = 0
+    for model_class, callback in ((files._TitanFile, _add_dirs_in_range),
+                                  (_TitanDir, _delete_orphaned_dirs_in_range)):
+      for start_path, end_path in self._compute_ranges(model_class):
+        deferred.defer(callback, self, start_path, end_path,
+                       _queue=self.queue)
+        num_tasks += 1
+    return num_tasks
+
+  def add_dirs_in_range(self, start_path, end_path, cursor=None):
+    """Make sure the parent dirs of a key range of files are available."""
+    files_query = self._make_range_query(files._TitanFile, start_path,
+                                         end_path)
+    added_dir_paths = set()
+    cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+    for _ in range(self.num_batches):
+      file_keys, cursor, has_more = files_query.fetch_page(
+          self.batch_size, start_cursor=cursor, keys_only=True)
+      dir_paths = set()
+      for key in file_keys:
+        _add_parent_dirs(key.id(), dir_paths)
+      dir_paths.discard('/')
+      # Files of a range share many dirs; update each of them only once.
+      dir_paths -= added_dir_paths
+      if dir_paths:
+        DirService().update_affected_dirs(
+            dirs_with_adds=dir_paths, dirs_with_deletes=set(),
+            namespace=self.namespace)
+        added_dir_paths |= dir_paths
+      if not has_more or not cursor:
+        return
+    deferred.defer(_add_dirs_in_range, self, start_path, end_path,
+                   cursor=cursor.urlsafe(), _queue=self.queue)
+
+  def delete_orphaned_dirs_in_range(self, start_path, end_path, cursor=None):
+    """Mark dirs in a key range as deleted if no files exist below them."""
+    dirs_query = self._make_range_query(_TitanDir, start_path, end_path)
+    dirs_query = dirs_query.filter(_TitanDir.status == _STATUS_AVAILABLE)
+    cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+    for _ in range(self.num_batches):
+      dir_ents, cursor, has_more = dirs_query.fetch_page(
+          self.batch_size, start_cursor=cursor)
+      # The files below a dir are exactly the keys between "<dir>/" and
+      # "<dir>0", since "0" sorts right after "/".
+      checks = []
+      for dir_ent in dir_ents:
+        files_future = self._make_range_query(
+            files._TitanFile, dir_ent.key.id() + '/',
+            dir_ent.key.id() + '0').fetch_async(1, keys_only=True)
+        checks.append((dir_ent, files_future))
+      orphaned_dir_ents = []
+      for dir_ent, files_future in checks:
+        if not files_future.get_result():
+          dir_ent.status = _STATUS_DELETED
+          orphaned_dir_ents.append(dir_ent)
+      if orphaned_dir_ents:
+        _forget_known_dirs([ent.key.id() for ent in orphaned_dir_ents],
+                           namespace=self.namespace)
+        ndb.put_multi(orphaned_dir_ents)
+        _clear_dir_listings([ent.parent_path for ent in orphaned_dir_ents],
+                            namespace=self.namespace)
+      if not has_more or not cursor:
+        return
+    deferred.defer(_delete_orphaned_dirs_in_range, self, start_path, end_path,
+                   cursor=cursor.urlsafe(), _queue=self.queue)
+
+  def _make_range_query(self, model_class, start_path, end_path):
+    """Makes a key-ordered query for the keys in [start_path, end_path)."""
+    query = model_class.query(namespace=self.namespace)
+    if start_path is not None:
+      query = query.filter(model_class.key >= ndb.Key(
+          model_class, start_path, namespace=self.namespace))
+    if end_path is not None:
+      query = query.filter(model_class.key < ndb.Key(
+          model_class, end_path, namespace=self.namespace))
+    return query.order(model_class.key)
+
+  def _compute_ranges(self, model_class):
+    """Returns a list of (start_path, end_path) pairs covering all keys."""
+    # Split at evenly spaced keys among a random sample, like mapreduce.
+    scatter_query = model_class.query(namespace=self.namespace).order(
+        ndb.GenericProperty('__scatter__'))
+    sample_keys = scatter_query.fetch(
+        self.num_shards * _INITIALIZER_OVERSAMPLING, keys_only=True)
+    sample_paths = sorted(key.id() for key in sample_keys)
+    boundaries = set()
+    for i in range(1, self.num_shards):
+      index = i * len(sample_paths) // self.num_shards
+      if index < len(sample_paths):
+        boundaries.add(sample_paths[index])
+    boundaries = [None] + sorted(boundaries) + [None]
+    return zip(boundaries[:-1], boundaries[1:])
 
 class Dir(object):
   """A simple directory."""
@@ -537,17 +799,40 @@ class Dirs(collections.Mapping):
   def sort(self):
     self._ordered_paths.sort()
 
+  def load(self):
+    """If not loaded, load associated dirs and remove non-existing ones."""
+    titan_dirs = [d for d in self.itervalues() if d._dir_ent is None]
+    dir_ents = ndb.get_multi([
+        ndb.Key(_TitanDir, titan_dir._path, namespace=self.namespace)
+        for titan_dir in titan_dirs])
+    for titan_dir, dir_ent in zip(titan_dirs, dir_ents):
+      if not dir_ent or dir_ent.status == _STATUS_DELETED:
+        # Remove non-existent dirs.
+        del self[titan_dir.path]
+      else:
+        # Inject the fetched dir entity into the current Dir object.
+        titan_dir._dir_ent = dir_ent
+    return self
+
   @classmethod
-  def list(cls, path, namespace=None, limit=None, **kwargs):
+  def list(cls, path, namespace=None, limit=None, load=False, cache=False,
+           **kwargs):
     """List the sub-directories of a directory.
 
     Args:
       path: An absolute directory path.
       namespace: The filesystem namespace.
       limit: An integer limiting the number of sub-directories returned.
+      load: Whether to fetch the dir entities with the query itself, rather
+          than lazily loading each one.
+      cache: Whether to serve the sub-directory paths from memcache when
+          possible. Cached listings are invalidated by DirService, but the
+          query is eventually consistent: a listing cached right after a
+          sub-directory changed may miss the change for up to
+          DIR_LISTING_MEMCACHE_SECONDS. Only use this where that is fine.
       **kwargs: Keyword arguments to pass through to Dir objects.
     Returns:
-      A lazy Dirs mapping.
+      A lazy Dirs mapping, or a loaded one if "load" is given.
     """
     Dir.validate_path(path, namespace=namespace)
 
@@ -555,14 +840,101 @@ class Dirs(collections.Mapping):
     if path != '/' and path.endswith('/'):
       path = path[:-1]
 
-    dirs_query = _TitanDir.query(namespace=namespace)
-    dirs_query = dirs_query.filter(_TitanDir.parent_path == path)
-    dirs_query = dirs_query.filter(_TitanDir.status == _STATUS_AVAILABLE)
-    dir_keys = dirs_query.fetch(limit=limit, keys_only=True)
-    titan_dirs = cls(
-        [key.id() for key in dir_keys], namespace=namespace, **kwargs)
+    # The key includes the listing's generation, read before the query, so a
+    # result that was queried before an invalidation is never served after it.
+    cache_key = None
+    if cache:
+      cache_key = _get_dir_listing_memcache_key(path, namespace=namespace)
+    paths = memcache.get(cache_key) if cache_key else None
+    if paths is not None:
+      titan_dirs = cls(paths[:limit], namespace=namespace, **kwargs)
+      return titan_dirs.load() if load else titan_dirs
+
+    dirs_query = _make_subdirs_query(path, namespace=namespace)
+    if load:
+      dir_ents = dirs_query.fetch(limit=limit)
+      paths = [dir_ent.key.id() for dir_ent in dir_ents]
+      titan_dirs = cls(
+          dirs=[_make_loaded_dir(dir_ent, namespace=namespace, **kwargs)
+                for dir_ent in dir_ents], namespace=namespace)
+    else:
+      dir_keys = dirs_query.fetch(limit=limit, keys_only=True)
+      paths = [key.id() for key in dir_keys]
+      titan_dirs = cls(paths, namespace=namespace, **kwargs)
+    if cache_key and limit is None:
+      # Limited listings are partial, so they can't be cached.
+      try:
+        memcache.set(cache_key, paths, time=DIR_LISTING_MEMCACHE_SECONDS)
+      except ValueError:
+        # Listing is too large for a single memcache value.
+        pass
     return titan_dirs
 
+  @classmethod
+  def walk(cls, path, namespace=None, depth=None,
+           page_size=DEFAULT_WALK_PAGE_SIZE, **kwargs):
+    """Walk a directory tree, like os.walk().
+
+    The whole subtree is listed by one query, rather than one query per
+    directory. Query results are fetched in batches of page_size, but the
+    whole subtree is held in memory before the first result is yielded.
+    Walks deeper than one level need the _TitanDir (parent_paths, status)
+    index in titan/files/index.yaml.
+
+    Args:
+      path: An absolute directory path.
+      namespace: The filesystem namespace.
+      depth: A positive integer to limit the recursion depth; 1 only walks
+          the immediate sub-directories.
+      page_size: The number of dir entities fetched per query RPC.
+      **kwargs: Keyword arguments to pass through to Dir objects.
+    Raises:
+      ValueError: If given an invalid depth.
+    Yields:
+      Two-tuples of (dir_path, Dirs of its sub-directories), top-down and in
+      name order. Dirs at the depth limit are listed but not walked.
+    """
+    Dir.validate_path(path, namespace=namespace)
+    if depth is not None and depth < 1:
+      raise ValueError('"depth" must be a positive integer. Got: %r' % depth)
+
+    # Strip trailing slash.
+    if path != '/' and path.endswith('/'):
+      path = path[:-1]
+
+    base_depth = len(utils.split_path(path))
+    subdirs = collections.defaultdict(list)
+    if depth == 1:
+      dirs_query = _make_subdirs_query(path, namespace=namespace)
+    else:
+      dirs_query = _TitanDir.query(namespace=namespace)
+      dirs_query = dirs_query.filter(_TitanDir.parent_paths == path)
+      dirs_query = dirs_query.filter(_TitanDir.status == _STATUS_AVAILABLE)
+    cursor = None
+    while True:
+      dir_ents, cursor, has_more = dirs_query.fetch_page(
+          page_size, start_cursor=cursor)
+      for dir_ent in dir_ents:
+        # parent_paths excludes the dir itself, so direct children of path
+        # are at relative depth 1.
+        if depth is None or len(dir_ent.parent_paths) - base_depth <= depth:
+          subdirs[dir_ent.parent_path].append(
+              _make_loaded_dir(dir_ent, namespace=namespace, **kwargs))
+      if not has_more or not cursor:
+        break
+
+    # Stack of (dir_path, depth relative to the walked path).
+    dir_paths = [(path, 0)]
+    while dir_paths:
+      dir_path, current_depth = dir_paths.pop()
+      titan_dirs = cls(dirs=sorted(subdirs[dir_path], key=lambda d: d.name),
+                       namespace=namespace)
+      yield dir_path, titan_dirs
+      if depth is None or current_depth + 1 < depth:
+        dir_paths.extend(reversed([
+            (titan_dir._path, current_depth + 1)
+            for titan_dir in titan_dirs.itervalues()]))
+
   def serialize(self):
     data = {}
     for titan_dir in self.itervalues():
@@ -621,6 +993,109 @@ class _TitanDir(ndb.Expando):
       if key in _TitanDir.BASE_PROPERTIES:
         raise InvalidMetaError('Invalid name for meta property: "%s"' % key)
 
+# These must be module-level for pickling.
+def _add_dirs_in_range(dir_initializer, start_path, end_path, cursor=None):
+  dir_initializer.add_dirs_in_range(start_path, end_path, cursor=cursor)
+
+def _delete_orphaned_dirs_in_range(dir_initializer, start_path, end_path,
+                                   cursor=None):
+  dir_initializer.delete_orphaned_dirs_in_range(
+      start_path, end_path, cursor=cursor)
+
+def _make_loaded_dir(dir_ent, namespace=None, **kwargs):
+  """Creates a Dir object from an already fetched entity."""
+  titan_dir = Dir(dir_ent.key.id(), namespace=namespace, **kwargs)
+  # Inject the entity to avoid a get per dir when loading properties.
+  titan_dir._dir_ent = dir_ent
+  return titan_dir
+
+def _make_subdirs_query(path, namespace=None):
+  """Creates a query for the available sub-directories of a directory."""
+  dirs_query = _TitanDir.query(namespace=namespace)
+  dirs_query = dirs_query.filter(_TitanDir.parent_path == path)
+  return dirs_query.filter(_TitanDir.status == _STATUS_AVAILABLE)
+
+def _add_parent_dirs(path, dir_paths):
+  """Adds all containing dirs of a path to a set, stopping at known dirs.
+
+  Like utils.split_path, but shared ancestors of many paths are only visited
+  once: once a dir is in the set, so are all of its parents.
+
+  Args:
+    path: An absolute file path.
+    dir_paths: The set of dir paths to update.
+  """
+  dir_path = os.path.dirname(path)
+  while dir_path not in dir_paths:
+    dir_paths.add(dir_path)
+    if dir_path == '/':
+      break
+    dir_path = os.path.dirname(dir_path)
+
+def _get_known_dir_memcache_key(dir_path, namespace=None):
+  return _KNOWN_DIR_MEMCACHE_PREFIX + hashlib.md5(
+      repr((namespace or None, dir_path))).hexdigest()
+
+def _is_known_dir(dir_path, namespace=None):
+  """Whether a dir is known to be available, without any datastore RPCs."""
+  if dir_path == '/':
+    return True
+  return bool(memcache.get(
+      _get_known_dir_memcache_key(dir_path, namespace=namespace)))
+
+def _add_known_dirs(dir_paths, namespace=None):
+  """Remembers dirs as available in memcache."""
+  if not dir_paths:
+    return
+  memcache.set_multi(dict(
+      (_get_known_dir_memcache_key(dir_path, namespace=namespace), 1)
+      for dir_path in dir_paths), time=KNOWN_DIRS_MEMCACHE_SECONDS)
+
+def _forget_known_dirs(dir_paths, namespace=None):
+  """Invalidates known dirs in memcache."""
+  if not dir_paths:
+    return
+  memcache.delete_multi([
+      _get_known_dir_memcache_key(dir_path, namespace=namespace)
+      for dir_path in dir_paths])
+
+def _get_dir_listing_generation_key(dir_path, namespace=None):
+  return _DIR_LISTING_GENERATION_MEMCACHE_PREFIX + hashlib.md5(
+      repr((namespace or None, dir_path))).hexdigest()
+
+def _get_dir_listing_memcache_key(dir_path, namespace=None):
+  """Returns the memcache key of a dir listing's current generation, or None."""
+  generation = files._get_memcache_generation(
+      _get_dir_listing_generation_key(dir_path, namespace=namespace))
+  if generation is None:
+    return None
+  return _DIR_LISTING_MEMCACHE_PREFIX + hashlib.md5(
+      repr((namespace or None, dir_path, generation))).hexdigest()
+
+def _clear_dir_listings(dir_paths, namespace=None):
+  """Invalidates cached Dirs.list() results of the given dirs.
+
+  This bumps the listings' generations rather than deleting them, so that a
+  reader which queried before the change can't put its result back.
+  """
+  # Without an initial value, missing counters stay missing and are re-seeded
+  # with a fresh value by the next cached listing.
+  memcache.offset_multi(dict(
+      (_get_dir_listing_generation_key(dir_path, namespace=namespace), 1)
+      for dir_path in set(dir_paths)))
+
+def _make_task_tag(window, namespace=None):
+  """Makes the tag of a window's dir tasks; one per namespace and window."""
+  # Colons are not valid in namespaces, so tags are never ambiguous.
+  return '%d:%s' % (window, namespace or '')
+
+def _make_backlog_counters():
+  from titan import stats
+  return [
+      stats.AverageCounter('dirs/backlog/num_tasks'),
+      stats.AverageCounter('dirs/backlog/lag_seconds'),
+  ]
+
 def _get_window(timestamp=None, window_size=WINDOW_SIZE_SECONDS):
   """Get the window for the given unix time and window size."""
   return int(window_size * round(float(timestamp) / window_size))
@@ -30,6 +30,11 @@ Usage:
   titan_files.move_to('/destination/', strip_prefix='/some')
   titan_files.load()
   titan_files.delete()
+
+  job = files.Files.update_meta('/some/dir', meta={'flag': True})
+  job.is_done
+
+  changes, token, has_more = files.Files.changes_since(token)
 """
 
 try:
@@ -40,10 +45,15 @@ except ImportError:
   appengine_config = None
 
 import collections
+import copy
 import datetime
 import hashlib
 import logging
 import os
+import random
+import re
+import time
+import uuid
 
 try:
   from concurrent import futures
@@ -51,8 +61,14 @@ except ImportError:
   # Allow Titan Files to be imported without the futures library present,
   # since only copy_to and move_to methods require this dependency.
   futures = None
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore import datastore_query
 from google.appengine.ext import blobstore
+from google.appengine.ext import deferred
 from google.appengine.ext import ndb
+from google.appengine.ext.ndb import blobstore as ndb_blobstore
 
 from titan.common import sharded_cache
 from titan import users
@@ -61,8 +77,22 @@ from titan.common import utils
 __all__ = [
     # Constants.
     'MAX_CONTENT_SIZE',
+    'DEFAULT_MAX_CHUNKED_CONTENT_SIZE',
+    'DEFAULT_CHUNK_SIZE',
+    'MAX_CHUNK_SIZE',
+    'DEFAULT_BLOB_CACHE_ADMIT_SIZE',
+    'DEFAULT_BLOB_CACHE_MAX_SIZE',
     'DEFAULT_BATCH_SIZE',
     'DEFAULT_MAX_WORKERS',
+    'JOB_STATUS_RUNNING',
+    'JOB_STATUS_SUCCESSFUL',
+    'JOB_STATUS_FAILED',
+    'CHANGE_ACTION_WRITE',
+    'CHANGE_ACTION_DELETE',
+    'DEFAULT_CHANGES_LIMIT',
+    'CHANGES_SETTLE_SECONDS',
+    'CHANGES_RETENTION_SECONDS',
+    'CHANGES_COMPACTION_BATCH_SIZE',
     # Errors.
     'Error',
     'BadFileError',
@@ -70,25 +100,113 @@ __all__ = [
     'CopyFileError',
     'MoveFileError',
     'CopyFilesError',
+    'InvalidJobError',
+    'ChangeTokenExpiredError',
     # Classes.
     'File',
     'Files',
     'OrderedFiles',
     'FileProperty',
+    'FilesJob',
+    'FileChange',
+    'IndexProfile',
+    'BlobCacheAdmissionPolicy',
+    'SizeAwareAdmissionPolicy',
     # Functions.
     'register_file_factory',
     'unregister_file_factory',
     'register_file_mixins',
+    'disable_path_indexes',
+    'enable_path_indexes',
+    'compact_file_changes',
+    'configure_chunked_storage',
+    'register_index_profile',
+    'unregister_index_profile',
+    'register_blob_cache_admission_policy',
+    'unregister_blob_cache_admission_policy',
 ]
 
 # Arbitrary cutoff for when content will be stored in blobstore.
 # This value should be mirrored by titan_client.DIRECT_TO_BLOBSTORE_SIZE.
 MAX_CONTENT_SIZE = 1 << 19  # 500 KiB
 
+# Defaults for the opt-in chunked storage tier. See configure_chunked_storage().
+DEFAULT_MAX_CHUNKED_CONTENT_SIZE = 1 << 25  # 32 MiB
+DEFAULT_CHUNK_SIZE = 1 << 19  # 512 KiB; each chunk is a single entity.
+# Chunks must fit in the 1 MiB entity size limit, with room for the key and
+# entity overhead.
+MAX_CHUNK_SIZE = MAX_CONTENT_SIZE * 2 - (1 << 16)  # 960 KiB
+
+# Defaults of the blob cache admission policy. See SizeAwareAdmissionPolicy.
+DEFAULT_BLOB_CACHE_ADMIT_SIZE = 1 << 20  # 1 MiB
+DEFAULT_BLOB_CACHE_MAX_SIZE = 1 << 23  # 8 MiB
+
 DEFAULT_BATCH_SIZE = 100
 DEFAULT_MAX_WORKERS = 25
+DEFAULT_JOB_QUEUE = 'default'
+# Each batch task of a FilesJob is retried up to this many times before the
+# job is marked as failed.
+JOB_TASK_RETRY_LIMIT = 5
+
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_SUCCESSFUL = 'successful'
+JOB_STATUS_FAILED = 'failed'
+
+CHANGE_ACTION_WRITE = 'write'
+CHANGE_ACTION_DELETE = 'delete'
+DEFAULT_CHANGES_LIMIT = 1000
+# Journal entries younger than this are held back from readers, to allow for
+# clock skew between instances and for eventually-consistent queries.
+CHANGES_SETTLE_SECONDS = 10
+CHANGES_RETENTION_SECONDS = 7 * 24 * 60 * 60  # 1 week.
+# Superseded journal entries are only dropped within one compaction batch, so
+# larger batches compact more.
+CHANGES_COMPACTION_BATCH_SIZE = 1000
+# Upper bound on the staleness of a cached listing, for writes which don't
+# bump listing generations (such as those made without dirs.DirManagerMixin),
+# or for listings cached before an eventually consistent query saw a write.
+LISTING_MEMCACHE_SECONDS = 600
 
 _BLOB_MEMCACHE_PREFIX = 'titan-blob:'
+_BLOB_CACHE_STATS_CALLER = 'blob_cache'
+_LISTING_MEMCACHE_PREFIX = 'titan-listing:'
+_LISTING_GENERATION_MEMCACHE_PREFIX = 'titan-listing-gen:'
+
+# Properties only needed for recursive (paths, depth) or by-name queries.
+_PATH_INDEX_PROPERTIES = frozenset(('name', 'paths', 'depth'))
+
+# Non-recursive listings always query dir_path.
+_REQUIRED_INDEXED_PROPERTIES = frozenset(('dir_path',))
+
+# Longer strings cannot be indexed by the datastore.
+_MAX_INDEXED_STRING_SIZE = 1500
+
+class _StorageConfig(object):
+  """How files are stored and indexed.
+
+  See configure_chunked_storage(), register_index_profile() and
+  disable_path_indexes(). This is per-instance state, so it must be configured
+  identically in every instance, i.e. from appengine_config. Otherwise
+  instances write files with different index rows, or list them with queries
+  that other instances' writes can't satisfy.
+  """
+
+  def __init__(self):
+    # 0 disables the chunked tier: everything over MAX_CONTENT_SIZE goes to
+    # blobstore.
+    self.max_chunked_size = 0
+    self.chunk_size = DEFAULT_CHUNK_SIZE
+    # Maps namespaces to dictionaries of path prefixes to IndexProfile objects.
+    self.index_profiles = {}
+
+  def should_chunk(self, content):
+    return (content is not None
+            and MAX_CONTENT_SIZE < len(content) <= self.max_chunked_size)
+
+_storage_config = _StorageConfig()
+
+_CHANGE_TOKEN_REGEX = re.compile(r'^[0-9a-f]{24}$')
+_JOURNAL_STATE_ID = 'journal'
 
 class Error(Exception):
   pass
@@ -117,6 +235,12 @@ class CopyFilesError(Error):
 class NamespaceMismatchError(Error):
   pass
 
+class InvalidJobError(Error):
+  pass
+
+class ChangeTokenExpiredError(Error):
+  pass
+
 class File(object):
   """A file abstraction.
 
@@ -398,6 +522,18 @@ class File(object):
   def read(self):
     return self.content
 
+  def read_async(self):
+    """Asynchronous version of read().
+
+    Cache lookups and chunk fetches of many files can overlap. The file entity
+    itself is loaded synchronously if needed, so load files in bulk first,
+    for example with Files.load().
+
+    Returns:
+      An ndb.Future of the file content.
+    """
+    return _read_content_or_blob_async(self)
+
   def close(self):
     pass
 
@@ -417,6 +553,9 @@ class File(object):
   def _maybe_write_to_blobstore(self, content, blob, force_blobstore=False):
     if content and blob:
       raise TypeError('Exactly one of "content" or "blob" must be given.')
+    if not force_blobstore and _storage_config.should_chunk(content):
+      # Leave mid-size content to be written as chunk entities by write().
+      return content, blob
     if force_blobstore or content and len(content) > MAX_CONTENT_SIZE:
       if not force_blobstore:
         logging.debug(
@@ -424,7 +563,9 @@ class File(object):
             len(content), MAX_CONTENT_SIZE)
       old_blobinfo = self.blob if self.exists else None
       blob = utils.write_to_blobstore(content, old_blobinfo=old_blobinfo)
-      _store_blob_cache(self.real_path, content)
+      if not _maybe_store_written_blob_cache(self.real_path, content):
+        # Never leave the previous content cached under this path.
+        _clear_blob_cache_for_paths([self.real_path])
       content = None
     return content, blob
 
@@ -453,7 +594,8 @@ class File(object):
       modified: Optional datetime.datetime to override the modified property.
       created_by: Optional TitanUser to override the created_by property.
       modified_by: Optional TitanUser to override the modified_by property.
-      _delete_old_blob: Whether or not to delete the old blob if it changed.
+      _delete_old_blob: Whether or not to delete the old blob or chunks if
+          they changed.
     Raises:
       TypeError: For missing arguments.
       ValueError: For invalid arguments.
@@ -490,6 +632,13 @@ class File(object):
 
     # If big enough, store content in blobstore. Must come after encoding.
     content, blob = self._maybe_write_to_blobstore(content, blob)
+    md5_hash = hashlib.md5(content).hexdigest() if content is not None else None
+
+    # Mid-size content is split into chunk entities.
+    chunk_keys = None
+    if _storage_config.should_chunk(content):
+      chunk_keys = _write_chunks(content, namespace=self.namespace)
+      content = None
 
     now = datetime.datetime.now()
     override_created_by = created_by is not None
@@ -521,9 +670,10 @@ class File(object):
           blob=blob,
           # Backwards-compatibility with deprecated "blobs" property:
           blobs=[],
+          chunks=chunk_keys or [],
           created_by=created_by,
           modified_by=modified_by,
-          md5_hash=None if blob else hashlib.md5(content).hexdigest(),
+          md5_hash=md5_hash,
       )
       # Add meta attributes.
       if meta:
@@ -537,6 +687,7 @@ class File(object):
     file_ent = self._file
 
     blob_to_delete = None
+    chunks_to_delete = []
 
     if override_created_by:
       file_ent.created_by = created_by
@@ -554,13 +705,17 @@ class File(object):
       file_ent.blob = file_ent.blobs[0]
       file_ent.blobs = []
 
-    if content is not None and file_ent.content != content:
+    if ((content is not None and file_ent.content != content)
+        or chunk_keys is not None):
       file_ent.content = content
-      file_ent.md5_hash = hashlib.md5(content).hexdigest()
+      file_ent.md5_hash = md5_hash
       if file_ent.blob and _delete_old_blob:
         blob_to_delete = self.blob
       # Clear the current blob association for this file.
       file_ent.blob = None
+      # Chunks are never shared between files, so always replace them.
+      chunks_to_delete = file_ent.chunks
+      file_ent.chunks = chunk_keys or []
 
     if blob is not None and file_ent.blob != blob:
       if file_ent.blob and _delete_old_blob:
@@ -569,6 +724,8 @@ class File(object):
       file_ent.blob = blob
       file_ent.md5_hash = None
       file_ent.content = None
+      chunks_to_delete = file_ent.chunks
+      file_ent.chunks = []
 
     if encoding != file_ent.encoding:
       file_ent.encoding = encoding
@@ -585,6 +742,8 @@ class File(object):
       # Delete the actual blobstore data after the file write to avoid
       # orphaned files.
       _delete_blobs(blobs=[blob_to_delete], file_paths=[self.real_path])
+    if chunks_to_delete and _delete_old_blob:
+      ndb.delete_multi(chunks_to_delete)
 
     return self
 
@@ -592,7 +751,8 @@ class File(object):
     """Delete file.
 
     Args:
-      _delete_old_blob: Internal-only flag to avoid deleting associated blobs.
+      _delete_old_blob: Internal-only flag to avoid deleting associated blobs
+          and chunks.
       _run_mixins_only: Internal-only flag. This skips the actual delete RPC,
           allowing any mixin side-effects to run.
     Returns:
@@ -601,9 +761,12 @@ class File(object):
     if _run_mixins_only:
       return
     blob_to_delete = self.blob
+    chunks_to_delete = self._file.chunks
     self._file.key.delete()
     if blob_to_delete and _delete_old_blob:
       _delete_blobs(blobs=[blob_to_delete], file_paths=[self.real_path])
+    if chunks_to_delete and _delete_old_blob:
+      ndb.delete_multi(chunks_to_delete)
 
     self._file_ent = None
     self._meta = None
@@ -634,8 +797,11 @@ class File(object):
           if key in meta:
             del meta[key]
 
+      content = self._file.content
+      if content is None and self._file.chunks:
+        content = self.content
       destination_file.write(
-          content=self._file.content,
+          content=content,
           blob=self._file.blob,
           mime_type=self.mime_type,
           meta=meta)
@@ -656,8 +822,12 @@ class File(object):
     logging.info('Moving Titan file: %s --> %s', self.real_path,
                  destination_file.real_path)
     try:
+      chunks_to_delete = self._file.chunks
       self.copy_to(destination_file)
+      # The blob is shared with the copy, but chunks are never shared.
       self.delete(_delete_old_blob=False)
+      if chunks_to_delete:
+        ndb.delete_multi(chunks_to_delete)
       return self
     except:
       logging.exception('Error moving file: %s', self.path)
@@ -771,6 +941,284 @@ def register_file_mixins(mixin_classes):
     return type('DynamicFile', tuple(base_classes), {})
   register_file_factory(DynamicFileFactory)
 
+def configure_chunked_storage(max_size=DEFAULT_MAX_CHUNKED_CONTENT_SIZE,
+                              chunk_size=DEFAULT_CHUNK_SIZE):
+  """Store mid-size content in datastore chunk entities instead of blobstore.
+
+  Content larger than MAX_CONTENT_SIZE and up to max_size is split into
+  entities of chunk_size bytes, written with one put_multi and read back with
+  one parallel get_multi. Larger content still goes to blobstore. This should
+  be called from appengine_config.
+
+  Args:
+    max_size: The largest content size stored in chunks, or 0 to disable
+        chunked storage.
+    chunk_size: The number of bytes per chunk entity, up to MAX_CHUNK_SIZE.
+  Raises:
+    ValueError: If given invalid sizes.
+  """
+  if max_size < 0:
+    raise ValueError('max_size must not be negative.')
+  if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+    raise ValueError(
+        'chunk_size must be between 1 and %d bytes.' % MAX_CHUNK_SIZE)
+  _storage_config.max_chunked_size = max_size
+  _storage_config.chunk_size = chunk_size
+
+class BlobCacheAdmissionPolicy(object):
+  """Base class which decides what blob content is kept in the blob cache.
+
+  The blob cache keeps content read from blobstore in sharded memcache
+  entries. Caching every blob lets a single large, one-off download evict
+  hot content, so each blob cache miss and each blobstore write first asks
+  the registered policy for admission.
+  """
+
+  def admit(self, path, size):
+    """Abstract method called on a blob cache miss, before caching read content.
+
+    Each call is one read access of the path.
+
+    Args:
+      path: The absolute file path of the content.
+      size: The content size in bytes.
+    Returns:
+      True if the content should be cached.
+    """
+    raise NotImplementedError('Subclasses should implement abstract method.')
+
+  def admit_write(self, path, size):
+    """Called before content written to blobstore is stored in the blob cache.
+
+    Unlike admit(), this is not an access of the path. By default, written
+    content is not cached until it is read.
+
+    Args:
+      path: The absolute file path of the content.
+      size: The content size in bytes.
+    Returns:
+      True if the content should be cached.
+    """
+    return False
+
+class SizeAwareAdmissionPolicy(BlobCacheAdmissionPolicy):
+  """TinyLFU-style admission: small content, or large content seen repeatedly.
+
+  Content up to admit_size is always cached and content over max_size never
+  is. Anything in between is only cached once its path has been seen
+  min_frequency times, as estimated by an instance-local count-min sketch.
+  The sketch halves all of its counts every sample_size accesses, so old
+  popularity fades out. Only reads are counted as accesses; written content
+  is cached if it would be admitted on its next read.
+  """
+
+  def __init__(self, admit_size=DEFAULT_BLOB_CACHE_ADMIT_SIZE,
+               max_size=DEFAULT_BLOB_CACHE_MAX_SIZE, min_frequency=2,
+               sketch_width=1024, sketch_depth=4, sample_size=10000):
+    if not 0 <= admit_size <= max_size:
+      raise ValueError('admit_size must be between 0 and max_size.')
+    if not 0 < sketch_depth <= 4:
+      raise ValueError('sketch_depth must be between 1 and 4.')
+    self.admit_size = admit_size
+    self.max_size = max_size
+    self.min_frequency = min_frequency
+    self.sample_size = sample_size
+    self._sketch_width = sketch_width
+    self._sketch = [[0] * sketch_width for _ in range(sketch_depth)]
+    self._num_accesses = 0
+
+  def admit(self, path, size):
+    if size > self.max_size:
+      return False
+    frequency = self._record_access(path)
+    return size <= self.admit_size or frequency >= self.min_frequency
+
+  def admit_write(self, path, size):
+    if size > self.max_size:
+      return False
+    return (size <= self.admit_size
+            or self._estimate_frequency(path) >= self.min_frequency)
+
+  def _get_columns(self, path):
+    """Returns the path's column in each row of the sketch."""
+    if isinstance(path, unicode):
+      path = path.encode('utf-8')
+    digest = hashlib.md5(path).hexdigest()
+    # One independent 32-bit hash per row, sliced from a single digest.
+    return [int(digest[i * 8:i * 8 + 8], 16) % self._sketch_width
+            for i in range(len(self._sketch))]
+
+  def _estimate_frequency(self, path):
+    return min(row[column] for row, column
+               in zip(self._sketch, self._get_columns(path)))
+
+  def _record_access(self, path):
+    """Increments the path's counts and returns its estimated frequency."""
+    for row, column in zip(self._sketch, self._get_columns(path)):
+      row[column] += 1
+    frequency = self._estimate_frequency(path)
+    self._num_accesses += 1
+    if self._num_accesses >= self.sample_size:
+      self._num_accesses = 0
+      for row in self._sketch:
+        row[:] = [count >> 1 for count in row]
+    return frequency
+
+class _BlobCacheConfig(object):
+  """Blob cache settings; see register_blob_cache_admission_policy().
+
+  Like _storage_config, this is per-instance state, so policies must be
+  registered at import time (e.g. in appengine_config.py) to apply everywhere.
+  """
+
+  def __init__(self):
+    self.policy = SizeAwareAdmissionPolicy()
+
+_blob_cache_config = _BlobCacheConfig()
+
+def register_blob_cache_admission_policy(policy):
+  """Register the BlobCacheAdmissionPolicy used by the blob cache.
+
+  This method will overwrite any previously-registered policy.
+
+  Args:
+    policy: A BlobCacheAdmissionPolicy instance.
+  """
+  _blob_cache_config.policy = policy
+
+def unregister_blob_cache_admission_policy():
+  """Restore a new default SizeAwareAdmissionPolicy."""
+  _blob_cache_config.policy = SizeAwareAdmissionPolicy()
+
+class IndexProfile(object):
+  """Declares which file properties stay indexed, i.e. queryable.
+
+  Every indexed property value costs two index row writes per put, and the
+  repeated "paths" property has one value per ancestor directory. Properties
+  not declared here are stored unindexed. "dir_path" is always indexed, since
+  non-recursive listings depend on it. Without "paths" and "depth", recursive
+  listings are key range scans and depth limits are applied in memory.
+
+  Usage:
+    # Files under /static can only be listed, or filtered by "color":
+    files.register_index_profile(
+        files.IndexProfile(['color']), path_prefix='/static')
+  """
+
+  def __init__(self, indexed_properties=(), index_all_meta=False):
+    """Constructor.
+
+    Args:
+      indexed_properties: An iterable of base and meta property names.
+      index_all_meta: Whether to index every meta property.
+    """
+    self.indexed_properties = (
+        frozenset(indexed_properties) | _REQUIRED_INDEXED_PROPERTIES)
+    self.index_all_meta = index_all_meta
+
+  def __repr__(self):
+    return '<IndexProfile %r index_all_meta:%r>' % (
+        sorted(self.indexed_properties), self.index_all_meta)
+
+  @property
+  def indexes_paths(self):
+    return ('paths' in self.indexed_properties
+            and 'depth' in self.indexed_properties)
+
+  def is_indexed(self, name):
+    if name in self.indexed_properties:
+      return True
+    return self.index_all_meta and name not in _TitanFile.BASE_PROPERTIES
+
+def register_index_profile(index_profile, namespace=None, path_prefix='/'):
+  """Applies an IndexProfile to files written in a namespace or directory.
+
+  The profile with the longest matching path prefix wins. Existing entities
+  keep their index rows until they are re-written; use Files.reindex() to
+  re-put them after changing profiles. This should be called from
+  appengine_config.
+
+  Args:
+    index_profile: An IndexProfile.
+    namespace: The filesystem namespace, or None if the default namespace.
+    path_prefix: An absolute directory path. Defaults to the whole namespace.
+  Raises:
+    ValueError: If given an invalid namespace or path_prefix.
+  """
+  if namespace is not None:
+    utils.validate_namespace(namespace)
+  path_prefix = _normalize_path_prefix(path_prefix)
+  _storage_config.index_profiles.setdefault(
+      namespace or None, {})[path_prefix] = index_profile
+
+def unregister_index_profile(namespace=None, path_prefix='/'):
+  """Removes a profile added with register_index_profile(), if any."""
+  path_prefix = _normalize_path_prefix(path_prefix)
+  _storage_config.index_profiles.get(namespace or None, {}).pop(
+      path_prefix, None)
+
+def disable_path_indexes(namespace=None):
+  """Stop indexing the name, paths and depth properties of files in a namespace.
+
+  This registers a namespace-wide IndexProfile which keeps all other base
+  properties and all meta properties indexed. Like register_index_profile(),
+  this should be called from appengine_config, so that every instance writes
+  and queries the namespace the same way.
+
+  Args:
+    namespace: The filesystem namespace, or None if the default namespace.
+  """
+  index_profile = IndexProfile(
+      _TitanFile.BASE_PROPERTIES - _PATH_INDEX_PROPERTIES, index_all_meta=True)
+  register_index_profile(index_profile, namespace=namespace)
+
+def enable_path_indexes(namespace=None):
+  """Undo disable_path_indexes() for the given namespace."""
+  unregister_index_profile(namespace=namespace)
+
+def _normalize_path_prefix(path_prefix):
+  utils.validate_dir_path(path_prefix)
+  if path_prefix != '/' and path_prefix.endswith('/'):
+    path_prefix = path_prefix[:-1]
+  return path_prefix
+
+def _is_path_under(path, dir_path):
+  return (dir_path == '/' or path == dir_path
+          or path.startswith(dir_path + '/'))
+
+def _get_index_profile(namespace, path):
+  """Returns the IndexProfile for a file path, or None for default indexing."""
+  best_prefix = None
+  profiles = _storage_config.index_profiles.get(namespace or None, {})
+  for path_prefix in profiles:
+    if _is_path_under(path, path_prefix):
+      if best_prefix is None or len(path_prefix) > len(best_prefix):
+        best_prefix = path_prefix
+  if best_prefix is None:
+    return None
+  return profiles[best_prefix]
+
+def _has_path_indexes(namespace, dir_path='/'):
+  """Whether every file under dir_path has its paths and depth indexed."""
+  if dir_path != '/' and dir_path.endswith('/'):
+    dir_path = dir_path[:-1]
+  profiles = _storage_config.index_profiles.get(namespace or None, {})
+  for path_prefix, index_profile in profiles.iteritems():
+    overlaps = (_is_path_under(dir_path, path_prefix)
+                or _is_path_under(path_prefix, dir_path))
+    if overlaps and not index_profile.indexes_paths:
+      return False
+  return True
+
+def _is_indexable(value):
+  values = value if isinstance(value, list) else [value]
+  for value in values:
+    if isinstance(value, unicode):
+      value = value.encode('utf-8')
+    if isinstance(value, str) and len(value) > _MAX_INDEXED_STRING_SIZE:
+      return False
+  return True
+
 class Files(collections.Mapping):
   """A mapping of paths to File objects."""
 
@@ -870,8 +1318,12 @@ class Files(collections.Mapping):
     self.load()
     real_paths = [f.real_path for f in self.values()]
     blobs_to_delete = [f.blob for f in self.values() if f.blob]
+    chunks_to_delete = []
+    for titan_file in self.itervalues():
+      chunks_to_delete.extend(titan_file._file.chunks)
 
-    ndb.delete_multi([f._file.key for f in self.itervalues()])
+    ndb.delete_multi(
+        [f._file.key for f in self.itervalues()] + chunks_to_delete)
 
     # Avoid orphaning files by deleting blobs after the delete_multi succeeds.
     # This introduces the other case where _delete_blobs may fail and
@@ -1011,7 +1463,8 @@ class Files(collections.Mapping):
 
   @classmethod
   def list(cls, dir_path, namespace=None, recursive=False, depth=None,
-           filters=None, limit=None, offset=None, order=None, **kwargs):
+           filters=None, limit=None, offset=None, order=None, cache=False,
+           **kwargs):
     """Factory method to return a lazy Files mapping for the given dir.
 
     Args:
@@ -1025,18 +1478,40 @@ class Files(collections.Mapping):
       order: An iterable of FileProperty objects to sort the result set.
       limit: An integer limiting the number of files returned.
       offset: Number of files to offset the query by.
+      cache: Whether to serve the listing from memcache when possible.
+          Cached listings are invalidated by per-directory generation
+          counters, which are bumped by dirs.DirManagerMixin writes and
+          deletes, so only enable this when that mixin is registered.
+          Listing queries are not ancestor queries, so they are eventually
+          consistent: a listing cached right after a write may still miss
+          it, and is then served until LISTING_MEMCACHE_SECONDS expire, so
+          only enable this where a lagging listing is acceptable.
     Raises:
       ValueError: If given an invalid depth argument.
     Returns:
       A populated Files mapping.
     """
-    files_query = _create_files_query(
-        dir_path, namespace=namespace, recursive=recursive, depth=depth,
-        filters=filters, order=order)
-    # TODO(user): support cursors.
-    file_keys = files_query.fetch(limit=limit, offset=offset, keys_only=True)
-    titan_files = cls(
-        [key.id() for key in file_keys], namespace=namespace, **kwargs)
+    list_kwargs = {
+        'dir_path': dir_path,
+        'namespace': namespace,
+        'recursive': recursive,
+        'depth': depth,
+        'filters': list(filters) if hasattr(filters, '__iter__') else filters,
+        'order': order,
+        'limit': limit,
+        'offset': offset,
+    }
+    cache_key = _get_listing_cache_key(**list_kwargs) if cache else None
+    paths = memcache.get(cache_key) if cache_key else None
+    if paths is None:
+      paths = [key.id() for key in _fetch_file_keys(**list_kwargs)]
+      if cache_key:
+        try:
+          memcache.set(cache_key, paths, time=LISTING_MEMCACHE_SECONDS)
+        except ValueError:
+          # Listing is too large for a single memcache value.
+          pass
+    titan_files = cls(paths, namespace=namespace, **kwargs)
     return titan_files
 
   @staticmethod
@@ -1056,11 +1531,150 @@ class Files(collections.Mapping):
     Returns:
       A count of files that match the query.
     """
+    if _needs_depth_scan(dir_path, namespace, recursive, depth):
+      return len(_fetch_keys_with_depth_scan(
+          dir_path, namespace=namespace, depth=depth, filters=filters))
     files_query = _create_files_query(
         dir_path, namespace=namespace, recursive=recursive, depth=depth,
         filters=filters)
     return files_query.count()
 
+  @staticmethod
+  def update_meta(dir_path, meta, namespace=None, recursive=False, depth=None,
+                  filters=None, batch_size=DEFAULT_BATCH_SIZE,
+                  queue=DEFAULT_JOB_QUEUE):
+    """Update meta properties on every file matching a listing query.
+
+    The update runs in deferred tasks, one batch of entities per task, and
+    only touches meta properties: content, blobs, and directory entities are
+    never modified. This operates on real storage paths and does not run
+    File mixins.
+
+    Args:
+      dir_path: Absolute directory path.
+      meta: A dictionary of meta properties to set on each matching file.
+      namespace: The filesystem namespace, or None if the default namespace.
+      recursive: Whether to update files recursively.
+      depth: If recursive, a positive integer to limit the recursion depth.
+      filters: An iterable of FileProperty comparisons.
+      batch_size: The number of entities to fetch and put in each task.
+      queue: The task queue used for the deferred batches.
+    Raises:
+      TypeError: If meta is not given.
+      ValueError: If given invalid query arguments.
+      InvalidMetaError: If given reserved meta property names.
+    Returns:
+      A FilesJob for monitoring progress.
+    """
+    if not meta:
+      raise TypeError('"meta" argument expected, but none given.')
+    _TitanFile.validate_meta_properties(meta)
+    # Build the query once to fail fast on bad arguments.
+    _create_files_query(
+        dir_path, namespace=namespace, recursive=recursive, depth=depth,
+        filters=filters)
+    job = FilesJob.new(namespace=namespace)
+    query_kwargs = {
+        'dir_path': dir_path,
+        'namespace': namespace,
+        'recursive': recursive,
+        'depth': depth,
+        'filters': filters,
+    }
+    deferred.defer(
+        _update_meta_batch, job.key, meta, query_kwargs, batch_size,
+        queue=queue, _queue=queue, _retry_options=_make_job_retry_options())
+    return job
+
+  @staticmethod
+  def reindex(dir_path='/', namespace=None, recursive=True,
+              batch_size=DEFAULT_BATCH_SIZE, queue=DEFAULT_JOB_QUEUE):
+    """Re-put every file under a directory to apply current index profiles.
+
+    Like update_meta(), this runs in deferred tasks and does not run File
+    mixins or change any data.
+
+    Args:
+      dir_path: Absolute directory path.
+      namespace: The filesystem namespace, or None if the default namespace.
+      recursive: Whether to re-put files recursively.
+      batch_size: The number of entities to fetch and put in each task.
+      queue: The task queue used for the deferred batches.
+    Raises:
+      ValueError: If given invalid query arguments.
+    Returns:
+      A FilesJob for monitoring progress.
+    """
+    _create_files_query(dir_path, namespace=namespace, recursive=recursive)
+    job = FilesJob.new(namespace=namespace)
+    query_kwargs = {
+        'dir_path': dir_path,
+        'namespace': namespace,
+        'recursive': recursive,
+    }
+    deferred.defer(
+        _reindex_batch, job.key, query_kwargs, batch_size,
+        queue=queue, _queue=queue, _retry_options=_make_job_retry_options())
+    return job
+
+  @staticmethod
+  def changes_since(token=None, namespace=None, limit=DEFAULT_CHANGES_LIMIT,
+                    settle_seconds=CHANGES_SETTLE_SECONDS):
+    """Returns a page of the namespace's change journal after a token.
+
+    The journal is appended to by dirs.DirManagerMixin on every write and
+    delete, so File writes are only journaled when that mixin is registered.
+    Bulk writes which bypass File mixins (update_meta(), archive imports and
+    mapper.Mapper) are always journaled. A path may appear more than once; the
+    last entry for a path is its current state.
+
+    Usage:
+      changes, token, has_more = files.Files.changes_since(saved_token)
+      # Apply changes, then persist token for the next sync.
+
+    Args:
+      token: A token returned by a previous call, or None to read from the
+          oldest retained entry.
+      namespace: The filesystem namespace, or None if the default namespace.
+      limit: The maximum number of changes to return.
+      settle_seconds: Entries younger than this many seconds are not returned
+          yet, since older entries may still become visible before them.
+    Raises:
+      ValueError: If given an invalid token or namespace.
+      ChangeTokenExpiredError: If entries after the token have been
+          compacted away; the caller must do a full re-sync.
+    Returns:
+      A three-tuple of (list of FileChange objects, next token, has_more).
+      The next token is the given token if there are no new changes.
+    """
+    if token is not None and not _CHANGE_TOKEN_REGEX.match(token):
+      raise ValueError('Invalid change token: %r' % token)
+    if namespace is not None:
+      utils.validate_namespace(namespace)
+
+    journal_ent = _TitanFileJournal.get_by_id(
+        _JOURNAL_STATE_ID, namespace=namespace)
+    if token is not None and journal_ent and journal_ent.compacted_token:
+      if token < journal_ent.compacted_token:
+        raise ChangeTokenExpiredError(
+            'Change token %r predates the compacted journal.' % token)
+
+    end_token = _make_change_token(
+        time.time() - settle_seconds, boundary=True)
+    end_key = ndb.Key(_TitanFileChange, end_token, namespace=namespace)
+    changes_query = _TitanFileChange.query(
+        _TitanFileChange.key < end_key, namespace=namespace)
+    if token is not None:
+      start_key = ndb.Key(_TitanFileChange, token, namespace=namespace)
+      changes_query = changes_query.filter(_TitanFileChange.key > start_key)
+    changes_query = changes_query.order(_TitanFileChange.key)
+    change_ents = changes_query.fetch(limit + 1)
+
+    has_more = len(change_ents) > limit
+    changes = [FileChange._from_entity(ent) for ent in change_ents[:limit]]
+    next_token = changes[-1].token if changes else token
+    return changes, next_token, has_more
+
   @staticmethod
   def validate_paths(paths):
     if not hasattr(paths, '__iter__'):
@@ -1102,6 +1716,194 @@ class OrderedFiles(Files):
     for path in self._ordered_paths:
       yield path
 
+class FilesJob(object):
+  """A handle for monitoring a batch operation run across deferred tasks.
+
+  Usage:
+    job = files.Files.update_meta('/some/dir', meta={'flag': True})
+    # Later, possibly in a different request:
+    job = files.FilesJob(job.key)
+    job.status, job.num_processed, job.num_updated
+  """
+
+  def __init__(self, key, namespace=None):
+    self._key = key
+    self._namespace = namespace
+    self._job_ent = None
+
+  def __repr__(self):
+    return '<FilesJob %r namespace:%r>' % (self.key, self.namespace)
+
+  @property
+  def _job(self):
+    if not self._job_ent:
+      self._job_ent = _TitanFilesJob.get_by_id(
+          self.key, namespace=self.namespace)
+      if not self._job_ent:
+        raise InvalidJobError('Job does not exist: %r' % self.key)
+    return self._job_ent
+
+  @property
+  def key(self):
+    return self._key
+
+  @property
+  def namespace(self):
+    return self._namespace
+
+  @property
+  def exists(self):
+    try:
+      return bool(self._job)
+    except InvalidJobError:
+      return False
+
+  @property
+  def status(self):
+    return self._job.status
+
+  @property
+  def is_done(self):
+    return self.status != JOB_STATUS_RUNNING
+
+  @property
+  def num_processed(self):
+    return self._job.num_processed
+
+  @property
+  def num_updated(self):
+    return self._job.num_updated
+
+  @property
+  def blob_key(self):
+    return self._job.blob_key
+
+  @property
+  def created(self):
+    return self._job.created
+
+  @property
+  def modified(self):
+    return self._job.modified
+
+  def refresh(self):
+    """Drop the loaded job state so the next access re-fetches it."""
+    self._job_ent = None
+    return self
+
+  def serialize(self):
+    return {
+        'key': self.key,
+        'status': self.status,
+        'num_processed': self.num_processed,
+        'num_updated': self.num_updated,
+        'blob_key': str(self.blob_key) if self.blob_key else None,
+        'created': self.created,
+        'modified': self.modified,
+    }
+
+  @classmethod
+  def new(cls, namespace=None):
+    job_ent = _TitanFilesJob(namespace=namespace, status=JOB_STATUS_RUNNING)
+    job_ent.put()
+    job = cls(job_ent.key.id(), namespace=namespace)
+    job._job_ent = job_ent
+    return job
+
+class FileChange(object):
+  """A single entry of a namespace's change journal."""
+
+  def __init__(self, path, action, modified=None, md5_hash=None,
+               namespace=None, token=None):
+    """Constructor.
+
+    Args:
+      path: Absolute path of the changed file.
+      action: One of CHANGE_ACTION_WRITE or CHANGE_ACTION_DELETE.
+      modified: Unix timestamp float of the change. Defaults to now.
+      md5_hash: The md5 hash of the written content, if known.
+      namespace: The filesystem namespace, or None if the default namespace.
+      token: The journal token of a saved change.
+    """
+    if action not in (CHANGE_ACTION_WRITE, CHANGE_ACTION_DELETE):
+      raise ValueError('Invalid change action: %r' % action)
+    self.path = path
+    self.action = action
+    self.modified = time.time() if modified is None else modified
+    self.md5_hash = md5_hash
+    self.namespace = namespace
+    self.token = token
+
+  def __repr__(self):
+    return '<FileChange %s %s namespace:%r>' % (
+        self.action, self.path, self.namespace)
+
+  def serialize(self):
+    return {
+        'path': self.path,
+        'action': self.action,
+        'modified': self.modified,
+        'md5_hash': self.md5_hash,
+        'token': self.token,
+    }
+
+  @classmethod
+  def _from_entity(cls, change_ent):
+    return cls(
+        path=change_ent.path,
+        action=change_ent.action,
+        modified=change_ent.modified,
+        md5_hash=change_ent.md5_hash,
+        namespace=change_ent.key.namespace() or None,
+        token=change_ent.key.id())
+
+def compact_file_changes(namespace=None,
+                         max_age_seconds=CHANGES_RETENTION_SECONDS,
+                         batch_size=CHANGES_COMPACTION_BATCH_SIZE,
+                         queue=DEFAULT_JOB_QUEUE):
+  """Compacts the change journal of a namespace.
+
+  Entries older than max_age_seconds are dropped, and tokens from before that
+  point become expired. Of the remaining entries, all but the newest entry of
+  each path within a batch are dropped, which never hides a path's current
+  state from a reader at any token. Superseded entries in different batches
+  are kept, so that no task has to remember every path of the journal.
+
+  This runs in deferred tasks, one batch per task.
+
+  Args:
+    namespace: The filesystem namespace, or None if the default namespace.
+    max_age_seconds: How long entries are retained.
+    batch_size: The number of entries fetched and deleted per task.
+    queue: The task queue used for the deferred batches.
+  Raises:
+    ValueError: If given an invalid namespace.
+  Returns:
+    A FilesJob for monitoring progress. Its num_updated is the number of
+    deleted entries.
+  """
+  if namespace is not None:
+    utils.validate_namespace(namespace)
+  cutoff_token = _make_change_token(
+      time.time() - max_age_seconds, boundary=True)
+
+  # Advance the watermark first, so no reader can silently skip over entries
+  # which are about to be deleted.
+  journal_ent = _TitanFileJournal.get_by_id(
+      _JOURNAL_STATE_ID, namespace=namespace)
+  if not journal_ent:
+    journal_ent = _TitanFileJournal(id=_JOURNAL_STATE_ID, namespace=namespace)
+  if cutoff_token > (journal_ent.compacted_token or ''):
+    journal_ent.compacted_token = cutoff_token
+    journal_ent.put()
+
+  job = FilesJob.new(namespace=namespace)
+  deferred.defer(
+      _compact_file_changes_batch, job.key, namespace, cutoff_token,
+      batch_size, queue=queue, _queue=queue,
+      _retry_options=_make_job_retry_options())
+  return job
+
 class FileProperty(ndb.GenericProperty):
   """A convenience wrapper for creating filters for Files.list.
 
@@ -1133,6 +1935,8 @@ class _TitanFile(ndb.Expando):
     content: Byte string of the file's contents.
     blob: If content is null, a BlobKey pointing to the file.
     blobs: Deprecated; use "blob" instead.
+    chunks: If content is null, keys of the _TitanFileChunk entities which
+        hold the content, in order.
     created_by: A users.TitanUser of who first created the file, or None.
     modified_by: A users.TitanUser of who last modified the file, or None.
     md5_hash: Pre-computed md5 hash of the entity's content or blob.
@@ -1148,6 +1952,7 @@ class _TitanFile(ndb.Expando):
   content = ndb.BlobProperty()
   blob = ndb.BlobKeyProperty()
   blobs = ndb.BlobKeyProperty(repeated=True)  # Deprecated; use "blob" instead.
+  chunks = ndb.KeyProperty(repeated=True, indexed=False)
   created_by = users.TitanUserProperty()
   modified_by = users.TitanUserProperty()
   md5_hash = ndb.StringProperty(indexed=False)
@@ -1164,6 +1969,7 @@ class _TitanFile(ndb.Expando):
       'content',
       'blob',
       'blobs',
+      'chunks',
       'created_by',
       'modified_by',
       'md5_hash',
@@ -1189,6 +1995,26 @@ class _TitanFile(ndb.Expando):
   def __repr__(self):
     return '<_TitanFile (_File): %s>' % self.key.id()
 
+  def _pre_put_hook(self):
+    index_profile = _get_index_profile(self.namespace, self.path)
+    # Swap in per-entity copies of the properties with the profile's indexing.
+    # This also runs without a profile, since meta properties load as
+    # unindexed if they were last stored under a profile which excluded them.
+    for name, prop in self._properties.items():
+      is_indexed = index_profile is None or index_profile.is_indexed(name)
+      if prop._indexed and not is_indexed:
+        prop = copy.copy(prop)
+        prop._indexed = False
+      elif (not prop._indexed and is_indexed
+            and name not in self.BASE_PROPERTIES
+            and _is_indexable(prop._get_value(self))):
+        prop = copy.copy(prop)
+        prop._indexed = True
+      else:
+        continue
+      self._clone_properties()
+      self._properties[name] = prop
+
   @property
   def path(self):
     return self.key.id()
@@ -1216,8 +2042,139 @@ class _TitanFile(ndb.Expando):
         raise InvalidMetaError(
             'Invalid name for meta property (reserved word): "%s"' % key)
 
+class _TitanFileChunk(ndb.Model):
+  """A piece of a file's content; don't use directly outside of this module.
+
+  Chunk entities are immutable. Each write creates a new set of chunks with a
+  random id prefix, and deletes the chunks it replaced.
+
+  Attributes:
+    content: Byte string of this part of the content.
+  """
+  content = ndb.BlobProperty()
+
+  @classmethod
+  def _get_kind(cls):
+    return '_FileChunk'
+
+class _TitanFilesJob(ndb.Model):
+  """Progress state of a FilesJob; don't use directly outside of this module.
+
+  Attributes:
+    status: One of the JOB_STATUS_* constants.
+    num_processed: The number of file entities visited so far.
+    num_updated: The number of file entities actually changed so far.
+    cursor: Urlsafe start cursor of the next batch to be counted, or None
+        for the first batch. Makes retried batches count only once.
+    blob_key: The BlobKey written by jobs which output a blob, such as
+        archive exports.
+    created: Created datetime.
+    modified: Last-modified datetime.
+  """
+  _use_memcache = False
+
+  status = ndb.StringProperty(indexed=False)
+  num_processed = ndb.IntegerProperty(default=0, indexed=False)
+  num_updated = ndb.IntegerProperty(default=0, indexed=False)
+  cursor = ndb.StringProperty(indexed=False)
+  blob_key = ndb.BlobKeyProperty(indexed=False)
+  created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+  modified = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class _TitanFileChange(ndb.Model):
+  """An entry of the change journal; don't use directly outside of this module.
+
+  The key id is a token which sorts by time: 16 hex digits of microseconds
+  since the epoch, followed by 8 random hex digits.
+
+  Attributes:
+    path: Absolute path of the changed file.
+    action: One of the CHANGE_ACTION_* constants.
+    modified: Unix timestamp float of the change.
+    md5_hash: The md5 hash of written content, or None.
+  """
+  _use_memcache = False
+
+  path = ndb.StringProperty(indexed=False)
+  action = ndb.StringProperty(indexed=False)
+  modified = ndb.FloatProperty(indexed=False)
+  md5_hash = ndb.StringProperty(indexed=False)
+
+  @classmethod
+  def _get_kind(cls):
+    return '_FileChange'
+
+class _TitanFileJournal(ndb.Model):
+  """Per-namespace change journal state.
+
+  Attributes:
+    compacted_token: Entries before this token may have been deleted.
+  """
+  _use_memcache = False
+
+  compacted_token = ndb.StringProperty(indexed=False)
+
+  @classmethod
+  def _get_kind(cls):
+    return '_FileJournal'
+
 # ------------------------------------------------------------------------------
 
+def _make_change_token(timestamp, boundary=False):
+  """Returns a journal token; boundary tokens sort before any entry token."""
+  suffix = 0 if boundary else random.getrandbits(32)
+  return '%016x%08x' % (int(timestamp * 1e6), suffix)
+
+def _journal_file_changes(paths, action, namespace=None, md5_hashes=None):
+  """Appends changes of the given paths to the namespace's change journal.
+
+  This is the journaling hook for every write path: dirs.DirManagerMixin for
+  File writes and deletes, and the bulk writers which bypass File mixins
+  (update_meta(), archive imports and mapper.Mapper).
+
+  Args:
+    paths: Absolute paths of the changed files.
+    action: One of CHANGE_ACTION_WRITE or CHANGE_ACTION_DELETE.
+    namespace: The filesystem namespace, or None if the default namespace.
+    md5_hashes: An optional list of written content hashes, one per path.
+  Returns:
+    A list of the saved FileChange objects.
+  """
+  return _journal_file_changes_async(
+      paths, action, namespace=namespace, md5_hashes=md5_hashes).get_result()
+
+@ndb.tasklet
+def _journal_file_changes_async(paths, action, namespace=None,
+                                md5_hashes=None):
+  """Async version of _journal_file_changes(), for use within transactions."""
+  if md5_hashes is None:
+    md5_hashes = [None] * len(paths)
+  file_changes = [
+      FileChange(path, action, md5_hash=md5_hash, namespace=namespace)
+      for path, md5_hash in zip(paths, md5_hashes)]
+  yield _append_file_changes_async(file_changes)
+  raise ndb.Return(file_changes)
+
+def _append_file_changes(file_changes):
+  """Saves FileChange objects to the journal of their namespaces."""
+  _append_file_changes_async(file_changes).get_result()
+
+@ndb.tasklet
+def _append_file_changes_async(file_changes):
+  change_ents = []
+  for file_change in file_changes:
+    change_ent = _TitanFileChange(
+        id=_make_change_token(file_change.modified),
+        namespace=file_change.namespace,
+        path=file_change.path,
+        action=file_change.action,
+        modified=file_change.modified,
+        md5_hash=file_change.md5_hash,
+    )
+    file_change.token = change_ent.key.id()
+    change_ents.append(change_ent)
+  yield ndb.put_multi_async(change_ents)
+
 def _get_titan_file_ents(paths, namespace=None):
   """Internal method for getting _File entities.
 
@@ -1248,9 +2205,8 @@ def _get_file_entities(titan_files):
     file_ents.append(titan_file._file if titan_file else None)
   return file_ents
 
-def _create_files_query(dir_path, namespace=None, recursive=False, depth=None,
-                        filters=None, order=None):
-  """Creates a ndb.Query object for listing _TitanFile entities."""
+def _validate_list_args(dir_path, recursive=False, depth=None, filters=None):
+  """Validates listing arguments and returns the normalized dir_path."""
   if depth is not None and depth <= 0:
     raise ValueError('depth argument must be a positive integer.')
   if depth is not None and not recursive:
@@ -1262,6 +2218,30 @@ def _create_files_query(dir_path, namespace=None, recursive=False, depth=None,
   # Strip trailing slash.
   if dir_path != '/' and dir_path.endswith('/'):
     dir_path = dir_path[:-1]
+  return dir_path
+
+def _create_files_query(dir_path, namespace=None, recursive=False, depth=None,
+                        filters=None, order=None):
+  """Creates a ndb.Query object for listing _TitanFile entities.
+
+  Recursive listings without a depth, filters, or order (and all recursive
+  listings in namespaces with disabled path indexes) are key range scans.
+
+  Raises:
+    ValueError: If given invalid arguments, or a depth or order which cannot
+        be queried because path indexes are disabled in the namespace.
+  """
+  dir_path = _validate_list_args(
+      dir_path, recursive=recursive, depth=depth, filters=filters)
+
+  if recursive and (not _has_path_indexes(namespace, dir_path)
+                    or (depth is None and not filters and not order)):
+    if depth is not None:
+      raise ValueError(
+          'depth queries require path indexes, which an index profile '
+          'disables under %r in namespace %r.' % (dir_path, namespace))
+    return _create_key_range_query(
+        dir_path, namespace=namespace, filters=filters, order=order)
 
   files_query = _TitanFile.query(namespace=namespace)
   if recursive:
@@ -1270,7 +2250,6 @@ def _create_files_query(dir_path, namespace=None, recursive=False, depth=None,
       dir_path_depth = 0 if dir_path == '/' else dir_path.count('/')
       depth_filter = _TitanFile.depth <= dir_path_depth + depth
       files_query = files_query.filter(depth_filter)
-    files_query = files_query.filter(_TitanFile.paths == dir_path)
   else:
     files_query = files_query.filter(_TitanFile.dir_path == dir_path)
 
@@ -1280,6 +2259,363 @@ def _create_files_query(dir_path, namespace=None, recursive=False, depth=None,
     files_query = files_query.order(*order)
   return files_query
 
+def _create_key_range_query(dir_path, namespace=None, filters=None,
+                            order=None):
+  """Creates a query for all files under a normalized dir_path, by key range.
+
+  Every file below "/a/b" has a key id in the range ["/a/b/", "/a/b0"), since
+  "0" is the character after "/". This scans the built-in key index directly
+  instead of merge-joining the much larger repeated "paths" index.
+  """
+  if order:
+    raise ValueError('Recursive key range listings cannot be ordered.')
+  files_query = _TitanFile.query(namespace=namespace)
+  if dir_path != '/':
+    start_key = ndb.Key(_TitanFile, dir_path + '/', namespace=namespace)
+    end_key = ndb.Key(_TitanFile, dir_path + '0', namespace=namespace)
+    files_query = files_query.filter(_TitanFile.key >= start_key,
+                                     _TitanFile.key < end_key)
+  if filters:
+    files_query = files_query.filter(*filters)
+  return files_query
+
+def _fetch_file_keys(dir_path, namespace=None, recursive=False, depth=None,
+                     filters=None, order=None, limit=None, offset=None):
+  """Returns the list of _TitanFile keys matching a listing."""
+  if _needs_depth_scan(dir_path, namespace, recursive, depth):
+    return _fetch_keys_with_depth_scan(
+        dir_path, namespace=namespace, depth=depth, filters=filters,
+        order=order, limit=limit, offset=offset)
+  files_query = _create_files_query(
+      dir_path, namespace=namespace, recursive=recursive, depth=depth,
+      filters=filters, order=order)
+  # TODO(user): support cursors.
+  return files_query.fetch(limit=limit, offset=offset, keys_only=True)
+
+def _get_listing_generation_key(dir_path, namespace=None):
+  return _LISTING_GENERATION_MEMCACHE_PREFIX + hashlib.md5(
+      repr((namespace or None, dir_path))).hexdigest()
+
+def _get_listing_cache_key(dir_path, namespace=None, recursive=False,
+                           depth=None, filters=None, order=None, limit=None,
+                           offset=None):
+  """Returns the memcache key of a listing's current generation, or None."""
+  dir_path = _validate_list_args(
+      dir_path, recursive=recursive, depth=depth, filters=filters)
+  generation = _get_memcache_generation(
+      _get_listing_generation_key(dir_path, namespace=namespace))
+  if generation is None:
+    return None
+  # Query objects have no canonical repr, so describe them explicitly.
+  query_shape = repr((namespace or None, dir_path, recursive, depth,
+                      _describe_filters(filters), _describe_order(order),
+                      limit, offset, generation))
+  return _LISTING_MEMCACHE_PREFIX + hashlib.md5(query_shape).hexdigest()
+
+def _describe_filters(filters):
+  """Returns a canonical description of listing filters, for cache keys."""
+  if not filters:
+    return ()
+  return tuple(sorted(_describe_filter_node(node) for node in filters))
+
+def _describe_filter_node(node):
+  if isinstance(node, ndb.FilterNode):
+    name, opsymbol, value = node.__getnewargs__()
+    return ('filter', name, opsymbol, repr(value))
+  if isinstance(node, (ndb.ConjunctionNode, ndb.DisjunctionNode)):
+    # "!=" and "IN" comparisons become disjunctions of plain filters.
+    return (node.__class__.__name__,
+            tuple(sorted(_describe_filter_node(child) for child in node)))
+  return ('node', repr(node))
+
+def _describe_order(order):
+  """Returns a canonical description of a listing's sort order."""
+  description = []
+  for prop_order in order or ():
+    if isinstance(prop_order, ndb.Property):
+      description.append(
+          (prop_order._name, datastore_query.PropertyOrder.ASCENDING))
+    else:
+      # A datastore_query.PropertyOrder, as made by -FileProperty('name').
+      description.append((prop_order.prop, prop_order.direction))
+  return tuple(description)
+
+def _get_memcache_generation(generation_key):
+  """Returns the value of a memcache generation counter, seeding it if needed.
+
+  Returns:
+    The current generation, or None if memcache is unavailable.
+  """
+  generation = memcache.get(generation_key)
+  if generation is None:
+    # Seed with a never-used value instead of 0: a counter which was evicted
+    # and restarted from 0 could otherwise match stale cached values.
+    generation = int(time.time() * 1e6)
+    if not memcache.add(generation_key, generation):
+      generation = memcache.get(generation_key)
+  return generation
+
+def _bump_listing_generations(paths, namespace=None):
+  """Invalidates cached listings of every directory containing the paths."""
+  dir_paths = set()
+  for path in paths:
+    dir_paths.update(utils.split_path(path))
+  # Without an initial value, missing counters stay missing and are re-seeded
+  # with a fresh value by the next cached listing.
+  memcache.offset_multi(dict(
+      (_get_listing_generation_key(dir_path, namespace=namespace), 1)
+      for dir_path in dir_paths))
+
+def _needs_depth_scan(dir_path, namespace, recursive, depth):
+  """Whether a depth-limited listing must filter a key range in memory."""
+  return bool(recursive and depth is not None
+              and not _has_path_indexes(namespace, dir_path))
+
+def _fetch_keys_with_depth_scan(dir_path, namespace=None, depth=None,
+                                filters=None, order=None, limit=None,
+                                offset=None):
+  """Lists file keys by key range, filtering the depth in memory."""
+  dir_path = _validate_list_args(
+      dir_path, recursive=True, depth=depth, filters=filters)
+  max_depth = (0 if dir_path == '/' else dir_path.count('/')) + depth
+  files_query = _create_key_range_query(
+      dir_path, namespace=namespace, filters=filters, order=order)
+  file_keys = []
+  num_skipped = 0
+  for key in files_query.iter(keys_only=True, batch_size=DEFAULT_BATCH_SIZE):
+    # A root file like "/foo" has depth 0.
+    if key.id().count('/') - 1 > max_depth:
+      continue
+    if offset and num_skipped < offset:
+      num_skipped += 1
+      continue
+    file_keys.append(key)
+    if limit is not None and len(file_keys) >= limit:
+      break
+  return file_keys
+
+def _update_meta_batch(job_key, meta, query_kwargs, batch_size, cursor=None,
+                       queue=DEFAULT_JOB_QUEUE):
+  """Deferred task: update meta on one page of files and chain the next."""
+  _run_job_batch(
+      _update_meta_batch, (job_key, meta, query_kwargs, batch_size),
+      lambda file_key: _put_meta_async(file_key, meta), job_key, query_kwargs,
+      batch_size, cursor, queue)
+
+def _reindex_batch(job_key, query_kwargs, batch_size, cursor=None,
+                   queue=DEFAULT_JOB_QUEUE):
+  """Deferred task: re-put one page of files and chain the next."""
+  _run_job_batch(
+      _reindex_batch, (job_key, query_kwargs, batch_size), _reput_async,
+      job_key, query_kwargs, batch_size, cursor, queue)
+
+def _compact_file_changes_batch(job_key, namespace, cutoff_token, batch_size,
+                                cursor=None, queue=DEFAULT_JOB_QUEUE):
+  """Deferred task: compact one page of the change journal, chain the next.
+
+  Entries older than cutoff_token are deleted. Newer entries are only
+  deduplicated within this page: seen paths are not carried forward, so a
+  path may keep one entry per page of batch_size entries.
+  """
+
+  def _compact_batch():
+    # Newest first, so the first entry seen for each path is the one to keep.
+    changes_query = _TitanFileChange.query(namespace=namespace)
+    changes_query = changes_query.order(-_TitanFileChange.key)
+    start_cursor = ndb.Cursor(urlsafe=cursor) if cursor is not None else None
+    change_ents, next_cursor, has_more = changes_query.fetch_page(
+        batch_size, start_cursor=start_cursor)
+
+    stale_keys = []
+    seen_paths = set()
+    for change_ent in change_ents:
+      if change_ent.key.id() < cutoff_token or change_ent.path in seen_paths:
+        stale_keys.append(change_ent.key)
+      else:
+        seen_paths.add(change_ent.path)
+    # Deleting is idempotent, so a retried batch deletes nothing new.
+    ndb.delete_multi(stale_keys)
+
+    next_cursor = next_cursor.urlsafe() if has_more and next_cursor else None
+    ndb.transaction(lambda: _finish_job_batch(
+        _compact_file_changes_batch,
+        (job_key, namespace, cutoff_token, batch_size), job_key, namespace,
+        cursor, next_cursor, num_processed=len(change_ents),
+        num_updated=len(stale_keys), queue=queue))
+
+  _run_job_task(job_key, namespace, _compact_batch)
+
+def _run_job_batch(task_func, task_args, put_async_func, job_key, query_kwargs,
+                   batch_size, cursor, queue):
+  """Runs one batch of a FilesJob over a files query.
+
+  Args:
+    task_func: The module-level deferred task function of the job.
+    task_args: Positional arguments of task_func, without cursor and queue.
+    put_async_func: Called with each file key of the batch; returns a Future
+        of whether the file was changed.
+    job_key: The _TitanFilesJob id.
+    query_kwargs: Keyword arguments for _create_files_query().
+    batch_size: The number of files per batch.
+    cursor: Urlsafe start cursor of this batch, or None for the first batch.
+    queue: The task queue used for the deferred batches.
+  """
+  namespace = query_kwargs['namespace']
+
+  def _files_batch():
+    files_query = _create_files_query(**query_kwargs)
+    start_cursor = ndb.Cursor(urlsafe=cursor) if cursor is not None else None
+    file_keys, next_cursor, has_more = files_query.fetch_page(
+        batch_size, start_cursor=start_cursor, keys_only=True)
+
+    # Each file is re-read and written in its own transaction, so that
+    # concurrent content writes are never overwritten by a stale entity.
+    put_futures = [put_async_func(file_key) for file_key in file_keys]
+    ndb.Future.wait_all(put_futures)
+    changed_paths = [file_key.id() for file_key, future
+                     in zip(file_keys, put_futures) if future.get_result()]
+    if changed_paths:
+      # Also after re-indexing, which changes the results of filtered queries.
+      _bump_listing_generations(changed_paths, namespace=namespace)
+
+    next_cursor = next_cursor.urlsafe() if has_more and next_cursor else None
+    ndb.transaction(lambda: _finish_job_batch(
+        task_func, task_args, job_key, namespace, cursor, next_cursor,
+        num_processed=len(file_keys), num_updated=len(changed_paths),
+        queue=queue))
+
+  _run_job_task(job_key, namespace, _files_batch)
+
+def _run_job_task(job_key, namespace, batch_func):
+  """Runs batch_func for a running FilesJob, failing the job on final errors.
+
+  Args:
+    job_key: The _TitanFilesJob id.
+    namespace: The namespace of the job.
+    batch_func: Callable which processes one batch and finishes it with
+        _finish_job_batch().
+  Raises:
+    deferred.PermanentTaskFailure: If the batch can't succeed on retry.
+  """
+  job_ent = _TitanFilesJob.get_by_id(job_key, namespace=namespace)
+  if not job_ent or job_ent.status != JOB_STATUS_RUNNING:
+    logging.error('Files job %r is missing or finalized; skipping.', job_key)
+    return
+  try:
+    batch_func()
+  except (InvalidMetaError, deferred.PermanentTaskFailure) as e:
+    # Invalid meta values won't succeed on retry. Query arguments are
+    # validated before a job starts, so other errors are retried.
+    logging.exception('Files job %r failed.', job_key)
+    _fail_job(job_key, namespace=namespace)
+    raise deferred.PermanentTaskFailure(str(e))
+  except:
+    if _get_task_retry_count() < JOB_TASK_RETRY_LIMIT:
+      logging.exception('Files job %r batch failed; retrying.', job_key)
+    else:
+      logging.exception('Files job %r failed.', job_key)
+      _fail_job(job_key, namespace=namespace)
+    raise
+
+@ndb.tasklet
+def _put_meta_async(file_key, meta):
+  """Transactionally sets meta on a file; returns whether it was changed.
+
+  The change is journaled in the same transaction, so that a retried batch
+  never skips the journal entry of an already-updated file.
+
+  Raises:
+    InvalidMetaError: If a meta value can't be stored.
+  """
+
+  @ndb.tasklet
+  def _put_meta_txn():
+    file_ent = yield file_key.get_async()
+    if not file_ent:
+      # Deleted since the batch was listed.
+      raise ndb.Return(False)
+    is_changed = False
+    try:
+      for key, value in meta.iteritems():
+        if not hasattr(file_ent, key) or getattr(file_ent, key) != value:
+          setattr(file_ent, key, value)
+          is_changed = True
+      if is_changed:
+        yield (
+            file_ent.put_async(),
+            _journal_file_changes_async(
+                [file_ent.path], CHANGE_ACTION_WRITE,
+                namespace=file_key.namespace() or None,
+                md5_hashes=[file_ent.md5_hash]))
+    except datastore_errors.BadValueError as e:
+      raise InvalidMetaError('Invalid meta for %s: %s' % (file_ent.path, e))
+    raise ndb.Return(is_changed)
+
+  # Cross-group, for the journal entry.
+  is_changed = yield ndb.transaction_async(_put_meta_txn, xg=True)
+  raise ndb.Return(is_changed)
+
+@ndb.tasklet
+def _reput_async(file_key):
+  """Transactionally re-puts a file to apply the current index profiles."""
+
+  @ndb.tasklet
+  def _reput_txn():
+    file_ent = yield file_key.get_async()
+    if not file_ent:
+      raise ndb.Return(False)
+    yield file_ent.put_async()
+    raise ndb.Return(True)
+
+  is_reput = yield ndb.transaction_async(_reput_txn)
+  raise ndb.Return(is_reput)
+
+def _finish_job_batch(task_func, task_args, job_key, namespace, cursor,
+                      next_cursor, num_processed, num_updated, queue):
+  """Transactionally counts a finished batch and chains the next one."""
+  job_ent = _TitanFilesJob.get_by_id(job_key, namespace=namespace)
+  if job_ent.status != JOB_STATUS_RUNNING or job_ent.cursor != cursor:
+    # A previous attempt of this task already counted the batch.
+    return
+  job_ent.num_processed += num_processed
+  job_ent.num_updated += num_updated
+  job_ent.cursor = next_cursor
+  if next_cursor:
+    deferred.defer(
+        task_func, *task_args, cursor=next_cursor, queue=queue, _queue=queue,
+        _transactional=True, _retry_options=_make_job_retry_options())
+  else:
+    job_ent.status = JOB_STATUS_SUCCESSFUL
+  job_ent.put()
+
+def _finish_blob_job(job_key, namespace, blob_key, num_processed):
+  """Transactionally records the output blob of a single-task job.
+
+  Returns:
+    False if a previous attempt of the task already finished the job, in
+    which case blob_key is not recorded.
+  """
+  job_ent = _TitanFilesJob.get_by_id(job_key, namespace=namespace)
+  if job_ent.status != JOB_STATUS_RUNNING:
+    return False
+  job_ent.num_processed = num_processed
+  job_ent.blob_key = blob_key
+  job_ent.status = JOB_STATUS_SUCCESSFUL
+  job_ent.put()
+  return True
+
+def _fail_job(job_key, namespace=None):
+  job_ent = _TitanFilesJob.get_by_id(job_key, namespace=namespace)
+  if job_ent and job_ent.status == JOB_STATUS_RUNNING:
+    job_ent.status = JOB_STATUS_FAILED
+    job_ent.put()
+
+def _make_job_retry_options():
+  return taskqueue.TaskRetryOptions(task_retry_limit=JOB_TASK_RETRY_LIMIT)
+
+def _get_task_retry_count():
+  return int(os.environ.get('HTTP_X_APPENGINE_TASKRETRYCOUNT', 0))
+
 def _delete_blobs(blobs, file_paths):
   blobstore.delete([b.key() for b in blobs])
   _clear_blob_cache_for_paths(file_paths)
@@ -1290,34 +2626,165 @@ def _read_content_or_blob(titan_file):
     raise BadFileError('File does not exist: %s' % titan_file.path)
   if file_ent.content is not None:
     content = file_ent.content
+  elif file_ent.chunks:
+    content = _read_chunks(file_ent.chunks, path=titan_file.path)
   else:
     content = _get_blob_cache(file_ent.path)
     if content is None:
-      blob = file_ent.blob
-      if not file_ent.blob:
-        # Backwards-compatibility with deprecated "blobs" property:
-        blob = blobstore.BlobInfo.get(file_ent.blobs[0])
-      if not isinstance(blob, blobstore.BlobInfo):
-        blob = blobstore.BlobInfo(blob)
-      try:
-        content = blob.open().read()
-      except blobstore.BlobNotFoundError:
-        raise blobstore.BlobNotFoundError(
-            'Blob associated to path was not found: %s' % titan_file.path)
-      _store_blob_cache(file_ent.path, content)
+      content = _read_blob(file_ent, path=titan_file.path)
+      _maybe_store_blob_cache(file_ent.path, content)
   if file_ent.encoding:
     return content.decode(file_ent.encoding)
   return content
 
+@ndb.tasklet
+def _read_content_or_blob_async(titan_file):
+  """Asynchronous version of _read_content_or_blob(); returns a Future."""
+  file_ent = _get_file_entities(titan_file)
+  if not file_ent:
+    raise BadFileError('File does not exist: %s' % titan_file.path)
+  if file_ent.content is not None:
+    content = file_ent.content
+  elif file_ent.chunks:
+    chunk_ents = yield ndb.get_multi_async(file_ent.chunks)
+    content = _join_chunks(chunk_ents, path=titan_file.path)
+  else:
+    cache_key = _BLOB_MEMCACHE_PREFIX + file_ent.path
+    content = yield sharded_cache.GetAsync(
+        cache_key, caller=_BLOB_CACHE_STATS_CALLER)
+    if content is None:
+      content = yield _read_blob_async(file_ent, path=titan_file.path)
+      if _admit_blob_cache(file_ent.path, content):
+        yield sharded_cache.SetAsync(
+            cache_key, content, caller=_BLOB_CACHE_STATS_CALLER)
+  if file_ent.encoding:
+    content = content.decode(file_ent.encoding)
+  raise ndb.Return(content)
+
+def _read_blob(file_ent, path=None):
+  """Reads the full content of a file entity's blob from blobstore."""
+  blob = file_ent.blob
+  if not file_ent.blob:
+    # Backwards-compatibility with deprecated "blobs" property:
+    blob = blobstore.BlobInfo.get(file_ent.blobs[0])
+  if not isinstance(blob, blobstore.BlobInfo):
+    blob = blobstore.BlobInfo(blob)
+  try:
+    content = blob.open().read()
+  except blobstore.BlobNotFoundError:
+    raise blobstore.BlobNotFoundError(
+        'Blob associated to path was not found: %s' % path)
+  _log_blobstore_read(len(content))
+  return content
+
+@ndb.tasklet
+def _read_blob_async(file_ent, path=None):
+  """Asynchronous version of _read_blob(); returns a Future.
+
+  The blob is fetched in parallel ranges of up to MAX_BLOB_FETCH_SIZE bytes.
+  """
+  # Backwards-compatibility with deprecated "blobs" property.
+  blob_key = file_ent.blob or file_ent.blobs[0]
+  blob_info = yield ndb_blobstore.BlobInfo.get_async(blob_key)
+  if not blob_info:
+    raise blobstore.BlobNotFoundError(
+        'Blob associated to path was not found: %s' % path)
+  fetch_size = blobstore.MAX_BLOB_FETCH_SIZE
+  ranges = yield [
+      ndb_blobstore.fetch_data_async(blob_key, start, start + fetch_size - 1)
+      for start in xrange(0, blob_info.size, fetch_size)]
+  content = ''.join(ranges)
+  _log_blobstore_read(len(content))
+  raise ndb.Return(content)
+
+def _write_chunks(content, namespace=None):
+  """Stores content as new chunk entities and returns their keys."""
+  chunk_set_id = uuid.uuid4().hex
+  chunk_size = _storage_config.chunk_size
+  chunk_ents = []
+  for i, start in enumerate(xrange(0, len(content), chunk_size)):
+    chunk_ents.append(_TitanFileChunk(
+        id='%s:%d' % (chunk_set_id, i),
+        namespace=namespace,
+        content=content[start:start + chunk_size]))
+  return ndb.put_multi(chunk_ents)
+
+def _read_chunks(chunk_keys, path=None):
+  """Reads and joins the content of chunk entities in a single get_multi."""
+  return _join_chunks(ndb.get_multi(chunk_keys), path=path)
+
+def _join_chunks(chunk_ents, path=None):
+  if None in chunk_ents:
+    raise BadFileError('Content chunks are missing for path: %s' % path)
+  return ''.join([chunk_ent.content for chunk_ent in chunk_ents])
+
 def _get_blob_cache(path):
   """Get a blob's content from the sharded cache."""
-  return sharded_cache.Get(_BLOB_MEMCACHE_PREFIX + path)
+  return sharded_cache.Get(
+      _BLOB_MEMCACHE_PREFIX + path, caller=_BLOB_CACHE_STATS_CALLER)
 
 def _store_blob_cache(path, content):
   """Set a blob's content in the sharded cache."""
-  return sharded_cache.Set(_BLOB_MEMCACHE_PREFIX + path, content)
+  return sharded_cache.Set(
+      _BLOB_MEMCACHE_PREFIX + path, content, caller=_BLOB_CACHE_STATS_CALLER)
+
+def _maybe_store_blob_cache(path, content):
+  """Store a blob's read content only if the admission policy admits it.
+
+  Returns:
+    True if the content was stored, False if it was rejected.
+  """
+  admitted = _admit_blob_cache(path, content)
+  if admitted:
+    _store_blob_cache(path, content)
+  return admitted
+
+def _maybe_store_written_blob_cache(path, content):
+  """Like _maybe_store_blob_cache(), but for written content.
+
+  Writes are not accesses, so they never count towards admission.
+  """
+  admitted = _blob_cache_config.policy.admit_write(path, len(content))
+  if admitted:
+    _store_blob_cache(path, content)
+  return admitted
+
+def _admit_blob_cache(path, content):
+  """Asks the admission policy whether to cache a blob's read content."""
+  admitted = _blob_cache_config.policy.admit(path, len(content))
+  _log_blob_cache_admission(admitted)
+  return admitted
+
+def _log_blob_cache_admission(admitted):
+  if admitted:
+    _log_blob_cache_counter('files/blob_cache/admit')
+  else:
+    _log_blob_cache_counter('files/blob_cache/reject')
+
+def _log_blob_cache_counter(name, value=1):
+  """Logs a sampled blob cache counter, scaled up like sharded_cache's."""
+  if random.random() >= sharded_cache.STATS_SAMPLE_RATE:
+    return
+  # Imported here since titan.stats depends on titan.files.
+  from titan import stats
+  counter = stats.Counter(name)
+  counter.offset(int(round(value / sharded_cache.STATS_SAMPLE_RATE)))
+  stats.log_counters([counter], counters_func=_make_blob_cache_counters)
+
+def _log_blobstore_read(num_bytes):
+  # Bytes served from the cache are counted by sharded_cache, as
+  # 'sharded_cache/blob_cache/get/bytes', at the same sample rate.
+  _log_blob_cache_counter('files/blob_cache/blobstore_bytes', num_bytes)
+
+def _make_blob_cache_counters():
+  from titan import stats
+  return [
+      stats.Counter('files/blob_cache/admit'),
+      stats.Counter('files/blob_cache/reject'),
+      stats.Counter('files/blob_cache/blobstore_bytes'),
+  ]
 
 def _clear_blob_cache_for_paths(paths):
   """Delete blobs from the sharded cache."""
-  for path in paths:
-    sharded_cache.Delete(_BLOB_MEMCACHE_PREFIX + path)
+  sharded_cache.DeleteMulti([_BLOB_MEMCACHE_PREFIX + path for path in paths],
+                            caller=_BLOB_CACHE_STATS_CALLER)
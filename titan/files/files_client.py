@@ -18,6 +18,7 @@
 import collections
 import datetime
 import json
+import time
 import urllib
 import urllib2
 import urlparse
@@ -30,6 +31,15 @@ FILE_API_PATH_BASE = '/_titan/file'
 FILES_API_PATH_BASE = '/_titan/files'
 FILE_READ_API = '/read'
 FILE_NEWBLOB_API = '/newblob'
+FILES_EXPORT_API = '/export'
+FILES_EXPORT_DOWNLOAD_API = '/export/download'
+FILES_IMPORT_API = '/import'
+FILES_CHANGES_API = '/changes'
+ARCHIVE_MIME_TYPE = 'application/x-gzip'
+# Exported archives are downloaded in byte ranges of this size.
+ARCHIVE_DOWNLOAD_RANGE_SIZE = 8 * 1024 * 1024
+# Interval between checks of whether a remote export has finished.
+EXPORT_POLL_SECONDS = 1
 
 class Error(Exception):
   pass
@@ -40,6 +50,12 @@ class BadRemoteFileError(Error):
 class BadRemoteFilesError(Error):
   pass
 
+class ChangeTokenExpiredError(Error):
+  pass
+
+class ExportFailedError(Error):
+  pass
+
 class RemoteFileFactory(titan_rpc.AbstractRemoteFactory):
   """Factory for creating RemoteFile objects."""
 
@@ -189,27 +205,12 @@ class RemoteFile(object):
 
     try:
       if fp:
-        # If given a file pointer, create a multipart encoded request.
-        path = FILE_API_PATH_BASE + FILE_NEWBLOB_API
-        write_blob_url = self._titan_client.fetch_url(path).content
-        params.append(('file', fp))
-        content_generator, headers = encode.multipart_encode(params)
-        # Make custom opener to support multipart POST requests.
-        opener = urllib2.build_opener()
-        opener.add_handler(streaminghttp.StreamingHTTPHandler())
-        opener.add_handler(streaminghttp.StreamingHTTPSHandler())
-        # Upload directly to the blobstore URL, avoiding authentication.
-        request = urllib2.Request(write_blob_url, data=content_generator,
-                                  headers=headers)
-        response = opener.open(request)
-        # Pull the blobkey out of the query params and fall through
-        # to the POST to /_titan/file.
-        url = response.geturl()
-        response_params = urlparse.parse_qs(urlparse.urlparse(url).query)
-
         # Verify that "blob" was not passed in.
         assert not blob
-        params.append(('blob', response_params['blob'][0]))
+        # Fall through to the POST to /_titan/file with the new blob key.
+        params.append(('file', fp))
+        blob = _upload_to_blobstore(self._titan_client, params)
+        params.append(('blob', blob))
       path_param = {'path': self.path}
       url = '%s?%s' % (FILE_API_PATH_BASE, urllib.urlencode(path_param))
       payload = urllib.urlencode(params)
@@ -335,6 +336,118 @@ class RemoteFiles(collections.Mapping):
                                            _titan_client=self._titan_client)
     return self
 
+  def export_archive(self, dir_path, fp, recursive=True, depth=None,
+                     namespace=None):
+    """Downloads a tar.gz archive of a remote directory tree.
+
+    The archive is exported into a remote blob by a task, which is polled
+    every EXPORT_POLL_SECONDS. The blob is then downloaded in byte ranges of
+    ARCHIVE_DOWNLOAD_RANGE_SIZE.
+
+    Args:
+      dir_path: Absolute directory path.
+      fp: A writable file object where the archive will be written.
+      recursive: Whether to export files recursively.
+      depth: If recursive, a positive integer to limit the recursion depth.
+      namespace: The filesystem namespace, or None if the default namespace.
+    Raises:
+      ExportFailedError: If the remote export task failed.
+    Returns:
+      The number of exported files.
+    """
+    params = [('dir_path', dir_path)]
+    if not recursive:
+      params.append(('recursive', 'false'))
+    if depth is not None:
+      params.append(('depth', depth))
+    if namespace is not None:
+      params.append(('namespace', namespace))
+    url = FILES_API_PATH_BASE + FILES_EXPORT_API
+    response = self._titan_client.fetch_url(
+        url, method='POST', payload=urllib.urlencode(params))
+    self._verify_response(response)
+    job_params = [('job', json.loads(response.content)['key'])]
+    if namespace is not None:
+      job_params.append(('namespace', namespace))
+    url = '%s?%s' % (url, urllib.urlencode(job_params))
+    while True:
+      response = self._titan_client.fetch_url(url)
+      self._verify_response(response)
+      data = json.loads(response.content)
+      if data['status'] == 'failed':
+        raise ExportFailedError('Export failed: %r' % dir_path)
+      if data['status'] != 'running':
+        break
+      time.sleep(EXPORT_POLL_SECONDS)
+
+    url = '%s%s?%s' % (FILES_API_PATH_BASE, FILES_EXPORT_DOWNLOAD_API,
+                       urllib.urlencode({'blob': data['blob']}))
+    for start in xrange(0, data['size'], ARCHIVE_DOWNLOAD_RANGE_SIZE):
+      end = min(start + ARCHIVE_DOWNLOAD_RANGE_SIZE, data['size']) - 1
+      response = self._titan_client.fetch_url(
+          url, headers={'Range': 'bytes=%d-%d' % (start, end)})
+      self._verify_response(response)
+      fp.write(response.content)
+    return data['num_files']
+
+  def import_archive(self, fp, dir_path='/', namespace=None):
+    """Uploads a tar.gz archive created by export_archive.
+
+    The archive is streamed to blobstore and imported from there, so it is
+    not limited to the maximum request size.
+
+    Args:
+      fp: A readable file object of the archive.
+      dir_path: The remote directory path to import files into.
+      namespace: The filesystem namespace, or None if the default namespace.
+    Returns:
+      A list of the imported remote paths.
+    """
+    # Uploaded as an archive, since only archive blobs can be imported.
+    archive_param = encode.MultipartParam(
+        'file', filename=getattr(fp, 'name', None) or 'archive.tar.gz',
+        filetype=ARCHIVE_MIME_TYPE, fileobj=fp)
+    blob = _upload_to_blobstore(self._titan_client, [archive_param])
+    params = [('dir_path', dir_path), ('blob', blob)]
+    if namespace is not None:
+      params.append(('namespace', namespace))
+    url = FILES_API_PATH_BASE + FILES_IMPORT_API
+    response = self._titan_client.fetch_url(
+        url, method='POST', payload=urllib.urlencode(params))
+    self._verify_response(response)
+    return json.loads(response.content)['paths']
+
+  def changes_since(self, token=None, namespace=None, limit=None):
+    """Fetches a page of the remote change journal after a token.
+
+    Args:
+      token: A token returned by a previous call, or None to read from the
+          oldest retained entry.
+      namespace: The filesystem namespace, or None if the default namespace.
+      limit: The maximum number of changes to return.
+    Raises:
+      ChangeTokenExpiredError: If the token has been compacted away and the
+          caller must do a full re-sync.
+    Returns:
+      A three-tuple of (list of change dictionaries, next token, has_more).
+      Each change has "path", "action", "modified", "md5_hash" and "token".
+    """
+    params = []
+    if token is not None:
+      params.append(('token', token))
+    if namespace is not None:
+      params.append(('namespace', namespace))
+    if limit is not None:
+      params.append(('limit', limit))
+    url = '%s%s?%s' % (FILES_API_PATH_BASE, FILES_CHANGES_API,
+                       urllib.urlencode(params))
+    response = self._titan_client.fetch_url(url)
+    if response.status_code == 410:
+      raise ChangeTokenExpiredError('Change token expired: %r' % token)
+    self._verify_response(response)
+    data = json.loads(response.content)
+    return data['changes'], data['token'], data['has_more']
+
   def delete(self):
     # TODO(user): implement batch operation. For now, the naive way:
     for remote_file in self.itervalues():
@@ -349,3 +462,24 @@ class RemoteFiles(collections.Mapping):
     elif not 200 <= response.status_code <= 299:
       raise titan_rpc.RpcError(response.content)
 
+def _upload_to_blobstore(titan_client, params):
+  """Uploads multipart params, including a "file" object, to blobstore.
+
+  Returns:
+    The string key of the new blob.
+  """
+  path = FILE_API_PATH_BASE + FILE_NEWBLOB_API
+  write_blob_url = titan_client.fetch_url(path).content
+  content_generator, headers = encode.multipart_encode(params)
+  # Make custom opener to support multipart POST requests.
+  opener = urllib2.build_opener()
+  opener.add_handler(streaminghttp.StreamingHTTPHandler())
+  opener.add_handler(streaminghttp.StreamingHTTPSHandler())
+  # Upload directly to the blobstore URL, avoiding authentication.
+  request = urllib2.Request(write_blob_url, data=content_generator,
+                            headers=headers)
+  response = opener.open(request)
+  # Pull the blobkey out of the query params.
+  url = response.geturl()
+  response_params = urlparse.parse_qs(urlparse.urlparse(url).query)
+  return response_params['blob'][0]
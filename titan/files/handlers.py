@@ -20,22 +20,28 @@ try:
 except ImportError:
   pass
 
+import collections
 import json
 import logging
 import time
 import urllib
 
 import webapp2
-from google.appengine.api import blobstore
+from google.appengine.api import taskqueue
+from google.appengine.ext import blobstore
 from google.appengine.ext.webapp import blobstore_handlers
 
 from titan import files
 from titan.common import handlers
 from titan.common import utils
+from titan.files import archive
 from titan.files import dirs
 
 _ENABLE_EXCEPTION_LOGGING = True
 
+# Exported archive blobs are deleted after this long.
+EXPORT_BLOB_EXPIRATION_SECONDS = 60 * 60
+
 class FileHandler(handlers.BaseHandler):
   """RESTful file handler."""
 
@@ -166,6 +172,141 @@ class FilesHandler(handlers.BaseHandler):
 
     self.write_json_response(titan_files)
 
+class FilesExportHandler(handlers.BaseHandler):
+  """Handler to export a directory tree into a tar.gz archive blob.
+
+  POST starts the export in a deferred task and returns its job, which is
+  polled with GET until done. The archive is written to blobstore page by
+  page, rather than buffered in a response, and is downloaded from
+  FilesExportDownloadHandler.
+  """
+
+  def get(self):
+    """GET handler; returns the export job and, once done, its archive."""
+    job_key = self.request.get('job')
+    namespace = self.request.get('namespace', None) or None
+    try:
+      # Job keys are integer ids.
+      job = files.FilesJob(int(job_key), namespace=namespace)
+      data = job.serialize()
+    except (files.InvalidJobError, ValueError):
+      self.error(404)
+      return
+    if job.blob_key:
+      data['blob'] = str(job.blob_key)
+      data['size'] = blobstore.BlobInfo.get(job.blob_key).size
+      data['num_files'] = job.num_processed
+    self.write_json_response(data)
+
+  def post(self):
+    """POST handler."""
+    dir_path = self.request.get('dir_path')
+    namespace = self.request.get('namespace', None) or None
+    recursive = self.request.get('recursive', 'true') != 'false'
+    depth = self.request.get('depth', None)
+    try:
+      depth = int(depth) if depth else None
+      job = archive.defer_export_to_blobstore(
+          dir_path, namespace=namespace, recursive=recursive, depth=depth,
+          blob_expiration_seconds=EXPORT_BLOB_EXPIRATION_SECONDS)
+    except ValueError:
+      self.error(400)
+      _MaybeLogException('Bad request:')
+      return
+    self.response.set_status(202)
+    self.write_json_response(job)
+
+class FilesExportDownloadHandler(blobstore_handlers.BlobstoreDownloadHandler):
+  """Handler to download an exported archive, optionally by byte range."""
+
+  def get(self):
+    """GET handler."""
+    blob_key = self.request.get('blob')
+    blob_info = blobstore.BlobInfo.get(blob_key) if blob_key else None
+    # Only serve archives, not arbitrary blobs.
+    if not blob_info or blob_info.content_type != archive.ARCHIVE_MIME_TYPE:
+      self.error(404)
+      return
+    self.send_blob(blob_info, use_range=True, save_as='export.tar.gz')
+
+class FilesImportHandler(handlers.BaseHandler):
+  """Handler to import a tar.gz archive.
+
+  The archive is read from the blob given by the "blob" parameter, which must
+  have the archive content type and is deleted afterwards, or else from the
+  request body.
+  """
+
+  def post(self):
+    """POST handler."""
+    dir_path = self.request.get('dir_path', '/')
+    namespace = self.request.get('namespace', None) or None
+    blob_key = self.request.get('blob', None)
+    if blob_key:
+      # Only import (and then delete) archives, not arbitrary blobs.
+      blob_info = blobstore.BlobInfo.get(blob_key)
+      if not blob_info or blob_info.content_type != archive.ARCHIVE_MIME_TYPE:
+        self.error(400)
+        return
+      # Streamed from blobstore, so archives aren't limited to the maximum
+      # request size.
+      fileobj = blobstore.BlobReader(blob_key)
+    else:
+      fileobj = self.request.body_file
+    try:
+      paths = archive.import_archive(
+          fileobj, dir_path=dir_path, namespace=namespace)
+    except (archive.InvalidArchiveError, ValueError):
+      self.error(400)
+      _MaybeLogException('Bad request:')
+      return
+    if blob_key:
+      blobstore.delete(blob_key)
+    self.response.set_status(201)
+    self.write_json_response({'paths': paths})
+
+class FilesChangesHandler(handlers.BaseHandler):
+  """Handler to read the change journal of a namespace."""
+
+  def get(self):
+    """GET handler."""
+    token = self.request.get('token', None) or None
+    namespace = self.request.get('namespace', None) or None
+    limit = self.request.get('limit', files.DEFAULT_CHANGES_LIMIT)
+    try:
+      changes, token, has_more = files.Files.changes_since(
+          token, namespace=namespace, limit=int(limit))
+    except files.ChangeTokenExpiredError:
+      # The client must re-sync the full tree.
+      self.error(410)
+      return
+    except ValueError:
+      self.error(400)
+      _MaybeLogException('Bad request:')
+      return
+    self.write_json_response({
+        'changes': changes,
+        'token': token,
+        'has_more': has_more,
+    })
+
+class FilesChangesCompactHandler(handlers.BaseHandler):
+  """Change journal compaction handler."""
+
+  def get(self):
+    """GET handler; must be GET because it is run from a cron job."""
+    namespace = self.request.get('namespace', None) or None
+    max_age = self.request.get(
+        'max_age_seconds', files.CHANGES_RETENTION_SECONDS)
+    try:
+      job = files.compact_file_changes(
+          namespace=namespace, max_age_seconds=int(max_age))
+    except ValueError:
+      self.error(400)
+      _MaybeLogException('Bad request:')
+      return
+    self.write_json_response(job)
+
 class FileReadHandler(blobstore_handlers.BlobstoreDownloadHandler):
   """Handler to return contents of a file."""
 
@@ -235,17 +376,45 @@ class DirsHandler(handlers.BaseHandler):
     dir_path = self.request.get('dir_path')
     if not dir_path:
       self.abort(400)
-    titan_dirs = dirs.Dirs.list(dir_path)
-    self.write_json_response(titan_dirs)
+    recursive = self.request.get('recursive', 'false')
+    recursive = False if recursive == 'false' else True
+    if not recursive:
+      titan_dirs = dirs.Dirs.list(dir_path, load=True)
+      self.write_json_response(titan_dirs)
+      return
+
+    # Map every walked dir path to its sub-directories.
+    try:
+      depth = self.request.get('depth', None)
+      depth = int(depth) if depth else None
+      result = collections.OrderedDict(dirs.Dirs.walk(dir_path, depth=depth))
+    except ValueError:
+      self.error(400)
+      _MaybeLogException('Invalid parameter')
+      return
+    self.write_json_response(result)
 
 class DirsProcessDataHandler(handlers.BaseHandler):
   """Dirs processing handler."""
 
   def get(self):
     """GET handler; must be GET because it is run from a cron job."""
-    runtime = self.request.get('runtime', dirs.DEFAULT_CRON_RUNTIME_SECONDS)
+    try:
+      runtime = int(
+          self.request.get('runtime', dirs.DEFAULT_CRON_RUNTIME_SECONDS))
+      num_workers = int(self.request.get('num_workers', 1))
+      if num_workers < 1:
+        raise ValueError('num_workers must be a positive integer.')
+    except ValueError:
+      self.error(400)
+      _MaybeLogException('Bad request:')
+      return
+    # Fan out to more consumers; this request is also one of them.
+    for _ in range(num_workers - 1):
+      taskqueue.add(url=self.request.path, method='GET',
+                    params={'runtime': runtime})
     dir_task_consumer = dirs.DirTaskConsumer()
-    results = dir_task_consumer.process_windows_with_backoff(runtime=int(runtime))
+    results = dir_task_consumer.process_windows_with_backoff(runtime=runtime)
     self.write_json_response(results)
 
 def _GetExtraParams(request_params):
@@ -271,6 +440,11 @@ def _MaybeLogException(message):
 ROUTES = (
     ('/_titan/file', FileHandler),
     ('/_titan/files', FilesHandler),
+    ('/_titan/files/export', FilesExportHandler),
+    ('/_titan/files/export/download', FilesExportDownloadHandler),
+    ('/_titan/files/import', FilesImportHandler),
+    ('/_titan/files/changes', FilesChangesHandler),
+    ('/_titan/files/changes/compact', FilesChangesCompactHandler),
     ('/_titan/file/read', FileReadHandler),
     ('/_titan/file/newblob', FileNewBlobHandler),
     ('/_titan/file/finalizeblob', FileFinalizeBlobHandler),
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parallel map/reduce jobs over Titan file trees.
+
+A recursive listing is split into key ranges (shards) at a random sample of
+file keys, like dirs.DirInitializer. Each shard runs in its own Titan Tasks
+deferred task, which calls the user's map() for every file and flushes meta
+updates in batches. Mapped results can optionally be reduced through a Titan
+Pipelines aggregate processor.
+
+Usage:
+  class ChecksumMapper(mapper.Mapper):
+
+    def map(self, titan_file):
+      self.put_meta(titan_file, {'checksum': titan_file.md5_hash})
+      return titan_file.size
+
+  class TotalSizeProcessor(pipelines.BaseAggregateProcessor):
+
+    def finalize(self):
+      logging.info('Total bytes: %d', sum(sum(data) for data in self.data))
+
+  file_mapper = ChecksumMapper(
+      '/some/dir', reduce_processor=TotalSizeProcessor())
+  task_manager = file_mapper.run(description='Checksum /some/dir')
+  # Poll task_manager.status, or subscribe to its broadcast channel.
+
+Mapper subclasses and reduce processors are pickled into deferred tasks, so
+they must be defined at module level.
+"""
+
+import logging
+
+from google.appengine.ext import ndb
+
+from titan import files
+from titan import pipelines
+from titan import tasks
+
+__all__ = [
+    # Constants.
+    'DEFAULT_NUM_SHARDS',
+    'DEFAULT_BATCH_SIZE',
+    'TASK_MANAGER_GROUP',
+    # Classes.
+    'Mapper',
+]
+
+# Number of shard tasks of a recursive mapper. Each shard must be mapped within
+# the task deadline, so raise this for larger trees.
+DEFAULT_NUM_SHARDS = 32
+# Number of __scatter__ samples per shard used to split key ranges.
+_SCATTER_OVERSAMPLING = 32
+
+# Number of entities fetched and written per batch within a shard.
+DEFAULT_BATCH_SIZE = 100
+
+TASK_MANAGER_GROUP = 'titan-mapper'
+
+class Mapper(object):
+  """Base class for a map job over every file matching a listing query.
+
+  Only recursive mappers without a depth are split into shards; others run
+  in a single shard.
+  """
+
+  def __init__(self, dir_path, namespace=None, recursive=True, depth=None,
+               filters=None, num_shards=DEFAULT_NUM_SHARDS,
+               batch_size=DEFAULT_BATCH_SIZE, reduce_processor=None,
+               reduce_name=None, file_kwargs=None):
+    """Constructor.
+
+    Args:
+      dir_path: Absolute directory path.
+      namespace: The filesystem namespace, or None if the default namespace.
+      recursive: Whether to map over files recursively.
+      depth: If recursive, a positive integer to limit the recursion depth.
+      filters: An iterable of files.FileProperty equality comparisons.
+          Sharded maps need a _TitanFile index of the filtered properties
+          followed by __key__, as described in titan/files/index.yaml.
+      num_shards: The maximum number of shard tasks. Fewer shards are used if
+          few sampled keys fall under dir_path.
+      batch_size: The number of entities fetched and written per batch.
+      reduce_processor: An optional pipelines.BaseAggregateProcessor. Each
+          shard pushes its list of non-None map() results to it.
+      reduce_name: The pipeline name used for reducing. Defaults to the
+          mapper class name.
+      file_kwargs: Keyword arguments passed through to File objects.
+    Raises:
+      ValueError: If given invalid query arguments.
+    """
+    self.dir_path = files._validate_list_args(
+        dir_path, recursive=recursive, depth=depth, filters=filters)
+    self.namespace = namespace
+    self.recursive = recursive
+    self.depth = depth
+    self.filters = filters
+    self.num_shards = num_shards
+    self.batch_size = batch_size
+    self.reduce_processor = reduce_processor
+    self.reduce_name = reduce_name or self.__class__.__name__
+    self.file_kwargs = file_kwargs or {}
+    self._pending_meta = {}
+    # Build the query once to fail fast on bad arguments.
+    self._make_query()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    # Never carry unflushed writes across a pickling boundary.
+    state['_pending_meta'] = {}
+    return state
+
+  def map(self, titan_file):
+    """Abstract method called once per file.
+
+    Args:
+      titan_file: A loaded files.File object.
+    Returns:
+      A JSON-serializable value to reduce, or None to reduce nothing.
+    """
+    raise NotImplementedError('Subclasses should implement abstract method.')
+
+  def put_meta(self, titan_file, meta):
+    """Buffer a meta update for the given file until the end of the batch.
+
+    This avoids File.write() and its mixins, and never touches content.
+
+    Args:
+      titan_file: The files.File object passed to map().
+      meta: A dictionary of meta properties to set.
+    """
+    files._TitanFile.validate_meta_properties(meta)
+    file_key = files._get_file_entities(titan_file).key
+    self._pending_meta.setdefault(file_key, {}).update(meta)
+
+  def flush(self):
+    """Write all buffered meta updates in parallel transactions.
+
+    Like files.Files.update_meta(), each file is re-read in its transaction,
+    so content written since the file was mapped is never overwritten.
+    """
+    if self._pending_meta:
+      file_keys = self._pending_meta.keys()
+      put_futures = [files._put_meta_async(key, self._pending_meta[key])
+                     for key in file_keys]
+      ndb.Future.wait_all(put_futures)
+      changed_paths = [key.id() for key, future
+                       in zip(file_keys, put_futures) if future.get_result()]
+      if changed_paths:
+        files._bump_listing_generations(
+            changed_paths, namespace=self.namespace)
+      self._pending_meta = {}
+
+  def run(self, description=None, broadcast_channel_key=None,
+          queue=tasks.DEFAULT_QUEUE_NAME):
+    """Split the listing into shards and defer one task per shard.
+
+    Args:
+      description: Arbitrary text stored with the TaskManager.
+      broadcast_channel_key: Optional key of a channel.BroadcastChannel used
+          for realtime task status messages.
+      queue: The task queue for shard tasks.
+    Returns:
+      A finalized tasks.TaskManager with one task per shard.
+    """
+    task_manager = tasks.TaskManager.new(
+        group=TASK_MANAGER_GROUP, description=description,
+        broadcast_channel_key=broadcast_channel_key, queue=queue)
+    for i, (start_path, end_path) in enumerate(self._compute_shards()):
+      task_manager.defer_task(
+          'shard-%d' % i, _map_shard, self, start_path, end_path)
+    task_manager.finalize()
+    return task_manager
+
+  @property
+  def _is_sharded(self):
+    return self.recursive and self.depth is None
+
+  def _make_query(self, start_path=None, end_path=None):
+    """Makes the listing query, limited to the keys in [start_path, end_path).
+
+    Raises:
+      ValueError: If given invalid query arguments.
+    """
+    if not self._is_sharded:
+      return files._create_files_query(
+          self.dir_path, namespace=self.namespace, recursive=self.recursive,
+          depth=self.depth, filters=self.filters)
+    # Key ranges only combine with a key range scan of the whole tree.
+    files_query = files._create_key_range_query(
+        self.dir_path, namespace=self.namespace, filters=self.filters)
+    if start_path is not None:
+      files_query = files_query.filter(files._TitanFile.key >= ndb.Key(
+          files._TitanFile, start_path, namespace=self.namespace))
+    if end_path is not None:
+      files_query = files_query.filter(files._TitanFile.key < ndb.Key(
+          files._TitanFile, end_path, namespace=self.namespace))
+    return files_query
+
+  def _compute_shards(self):
+    """Returns a list of (start_path, end_path) pairs covering the listing."""
+    if not self._is_sharded:
+      return [(None, None)]
+    # Split at evenly spaced keys among a random sample, like
+    # dirs.DirInitializer. Only the sampled keys under dir_path are used.
+    sample_paths = sorted(
+        path for path in self._sample_file_paths(
+            self.num_shards * _SCATTER_OVERSAMPLING)
+        if files._is_path_under(path, self.dir_path))
+    boundaries = set()
+    for i in range(1, self.num_shards):
+      index = i * len(sample_paths) // self.num_shards
+      if index < len(sample_paths):
+        boundaries.add(sample_paths[index])
+    boundaries = [None] + sorted(boundaries) + [None]
+    return zip(boundaries[:-1], boundaries[1:])
+
+  def _sample_file_paths(self, num_samples):
+    """Returns the paths of a random sample of files in the namespace."""
+    scatter_query = files._TitanFile.query(namespace=self.namespace).order(
+        ndb.GenericProperty('__scatter__'))
+    return [key.id() for key in scatter_query.fetch(num_samples,
+                                                    keys_only=True)]
+
+  def _run_shard(self, start_path=None, end_path=None):
+    """Map over every file in one key range."""
+    files_query = self._make_query(start_path=start_path, end_path=end_path)
+    cursor = None
+    results = []
+    num_files = 0
+    while True:
+      file_ents = []
+      query_iter = files_query.iter(
+          start_cursor=cursor, batch_size=self.batch_size,
+          produce_cursors=True)
+      for file_ent in query_iter:
+        file_ents.append(file_ent)
+        if len(file_ents) == self.batch_size:
+          break
+      if not file_ents:
+        break
+      for file_ent in file_ents:
+        titan_file = files.File(
+            file_ent.path, namespace=self.namespace, _file_ent=file_ent,
+            **self.file_kwargs)
+        result = self.map(titan_file)
+        if result is not None:
+          results.append(result)
+      self.flush()
+      num_files += len(file_ents)
+      if len(file_ents) < self.batch_size:
+        break
+      cursor = query_iter.cursor_after()
+
+    logging.info('Mapped %d files in shard [%r, %r).',
+                 num_files, start_path, end_path)
+    if self.reduce_processor is not None and results:
+      pipelines.push(self.reduce_name, self.reduce_processor, data=results)
+    return results
+
+# This must be module-level for pickling.
+def _map_shard(file_mapper, start_path, end_path):
+  file_mapper._run_shard(start_path=start_path, end_path=end_path)
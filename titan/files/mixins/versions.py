@@ -545,11 +545,14 @@ class Changeset(object):
 
   def _get_manifest_shard_ent(self, path):
     """Get the shard entity which may contain the given path."""
-    shard_index = _get_manifest_shard_index(path, self._num_manifest_shards)
-    shard_id = _make_manifest_shard_id(self, shard_index)
-    parent = _ChangesetManifestShard.get_root_key(
-        final_changeset_num=self.num, namespace=self.namespace)
-    return _ChangesetManifestShard.get_by_id(id=shard_id, parent=parent)
+    shard_ids = self.changeset_ent.manifest_shard_ids
+    if shard_ids:
+      shard_id = shard_ids[_get_manifest_shard_index(path, len(shard_ids))]
+    else:
+      # Manifest saved before shard-pointer tables: shards of this changeset.
+      shard_index = _get_manifest_shard_index(path, self._num_manifest_shards)
+      shard_id = _make_manifest_shard_id(self, shard_index)
+    return _make_manifest_shard_key(shard_id, namespace=self.namespace).get()
 
   def get_file_from_manifest(self, path, **kwargs):
     """Gets a file through the manifest.
@@ -879,6 +882,12 @@ class _Changeset(ndb.Model):
     base_changeset: A reference to the current base for staging changesets.
     num_manifest_shards: The number of shards of the filesystem manifest. Only
         set for final changesets and only if the manifest was saved.
+    manifest_shard_ids: The shard-pointer table of the manifest. A path's
+        shard ID is at the index of its hash modulo the table size, which is
+        always a power of 2. Shards which didn't change are shared with
+        previous changesets, and several slots may point to the same shard.
+        Empty for manifests saved before this property existed, which only
+        have num_manifest_shards shards of their own.
   """
   # NOTE: This model should be kept as lightweight as possible. Anything
   # else added here increases the amount of time that commit() will take,
@@ -894,6 +903,7 @@ class _Changeset(ndb.Model):
   linked_changeset = ndb.KeyProperty(kind='_Changeset')
   base_changeset = ndb.KeyProperty(kind='_Changeset')
   num_manifest_shards = ndb.IntegerProperty()
+  manifest_shard_ids = ndb.StringProperty(repeated=True, indexed=False)
 
   def __repr__(self):
     return ('<_Changeset %d namespace:%r status:%s base_changeset:%r '
@@ -1286,16 +1296,26 @@ class VersionControlService(object):
     self._verify_staging_changeset_ready_for_commit(
         namespace, staging_changeset, save_manifest=save_manifest)
 
-    transaction_func = (
-        lambda: self._commit(staging_changeset, staged_files, save_manifest))
+    # Only fetch the base manifest shards which contain staged paths. Each
+    # shard is in the entity group of the changeset which wrote it, so they
+    # are fetched outside of the xg-transaction. Manifest shards are never
+    # modified, and the transaction re-verifies the base_changeset.
+    base_manifest = None
+    if save_manifest:
+      base_manifest = _fetch_base_manifest(
+          staging_changeset.base_changeset, staged_files.keys())
+
+    transaction_func = lambda: self._commit(
+        staging_changeset, staged_files, save_manifest,
+        base_manifest=base_manifest)
     final_changeset = ndb.transaction(transaction_func, xg=True)
     return final_changeset
 
-  def _commit(self, staging_changeset, staged_files, save_manifest):
+  def _commit(self, staging_changeset, staged_files, save_manifest,
+              base_manifest=None):
     """Commit a staged changeset."""
     # Fail if rebase is needed or the base manifest is missing and needed.
     namespace = staging_changeset.namespace
-    base_changeset = staging_changeset.base_changeset
     self._verify_staging_changeset_ready_for_commit(
         namespace, staging_changeset, save_manifest=save_manifest)
 
@@ -1312,44 +1332,21 @@ class VersionControlService(object):
         staging_changeset.num, namespace, final_changeset.num,
         len(staged_files), '\n'.join(changes))
 
-    # Copy the manifest data from the base_changeset to the final_changeset.
-    # TODO(user): optimize this by pulling the data reading for small
-    # manifests out of the commit path.
+    # Write new manifest shards only for the shards with changed paths; the
+    # shard-pointer table references all other shards from the base manifest.
     new_manifest_shards = []
     if save_manifest:
-      new_manifest = {}
-      # If this isn't the first-ever committed changeset, copy the old manifest.
-      if staging_changeset.base_changeset:
-        full_manifest = _fetch_full_manifest(base_changeset)
-        new_manifest.update(full_manifest)
-
+      changes = {}
       for staged_file in staged_files.itervalues():
         if staged_file.meta.status == FileStatus.deleted:
           # Remove from new manifest if it existed in previous manifests.
-          new_manifest.pop(staged_file.path, None)
+          changes[staged_file.path] = None
         else:
           # New file or edited file: point to the current final_changeset.
-          new_manifest[staged_file.path] = final_changeset.num
-
-      # Split up the new_manifest into shards by hashing each path and modding
-      # it into the right bucket. Hashing the paths provides a relatively even
-      # distribution over the available buckets, and also provides a
-      # deterministic O(1) way to know which manifest shard a path may exist in.
-      num_manifest_shards = len(new_manifest) / _MAX_MANIFEST_SHARD_PATHS + 1
-      manifest_buckets = [{}] * num_manifest_shards
-      while new_manifest:
-        path, changeset_num = new_manifest.popitem()
-        index = _get_manifest_shard_index(path, num_manifest_shards)
-        manifest_buckets[index][path] = changeset_num
-
-      # Create the new manifest entities.
-      parent = _ChangesetManifestShard.get_root_key(
-          final_changeset_num=final_changeset.num, namespace=namespace)
-      for i, manifest_bucket in enumerate(manifest_buckets):
-        shard_ent = _ChangesetManifestShard(
-            id=_make_manifest_shard_id(final_changeset, i),
-            paths_to_changeset_num=manifest_bucket, parent=parent)
-        new_manifest_shards.append(shard_ent)
+          changes[staged_file.path] = final_changeset.num
+      base_shard_ids, base_shards = base_manifest
+      manifest_shard_ids, new_manifest_shards = _make_manifest_shards(
+          final_changeset, base_shard_ids, base_shards, changes)
 
     # Update status of the staging and final changesets.
     staging_changeset_ent = staging_changeset.changeset_ent
@@ -1359,7 +1356,8 @@ class VersionControlService(object):
     final_changeset_ent.status = ChangesetStatus.submitted
     final_changeset_ent.linked_changeset = staging_changeset.changeset_ent.key
     if save_manifest:
-      final_changeset_ent.num_manifest_shards = num_manifest_shards
+      final_changeset_ent.manifest_shard_ids = manifest_shard_ids
+      final_changeset_ent.num_manifest_shards = len(set(manifest_shard_ids))
     ndb.put_multi([
         staging_changeset_ent,
         final_changeset_ent,
@@ -1440,27 +1438,140 @@ class VersionControlService(object):
 
     return final_changeset
 
+def _get_manifest_path_hash(path):
+  return int(hashlib.md5(path).hexdigest(), 16)
+
 def _get_manifest_shard_index(path, num_manifest_shards):
-  path_hash_num = int(hashlib.md5(path).hexdigest(), 16)
-  return path_hash_num % num_manifest_shards
+  return _get_manifest_path_hash(path) % num_manifest_shards
 
 def _make_manifest_shard_keys(changeset):
   """Gets a list of ndb.Key objects for all of a changeset's manifest shards."""
-  num_shards = changeset._num_manifest_shards
-  namespace = changeset.namespace
-  ids = [_make_manifest_shard_id(changeset, i) for i in range(num_shards)]
-  keys = []
+  shard_ids = []
+  for shard_id in changeset.changeset_ent.manifest_shard_ids or [
+      _make_manifest_shard_id(changeset, i)
+      for i in range(changeset._num_manifest_shards)]:
+    if shard_id not in shard_ids:
+      shard_ids.append(shard_id)
+  return [_make_manifest_shard_key(shard_id, namespace=changeset.namespace)
+          for shard_id in shard_ids]
+
+def _make_manifest_shard_key(shard_id, namespace):
+  # Each shard is grouped with the other shards written by its changeset.
   parent = _ChangesetManifestShard.get_root_key(
-      changeset.num, namespace=namespace)
-  for shard_id in ids:
-    shard_key = ndb.Key(
-        _ChangesetManifestShard, shard_id, namespace=namespace, parent=parent)
-    keys.append(shard_key)
-  return keys
+      int(shard_id.split(':')[0]), namespace=namespace)
+  return ndb.Key(
+      _ChangesetManifestShard, shard_id, namespace=namespace, parent=parent)
 
 def _make_manifest_shard_id(changeset, shard_index):
   return '{:d}:{:d}'.format(changeset.num, shard_index)
 
+def _fetch_base_manifest(base_changeset, paths):
+  """Fetch the parts of a base manifest needed to change the given paths.
+
+  Args:
+    base_changeset: The submitted base Changeset, or None.
+    paths: An iterable of paths which will change.
+  Raises:
+    CommitError: If a manifest shard is missing.
+  Returns:
+    A two-tuple of the base shard-pointer table and a dictionary of shard IDs
+    to the paths_to_changeset_num of only the shards containing the paths.
+    Without a base_changeset, this is an empty manifest. For manifests saved
+    before shard-pointer tables, this is a single shard of the full manifest,
+    so it is re-sharded once.
+  """
+  if not base_changeset:
+    return [None], {None: {}}
+  shard_ids = base_changeset.changeset_ent.manifest_shard_ids
+  if not shard_ids:
+    return [None], {None: _fetch_full_manifest(base_changeset)}
+
+  needed_shard_ids = set(
+      shard_ids[_get_manifest_shard_index(path, len(shard_ids))]
+      for path in paths)
+  needed_shard_ids = list(needed_shard_ids)
+  manifest_shards = ndb.get_multi([
+      _make_manifest_shard_key(shard_id, namespace=base_changeset.namespace)
+      for shard_id in needed_shard_ids])
+  if not all(manifest_shards):
+    raise CommitError(
+        'Expected complete manifest shards, but got: {!r}'.format(
+            manifest_shards))
+  return shard_ids, dict(
+      (shard_id, shard.paths_to_changeset_num)
+      for shard_id, shard in zip(needed_shard_ids, manifest_shards))
+
+def _make_manifest_shards(final_changeset, shard_ids, base_shards, changes):
+  """Make the shard-pointer table and new shards of a changed manifest.
+
+  Only shards containing changed paths are rewritten. Shards which grow over
+  _MAX_MANIFEST_SHARD_PATHS are split in two by the next bit of the path
+  hashes, doubling the table when needed. Doubling only copies pointers, so
+  no path in any other shard moves.
+
+  Args:
+    final_changeset: The Changeset which the new shards belong to.
+    shard_ids: The base shard-pointer table.
+    base_shards: A dictionary of base shard IDs to paths_to_changeset_num,
+        containing at least the shards of the changed paths.
+    changes: A dictionary of changed paths to their new changeset number, or
+        to None if deleted.
+  Returns:
+    A two-tuple of the new shard-pointer table and the list of new
+    _ChangesetManifestShard entities.
+  """
+  shard_ids = list(shard_ids)
+  changed_shards = {}
+  for path, changeset_num in changes.iteritems():
+    shard_id = shard_ids[_get_manifest_shard_index(path, len(shard_ids))]
+    if shard_id not in changed_shards:
+      changed_shards[shard_id] = dict(base_shards[shard_id])
+    if changeset_num is None:
+      changed_shards[shard_id].pop(path, None)
+    else:
+      changed_shards[shard_id][path] = changeset_num
+
+  # Two-tuples of (paths_to_changeset_num, indexes of slots pointing to it).
+  pending_shards = []
+  for shard_id, paths_to_changeset_num in changed_shards.iteritems():
+    slots = [i for i, other_id in enumerate(shard_ids) if other_id == shard_id]
+    pending_shards.append((paths_to_changeset_num, slots))
+  new_shards = []
+  while pending_shards:
+    paths_to_changeset_num, slots = pending_shards.pop()
+    if len(paths_to_changeset_num) <= _MAX_MANIFEST_SHARD_PATHS:
+      new_shards.append((paths_to_changeset_num, slots))
+      continue
+    if len(slots) == 1:
+      # The shard already uses every hash bit of the table; double it.
+      num_slots = len(shard_ids)
+      shard_ids.extend(shard_ids)
+      pending_shards = [(p, s + [i + num_slots for i in s])
+                        for p, s in pending_shards]
+      new_shards = [(p, s + [i + num_slots for i in s]) for p, s in new_shards]
+      slots = slots + [slots[0] + num_slots]
+    # All slots of a shard share the hash bits below this one.
+    split_bit = len(shard_ids) // len(slots)
+    for bit_value in (0, split_bit):
+      pending_shards.append((
+          dict((path, changeset_num)
+               for path, changeset_num in paths_to_changeset_num.iteritems()
+               if _get_manifest_path_hash(path) & split_bit == bit_value),
+          [i for i in slots if i & split_bit == bit_value]))
+
+  parent = _ChangesetManifestShard.get_root_key(
+      final_changeset_num=final_changeset.num,
+      namespace=final_changeset.namespace)
+  shard_ents = []
+  for shard_index, (paths_to_changeset_num, slots) in enumerate(new_shards):
+    shard_id = _make_manifest_shard_id(final_changeset, shard_index)
+    for i in slots:
+      shard_ids[i] = shard_id
+    shard_ents.append(_ChangesetManifestShard(
+        id=shard_id, paths_to_changeset_num=paths_to_changeset_num,
+        parent=parent))
+  return shard_ids, shard_ents
+
 def _make_versioned_path(path, changeset):
   """Return a two-tuple of (versioned paths, is_multiple)."""
   # Make sure we're not accidentally using non-strings,
@@ -203,6 +203,92 @@ class DownloadCommand(BaseCommand):
         target_dir=target,
     )
 
+class ExportCommand(BaseCommand):
+  """Exports a remote directory tree to a local tar.gz archive.
+
+  Usage:
+    export --dir_path=<remote directory path> <local archive filename>
+  """
+
+  def __init__(self, name, flag_values, **kwargs):
+    super(ExportCommand, self).__init__(name, flag_values, **kwargs)
+    flags.DEFINE_string(
+        'dir_path', None,
+        'Remote directory to export.',
+        flag_values=flag_values)
+    flags.DEFINE_bool(
+        'recursive', True,
+        'Exports the directory recursively.',
+        flag_values=flag_values)
+    flags.DEFINE_integer(
+        'depth', None,
+        'Specifies recursion depth if "recursive" is specified.',
+        flag_values=flag_values)
+    flags.DEFINE_string(
+        'namespace', None,
+        'Remote filesystem namespace.',
+        flag_values=flag_values)
+
+  def Run(self, argv):
+    """Command runner."""
+    if len(argv) != 2 or not FLAGS.dir_path or not FLAGS.host:
+      sys.exit('Usage: --host=example.com '
+               'export --dir_path=<remote dir> <local archive filename>')
+
+    export_runner = titanfiles_runners.ExportRunner(
+        host=FLAGS.host,
+        port=FLAGS.port,
+        remote_file_factory=self.remote_file_factory,
+        api_base_path=FLAGS.api_base_path,
+        force=FLAGS.force,
+        secure=not FLAGS.insecure,
+    )
+    export_runner.Run(
+        dir_path=FLAGS.dir_path,
+        target=argv[1],
+        recursive=FLAGS.recursive,
+        depth=FLAGS.depth,
+        namespace=FLAGS.namespace,
+    )
+
+class ImportCommand(BaseCommand):
+  """Imports a local tar.gz archive created by "export".
+
+  Usage:
+    import [--target_path=/] <local archive filename>
+  """
+
+  def __init__(self, name, flag_values, **kwargs):
+    super(ImportCommand, self).__init__(name, flag_values, **kwargs)
+    flags.DEFINE_string(
+        'target_path', '/',
+        'Remote root target path for imported files.',
+        flag_values=flag_values)
+    flags.DEFINE_string(
+        'namespace', None,
+        'Remote filesystem namespace.',
+        flag_values=flag_values)
+
+  def Run(self, argv):
+    """Command runner."""
+    if len(argv) != 2 or not FLAGS.host:
+      sys.exit('Usage: --host=example.com '
+               'import [--target_path=/] <local archive filename>')
+
+    import_runner = titanfiles_runners.ImportRunner(
+        host=FLAGS.host,
+        port=FLAGS.port,
+        remote_file_factory=self.remote_file_factory,
+        api_base_path=FLAGS.api_base_path,
+        force=FLAGS.force,
+        secure=not FLAGS.insecure,
+    )
+    import_runner.Run(
+        filename=argv[1],
+        target_path=FLAGS.target_path,
+        namespace=FLAGS.namespace,
+    )
+
 class CommitCommand(BaseCommand):
   """Commit a versions Changeset.
 
@@ -251,6 +337,8 @@ def main(unused_argv):
   appcommands.AddCmd('upload', UploadCommand)
   appcommands.AddCmd('commit', CommitCommand)
   appcommands.AddCmd('download', DownloadCommand)
+  appcommands.AddCmd('export', ExportCommand)
+  appcommands.AddCmd('import', ImportCommand)
 
 if __name__ == '__main__':
   appcommands.Run()
@@ -335,6 +335,63 @@ class DownloadRunner(BaseRunner):
       fp.close()
     return {'path': remote_file.path, 'target': target}
 
+class ExportRunner(BaseRunner):
+  """Exports a remote directory tree to a local tar.gz archive."""
+
+  def Run(self, dir_path, target, recursive=True, depth=None,
+          namespace=None):
+    """Export runner.
+
+    Args:
+      dir_path: The remote directory to export.
+      target: The local archive filename to write.
+      recursive: Whether or not to export the directory recursively.
+      depth: Depth of recursion if specified.
+      namespace: The remote filesystem namespace.
+    """
+    if os.path.exists(target) and not self.confirm(
+        'Overwrite %s?' % target):
+      sys.exit('Export aborted.')
+
+    start = time.time()
+    self.remote_file_factory.validate_client_auth()
+    remote_files = self.remote_file_factory.make_remote_files(paths=[])
+    with open(target, 'wb') as fp:
+      num_files = remote_files.export_archive(
+          dir_path, fp, recursive=recursive, depth=depth, namespace=namespace)
+    elapsed_time = time.time() - start
+    print 'Exported %d files from %s to %s (%d bytes) in %s.' % (
+        num_files, dir_path, target, os.path.getsize(target),
+        utils.humanize_duration(elapsed_time))
+
+class ImportRunner(BaseRunner):
+  """Imports a local tar.gz archive into a remote directory."""
+
+  def Run(self, filename, target_path='/', namespace=None):
+    """Import runner.
+
+    Args:
+      filename: The local archive filename, as created by ExportRunner.
+      target_path: The remote directory to import files into.
+      namespace: The remote filesystem namespace.
+    Returns:
+      A list of the imported remote paths.
+    """
+    msg = 'Import %s into %s on %s?' % (filename, target_path, self.host)
+    if not self.confirm(msg):
+      sys.exit('Import aborted.')
+
+    start = time.time()
+    self.remote_file_factory.validate_client_auth()
+    remote_files = self.remote_file_factory.make_remote_files(paths=[])
+    with open(filename, 'rb') as fp:
+      paths = remote_files.import_archive(
+          fp, dir_path=target_path, namespace=namespace)
+    elapsed_time = time.time() - start
+    print 'Imported %d files in %s.' % (
+        len(paths), utils.humanize_duration(elapsed_time))
+    return paths
+
 class CommitRunner(BaseRunnerWithVersions):
 
   def Run(self, changeset, force_commit=False, manifest=None,
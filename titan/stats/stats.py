@@ -466,14 +466,16 @@ class _BatchProcessor(activities.BaseProcessor):
 
       # Aggregate the counter data into each counter object.
       for counter_name, counter_value in data['counters'].iteritems():
-        try:
-          self.window_counters[window][counter_name].aggregate(counter_value)
-          self.window_counters_available[window].add(counter_name)
-        except KeyError:
-          logging.error('Counter named "%s" is not configured! Discarding '
-                        'counter task data... fix this by adding the counter '
-                        'to the objects created in the `counters_func`.',
-                        counter_name)
+        if counter_name not in self.window_counters[window]:
+          # Only one counters_func is used per batch, so counters logged by
+          # other code (such as sharded_cache) may be missing from it.
+          logging.info('Counter named "%s" is not configured in the '
+                       '`counters_func`; inferring its type from its data.',
+                       counter_name)
+          self.window_counters[window][counter_name] = _make_inferred_counter(
+              counter_name, counter_value)
+        self.window_counters[window][counter_name].aggregate(counter_value)
+        self.window_counters_available[window].add(counter_name)
 
   def _init_counters(self, window):
     self.window_counters[window] = {}
@@ -607,6 +609,13 @@ def log_counters(counters, counters_func):
     activities.process_activity_loggers()
   return activity
 
+def _make_inferred_counter(counter_name, counter_value):
+  """Makes a counter for data of a counter missing from a counters_func."""
+  # Average counters finalize to (value, weight) pairs, lists once in JSON.
+  if isinstance(counter_value, (list, tuple)):
+    return AverageCounter(counter_name)
+  return Counter(counter_name)
+
 def _get_window(timestamp, window_size=DEFAULT_WINDOW_SIZE):
   """Get the aggregation window for the given unix time and window size."""
   return int(window_size * round(float(timestamp) / window_size))